@@ -3,33 +3,129 @@
 from flask import Flask, render_template, request, jsonify, send_file
 import os
 import diptych_creator
+import event_stream
+import job_store
+import metadata_index
+import render_spool
+import resource_governor
+import state_backend
 import zipfile
 from datetime import datetime
 import io
 import logging
 import time
-from PIL import Image, ExifTags, ImageColor
+from PIL import Image, ExifTags
 import threading
 import shutil
 from werkzeug.utils import secure_filename
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import queue
 import uuid
 import random
 import colorsys
+import hashlib
+import json
+import re
 
 # Configure Flask to look in the `review_app` folder for templates and static assets.
 app = Flask(__name__, template_folder='review_app/templates', static_folder='review_app/static')
 logger = logging.getLogger(__name__)
 
 # --- App Configuration & Caching ---
-BASE_CACHE_DIR = os.path.join(os.path.dirname(__file__), '.cache')
+# Uploads, proxies and indexes live here; DIPTYCH_CACHE_DIR moves them out
+# of the checkout (the tests point it at a temporary directory).
+BASE_CACHE_DIR = os.environ.get('DIPTYCH_CACHE_DIR') or os.path.join(os.path.dirname(__file__), '.cache')
 UPLOAD_DIR = os.path.join(BASE_CACHE_DIR, 'uploads')
+# Upload bytes are stored once per SHA-256 here; files in UPLOAD_DIR are
+# hard-link aliases carrying the user-facing names.
+OBJECT_DIR = os.path.join(BASE_CACHE_DIR, 'objects')
+# Partially received files of chunked upload sessions.
+UPLOAD_SESSION_DIR = os.path.join(BASE_CACHE_DIR, 'upload_sessions')
 THUMB_CACHE_DIR = os.path.join(BASE_CACHE_DIR, 'thumbnails')
+# Larger levels of each upload's proxy pyramid; the smallest level is the
+# thumbnail in THUMB_CACHE_DIR.
+PROXY_CACHE_DIR = os.path.join(BASE_CACHE_DIR, 'proxies')
+# Per-upload metadata used by auto grouping (see metadata_index).
+METADATA_DB_PATH = os.path.join(BASE_CACHE_DIR, 'metadata.sqlite3')
+# Jobs, download handles, the diptych order, upload times, upload sessions
+# and ingest outcomes live in a state backend (see state_backend). DIPTYCH_STATE_DB names a SQLite file shared
+# by several server processes on one host; unset keeps them in memory.
+STATE_DB_PATH = os.environ.get('DIPTYCH_STATE_DB') or None
+state = state_backend.open_backend(STATE_DB_PATH)
 # Save generated diptychs into the user's Downloads folder so they are easy to find.
 OUTPUT_DIR_BASE = os.path.join(os.path.expanduser("~"), "Downloads")
 
-# Use a thread pool for background tasks
-executor = ThreadPoolExecutor(max_workers=4)
+# serve.py can run DIPTYCH_SERVE_WORKERS copies of this process on one host.
+# The memory budget and pool sizes below are totals for the host, so each
+# process takes its share of them.
+SERVE_WORKERS = max(1, int(os.environ.get('DIPTYCH_SERVE_WORKERS', 1)))
+
+def serve_worker_share(total):
+    """Return this process's part of a host-wide pool size."""
+    return max(1, int(total) // SERVE_WORKERS)
+
+# Each open event stream (/thumbnail_events, /generation_events) holds one
+# server thread for as long as the page is open. At most this many run at
+# once per process, so the other threads stay free for requests; clients
+# turned away poll instead. Defaults to half of serve.py's threads.
+MAX_EVENT_STREAMS = max(1, int(os.environ.get(
+    'DIPTYCH_MAX_EVENT_STREAMS',
+    int(os.environ.get('DIPTYCH_SERVE_THREADS', 32)) // 2,
+)))
+event_stream_slots = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+
+# Final renders are CPU bound, so each diptych is rendered in a separate
+# process. The pool is created on first use so importing the app stays cheap.
+GENERATION_WORKERS = serve_worker_share(os.environ.get('DIPTYCH_GENERATION_WORKERS', os.cpu_count() or 1))
+# Render processes run at this much lower CPU priority (nice value) so batch
+# output gives way to previews and thumbnails in the server process.
+RENDER_NICENESS = int(os.environ.get('DIPTYCH_RENDER_NICE', 5))
+# With DIPTYCH_RENDER_SPOOL set, final renders are written as tasks to this
+# spool directory and rendered by separately started workers (see
+# render_spool) instead of the local process pool.
+RENDER_SPOOL_DIR = os.environ.get('DIPTYCH_RENDER_SPOOL') or None
+generation_executor: ProcessPoolExecutor | render_spool.SpoolExecutor | None = None
+# Outputs larger than this many pixels are rendered in strips on a memory-mapped
+# buffer instead of a full in-memory canvas (a 20x16 in print at 1200 DPI is
+# about 460 MP). Jobs can also opt in with the low_memory config flag.
+LOW_MEMORY_CANVAS_PIXELS = int(os.environ.get('DIPTYCH_LOW_MEMORY_PIXELS', 100_000_000))
+# Admission control: every preview and output render reserves its estimated
+# peak pixel memory before starting and waits in line when the budget is full.
+memory_governor = resource_governor.MemoryGovernor(resource_governor.default_memory_budget() // SERVE_WORKERS)
+# Each class of background work has its own thread pool so a long batch never
+# holds the threads interactive work needs. Defaults follow the CPU count and
+# the memory budget, assuming the per-worker peaks below.
+PREVIEW_WORKER_BYTES = 256 * 1024 * 1024
+INGEST_WORKER_BYTES = 512 * 1024 * 1024
+PREVIEW_WORKERS = serve_worker_share(os.environ.get(
+    'DIPTYCH_PREVIEW_WORKERS',
+    resource_governor.default_worker_count(PREVIEW_WORKER_BYTES),
+))
+INGEST_WORKERS = serve_worker_share(os.environ.get(
+    'DIPTYCH_INGEST_WORKERS',
+    resource_governor.default_worker_count(INGEST_WORKER_BYTES),
+))
+# Batch threads only queue renders for the process pool and collect results.
+BATCH_WORKERS = max(1, int(os.environ.get('DIPTYCH_BATCH_WORKERS', 2)))
+preview_executor = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS, thread_name_prefix='preview')
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='ingest')
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+# Interactive previews give up rather than wait behind long batch renders.
+PREVIEW_ADMISSION_TIMEOUT_SECONDS = 30
+# Encoded preview JPEGs keyed by preview_cache_key, bounded by
+# DIPTYCH_PREVIEW_CACHE_MB.
+preview_cache = diptych_creator.ByteBoundedLRU(
+    int(float(os.environ.get('DIPTYCH_PREVIEW_CACHE_MB', 64)) * 1024 * 1024)
+)
+# Viewport-sized previews are clamped to this many device pixels per edge.
+MAX_PREVIEW_EDGE_PX = 4096
+generation_executor_lock = threading.Lock()
+# One slot per render process. A batch item takes a slot before reserving
+# memory, so items queued behind busy processes hold no reservation that
+# previews would have to wait for.
+generation_slots = threading.Semaphore(GENERATION_WORKERS)
 
 # EXIF tag for original capture time
 DATE_TAGS = [
@@ -41,82 +137,240 @@ DATE_TAGS = [
 # with an error response. Extensions are case-insensitive and must be formats
 # Pillow can decode with the dependencies in requirements.txt.
 ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "tif", "tiff"}
-VALID_FIT_MODES = {"fill", "fit"}
-VALID_ORIENTATIONS = {"landscape", "portrait"}
+SHA256_PATTERN = re.compile(r'[0-9a-f]{64}')
 
 
 # --- Progress Tracking ---
 progress_data = {"processed": 0, "total": 0}
 progress_lock = threading.Lock()
-# Track current diptych order on the server so that client-side
-# reordering can be preserved across operations.
-diptych_order = []
-order_lock = threading.Lock()
-# Store outstanding preview jobs keyed by an ID
-preview_jobs: dict[str, dict] = {}
+# Ids of the generation jobs whose generation task runs in this process.
+running_generations: set[str] = set()
+# The current diptych order is kept as the state value 'diptych_order' so
+# that client-side reordering is preserved across operations.
+# Newest preview request per (client_id, target), guarded by preview_lock.
+# A newer request in the same group cancels the one it replaces.
+preview_groups: dict[tuple[str, str], dict] = {}
 preview_lock = threading.Lock()
-generation_jobs: dict[str, dict] = {}
-generation_lock = threading.Lock()
-current_generation_job_id: str | None = None
-download_registry: dict[str, str] = {}
-download_lock = threading.Lock()
+# The newest generation job id is kept as the state value 'current_generation_job'.
 # Track upload time for each file so auto grouping can fall back to the
 # actual upload moment rather than relying on the filesystem timestamp.
-UPLOAD_TIMES = {}
+UPLOAD_TIMES = state.mapping('upload_times', encode=datetime.timestamp, decode=datetime.fromtimestamp)
 # Lock to protect access to UPLOAD_TIMES in multi-threaded contexts
 upload_times_lock = threading.Lock()
+image_index = metadata_index.ImageMetadataIndex(METADATA_DB_PATH)
+# Uploads whose background decode failed, with the error, keyed by filename.
+ingest_failures = state.mapping('ingest_failures')
+# Library files referenced through a hard link because a symbolic link could
+# not be created (Windows without Developer Mode), keyed by filename.
+REFERENCE_SOURCES = state.mapping('reference_sources')
+ingest_failures_lock = threading.Lock()
+# Announces finished ingests ('ready') and failed ones ('failed') so the
+# pool can show thumbnails without polling (see /thumbnail_events).
+thumbnail_events = event_stream.EventLog(maxlen=10000)
+# Serializes choosing and creating upload alias names.
+alias_lock = threading.Lock()
+# Chunked upload sessions keyed by upload id (see /upload_sessions). Any
+# server process may receive a session's chunks, so received chunk indexes
+# are added with ``modify`` rather than by mutating a fetched session.
+upload_sessions = state.mapping(
+    'upload_sessions',
+    encode=lambda session: {**session, 'received': sorted(session['received'])},
+    decode=lambda session: {**session, 'received': set(session['received'])},
+)
+upload_sessions_lock = threading.Lock()
+# Size of each chunk in a chunked upload; the last chunk may be shorter.
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+# Largest file a chunked upload session may announce; its partial file is
+# preallocated to the announced size. Set with DIPTYCH_MAX_UPLOAD_MB.
+MAX_UPLOAD_BYTES = int(float(os.environ.get('DIPTYCH_MAX_UPLOAD_MB', 2048)) * 1024 * 1024)
+# Local folders whose files may be registered in place instead of uploaded
+# (see /register_local_files). Set with DIPTYCH_LIBRARY_DIRS, separated by
+# os.pathsep; empty disables reference ingest.
+LIBRARY_DIRS = [
+    os.path.realpath(path)
+    for path in os.environ.get('DIPTYCH_LIBRARY_DIRS', '').split(os.pathsep)
+    if path.strip()
+]
+# Referenced files whose ingest is queued or running, with the time it was queued.
+pending_reference_ingests = state.mapping('pending_reference_ingests')
+pending_reference_lock = threading.Lock()
 
 # Files older than this many seconds will be removed from the upload and thumbnail
 # caches automatically.  This prevents long-running sessions from consuming
 # unlimited disk space.  Default: 8 hours.
 MAX_FILE_AGE_SECONDS = 8 * 3600
+# Unreferenced cache files younger than this may still be being written.
+ORPHAN_GRACE_SECONDS = 600
 cleanup_thread: threading.Thread | None = None
+# How long /finalize_download waits for a job that is still closing its archive.
+FINALIZE_WAIT_SECONDS = 30
+
+# --- Job Stores ---
+# Job records are kept in bounded stores from the state backend instead of
+# plain dicts. In memory, preview JPEGs are payloads: large ones, and
+# whatever exceeds DIPTYCH_PREVIEW_JOBS_MB, spill to JOB_SPILL_DIR. Callers
+# publish changes to a record with ``save`` so other processes see them.
+JOB_SPILL_DIR = os.path.join(BASE_CACHE_DIR, 'jobs')
+PREVIEW_JOB_TTL_SECONDS = 15 * 60
+# Asynchronous preview jobs keyed by job id; pending and running jobs are
+# never evicted.
+preview_jobs = state.store(
+    'preview_jobs',
+    max_entries=256,
+    max_bytes=int(float(os.environ.get('DIPTYCH_PREVIEW_JOBS_MB', 32)) * 1024 * 1024),
+    ttl_seconds=PREVIEW_JOB_TTL_SECONDS,
+    spill_dir=JOB_SPILL_DIR,
+    spill_bytes=2 * 1024 * 1024,
+    evictable=lambda job: job['status'] not in ('pending', 'running'),
+)
+# Generation progress entries and their event logs, kept while running.
+generation_jobs = state.store(
+    'generation_jobs',
+    max_entries=64,
+    ttl_seconds=MAX_FILE_AGE_SECONDS,
+    evictable=lambda job: job.get('done'),
+)
+# Per-job progress events (see /generation_events), served by the process
+# running the job; clients elsewhere fall back to polling.
+generation_events = job_store.JobStore(
+    max_entries=64,
+    ttl_seconds=MAX_FILE_AGE_SECONDS,
+    evictable=lambda events: events.closed,
+)
+# Download handles (id -> output path) issued by /finalize_download.
+download_registry = state.store('downloads', max_entries=1024, ttl_seconds=MAX_FILE_AGE_SECONDS)
 
 def ensure_cache_dirs() -> None:
     """Create runtime cache directories without deleting user session data."""
     os.makedirs(UPLOAD_DIR, exist_ok=True)
     os.makedirs(THUMB_CACHE_DIR, exist_ok=True)
+    os.makedirs(PROXY_CACHE_DIR, exist_ok=True)
+    os.makedirs(OBJECT_DIR, exist_ok=True)
+    os.makedirs(UPLOAD_SESSION_DIR, exist_ok=True)
+    os.makedirs(JOB_SPILL_DIR, exist_ok=True)
 
 def reset_cache() -> None:
     """Clear transient runtime caches for an explicit local app startup."""
+    image_index.close()
+    state.close()
     if os.path.exists(BASE_CACHE_DIR):
         shutil.rmtree(BASE_CACHE_DIR)
     ensure_cache_dirs()
 
 ensure_cache_dirs()
 
+def cleanup_stored_files(now):
+    """
+    Delete expired uploads and whatever no longer belongs to a live upload.
+
+    Uploads expire MAX_FILE_AGE_SECONDS after they were last uploaded, which
+    is tracked separately from the mtime because an alias shares its inode
+    (and so its mtime) with older aliases of the same content. References
+    to local library files are unlinked the same way, or as soon as their
+    target is gone; the library files themselves are never touched.
+    Thumbnails and proxies are removed once their upload is gone, stored
+    objects once no alias links to them, partial chunked-upload files once
+    their session is gone, and spilled job payloads once their job is.
+    """
+    ensure_cache_dirs()
+    for fname in os.listdir(UPLOAD_DIR):
+        fpath = os.path.join(UPLOAD_DIR, fname)
+        try:
+            source = reference_source(fpath)
+            if source is not None and not os.path.exists(source):
+                discard_upload(fname)
+                continue
+            if not os.path.isfile(fpath):
+                continue
+            last_used = os.path.getmtime(fpath)
+            row = image_index.get(fname)
+            if row and row.get('uploaded_at'):
+                last_used = max(last_used, row['uploaded_at'])
+            with upload_times_lock:
+                if fname in UPLOAD_TIMES:
+                    last_used = max(last_used, UPLOAD_TIMES[fname].timestamp())
+            if now - last_used > MAX_FILE_AGE_SECONDS:
+                os.remove(fpath)
+                REFERENCE_SOURCES.pop(fname, None)
+                # Remove from upload times if present
+                with upload_times_lock:
+                    UPLOAD_TIMES.pop(fname, None)
+        except Exception:
+            logger.exception("Failed cleaning cache file %s", fpath)
+    live = {
+        path
+        for fname in os.listdir(UPLOAD_DIR)
+        for path in proxy_level_paths(fname).values()
+    }
+    with upload_sessions_lock:
+        live.update(session['path'] for session in upload_sessions.values())
+    live.update(preview_jobs.spilled_paths())
+    for directory in [THUMB_CACHE_DIR, PROXY_CACHE_DIR, OBJECT_DIR, UPLOAD_SESSION_DIR, JOB_SPILL_DIR]:
+        for fname in os.listdir(directory):
+            fpath = os.path.join(directory, fname)
+            try:
+                stat = os.stat(fpath)
+                if directory == OBJECT_DIR and not fname.endswith('.part'):
+                    orphaned = stat.st_nlink <= 1
+                else:
+                    orphaned = fpath not in live
+                # Leave files alone briefly so in-flight writes can finish.
+                if orphaned and now - stat.st_mtime > ORPHAN_GRACE_SECONDS:
+                    os.remove(fpath)
+            except Exception:
+                logger.exception("Failed cleaning cache file %s", fpath)
+
 def cleanup_task():
-    """Background cleanup thread that deletes old uploads and thumbnails."""
+    """Background cleanup thread that deletes old uploads, thumbnails and proxies."""
     while True:
         try:
             now = time.time()
-            ensure_cache_dirs()
-            for directory in [UPLOAD_DIR, THUMB_CACHE_DIR]:
-                for fname in os.listdir(directory):
-                    fpath = os.path.join(directory, fname)
-                    try:
-                        if os.path.isfile(fpath):
-                            age = now - os.path.getmtime(fpath)
-                            if age > MAX_FILE_AGE_SECONDS:
-                                os.remove(fpath)
-                                # Remove from upload times if present
-                                with upload_times_lock:
-                                    UPLOAD_TIMES.pop(fname, None)
-                    except Exception:
-                        logger.exception("Failed cleaning cache file %s", fpath)
+            cleanup_stored_files(now)
+            for store in (preview_jobs, generation_jobs, generation_events, download_registry):
+                store.purge()
+            if RENDER_SPOOL_DIR:
+                render_spool.RenderSpool(RENDER_SPOOL_DIR).purge_results(MAX_FILE_AGE_SECONDS, now)
             with preview_lock:
-                expired = [
-                    job_id for job_id, job in preview_jobs.items()
-                    if now - job.get('created_at', now) > MAX_FILE_AGE_SECONDS
+                for group, job in list(preview_groups.items()):
+                    if now - job.get('created_at', now) > PREVIEW_JOB_TTL_SECONDS:
+                        preview_groups.pop(group, None)
+            with upload_sessions_lock:
+                stale = [
+                    upload_id for upload_id, session in upload_sessions.items()
+                    if now - session['updated_at'] > MAX_FILE_AGE_SECONDS
                 ]
-                for job_id in expired:
-                    preview_jobs.pop(job_id, None)
+                for upload_id in stale:
+                    remove_file(upload_sessions.pop(upload_id)['path'])
         except Exception:
             logger.exception("Background cleanup task failed")
         # Sleep for 10 minutes between cleanups
         time.sleep(600)
 
 # --- Helper Functions ---
+def get_generation_executor() -> ProcessPoolExecutor | render_spool.SpoolExecutor:
+    """Return the shared render process pool (or spool), creating it on first use."""
+    global generation_executor
+    with generation_executor_lock:
+        if generation_executor is None and RENDER_SPOOL_DIR:
+            generation_executor = render_spool.SpoolExecutor(render_spool.RenderSpool(RENDER_SPOOL_DIR))
+        elif generation_executor is None:
+            # Spawn keeps workers independent of the server's threads and locks.
+            generation_executor = ProcessPoolExecutor(
+                max_workers=GENERATION_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=resource_governor.lower_process_priority,
+                initargs=(RENDER_NICENESS,),
+            )
+        return generation_executor
+
+def reset_generation_executor() -> None:
+    """Drop a broken render pool so the next generation starts a fresh one."""
+    global generation_executor
+    with generation_executor_lock:
+        pool, generation_executor = generation_executor, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
 def start_background_services(clean_cache=False):
     """Start runtime background services once."""
     global cleanup_thread
@@ -133,85 +387,35 @@ def thumbnail_cache_name(filename):
     """Return the thumbnail cache filename for an uploaded image filename."""
     return f"{secure_filename(filename)}.jpg"
 
-def flatten_thumbnail_image(img):
-    """Flatten thumbnails to RGB against white so transparent pixels stay neutral."""
-    if img.mode in ('RGBA', 'LA') or ('transparency' in img.info):
-        rgba = img.convert('RGBA')
-        background = Image.new('RGBA', rgba.size, 'white')
-        background.alpha_composite(rgba)
-        return background.convert('RGB')
-    return img.convert('RGB')
+def proxy_level_paths(filename):
+    """Return ``{long_edge: path}`` for every proxy level of an uploaded file."""
+    name = secure_filename(filename)
+    *larger, smallest = diptych_creator.PROXY_LEVELS
+    paths = {edge: os.path.join(PROXY_CACHE_DIR, f"{name}.{edge}.jpg") for edge in larger}
+    paths[smallest] = os.path.join(THUMB_CACHE_DIR, thumbnail_cache_name(filename))
+    return paths
+
+def existing_proxies(filename):
+    """Return the proxy paths of an uploaded file that have been written."""
+    return [path for path in proxy_level_paths(filename).values() if os.path.exists(path)]
 
 def create_single_thumbnail(full_path):
-    """Creates a thumbnail for a single image for the image pool."""
+    """Builds the proxy pyramid for an upload; its smallest level is the pool thumbnail."""
     try:
         ensure_cache_dirs()
         filename = os.path.basename(full_path)
         thumb_path = os.path.join(THUMB_CACHE_DIR, thumbnail_cache_name(filename))
         if not os.path.exists(thumb_path):
-            with Image.open(full_path) as img:
-                img = diptych_creator.apply_exif_orientation(img)
-                img.thumbnail((300, 300))
-                img = flatten_thumbnail_image(img)
-                img.save(thumb_path, "JPEG", quality=85)
+            diptych_creator.build_proxy_pyramid(full_path, proxy_level_paths(filename), quality=85)
     except Exception as e:
         logger.exception("Could not create thumbnail for %s", os.path.basename(full_path))
 
-def normalize_config(config, dpi_cap=None, both_images=True):
-    """Validate and normalize a client config, returning dimensions and values."""
-    config = config or {}
-    try:
-        width = float(config.get('width', 10))
-        height = float(config.get('height', 8))
-        dpi = int(config.get('dpi', 72))
-        gap = int(config.get('gap', 0))
-        outer_border = int(config.get('outer_border', 0))
-    except (TypeError, ValueError) as exc:
-        raise ValueError('Width, height, DPI, spacing, and border must be numeric') from exc
-
-    if width <= 0 or height <= 0:
-        raise ValueError('Width and height must be greater than zero')
-    if dpi <= 0 or dpi > 1200:
-        raise ValueError('DPI must be between 1 and 1200')
-    if gap < 0 or outer_border < 0:
-        raise ValueError('Spacing and outer border cannot be negative')
-    if dpi_cap is not None:
-        dpi = min(dpi, dpi_cap)
-
-    orientation = config.get('orientation') or 'landscape'
-    if orientation not in VALID_ORIENTATIONS:
-        raise ValueError('Orientation must be landscape or portrait')
-
-    fit_mode = config.get('fit_mode', 'fill')
-    if fit_mode not in VALID_FIT_MODES:
-        raise ValueError('Image fitting must be fill or fit')
-
-    border_color = config.get('border_color', 'white')
-    try:
-        ImageColor.getrgb(border_color)
-    except ValueError as exc:
-        raise ValueError('Border color is not valid') from exc
+def resolve_uploaded_image(image_data, with_proxies=False):
+    """Return normalized image job data for an uploaded file reference.
 
-    normalized = {
-        'width': width,
-        'height': height,
-        'dpi': dpi,
-        'gap': gap,
-        'outer_border': outer_border,
-        'orientation': orientation,
-        'fit_mode': fit_mode,
-        'border_color': border_color,
-        'preserve_exif': bool(config.get('preserve_exif')),
-    }
-    final_dims, processing_dims, outer_border_px, gap_px = diptych_creator.calculate_diptych_dimensions(
-        normalized,
-        dpi,
-        both_images=both_images,
-    )
-    return normalized, final_dims, processing_dims, outer_border_px, gap_px
-
-def resolve_uploaded_image(image_data):
-    """Return normalized image job data for an uploaded file reference."""
+    With ``with_proxies`` the result also lists the upload's existing proxy
+    files, so processing can read a downscaled copy when it covers the cell.
+    """
     if not image_data:
         return None
     raw_path = image_data.get('path') if isinstance(image_data, dict) else None
@@ -223,63 +427,203 @@ def resolve_uploaded_image(image_data):
     path = os.path.join(UPLOAD_DIR, filename)
     if not os.path.exists(path):
         raise FileNotFoundError(f"Image not found: {raw_path}")
+    source = reference_source(path)
+    if source is not None and not is_library_path(source):
+        raise ValueError('Image path is outside the local library')
     try:
         rotation = int(image_data.get('rotation', 0)) % 360
     except (TypeError, ValueError):
         rotation = 0
-    return {
+    resolved = {
         'path': path,
         'rotation': rotation,
         'crop_focus': image_data.get('crop_focus'),
     }
+    if with_proxies:
+        # A referenced file that changed on disk is read directly until its
+        # proxies have been rebuilt.
+        resolved['proxies'] = existing_proxies(filename) if refresh_reference(filename) else []
+    return resolved
 
-def render_diptych_preview(diptych_data, dpi_cap=150):
-    """Build a JPEG preview canvas from the same sizing logic used for output."""
-    config = diptych_data.get('config', {})
-    image1_data = diptych_data.get('image1')
-    image2_data = diptych_data.get('image2')
-    image1 = resolve_uploaded_image(image1_data)
-    image2 = resolve_uploaded_image(image2_data)
+def source_pixel_size(path):
+    """Return an image's stored pixel size from its header, or (0, 0)."""
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except Exception:
+        return (0, 0)
+
+def estimate_job_bytes(image1, image2, final_dims, processing_dims, low_memory=False):
+    """Estimate peak render memory for resolved images and computed dimensions."""
+    sizes = [source_pixel_size(image['path']) for image in (image1, image2) if image]
+    return diptych_creator.estimate_render_bytes(final_dims, processing_dims, sizes, low_memory)
+
+def parse_viewport(viewport):
+    """
+    Return a client's preview box in device pixels, or None when not given.
+
+    ``viewport`` is ``{'width': css_px, 'height': css_px, 'dpr': ratio}``;
+    the device pixel ratio defaults to 1. Each edge is clamped to
+    MAX_PREVIEW_EDGE_PX.
+    """
+    if not viewport:
+        return None
+    if not isinstance(viewport, dict):
+        raise ValueError('Viewport must be an object with width and height')
+    try:
+        width = float(viewport['width'])
+        height = float(viewport['height'])
+        dpr = float(viewport.get('dpr') or 1)
+    except (KeyError, TypeError, ValueError) as exc:
+        raise ValueError('Viewport width, height and dpr must be numeric') from exc
+    if width <= 0 or height <= 0 or dpr <= 0:
+        raise ValueError('Viewport width, height and dpr must be greater than zero')
+    return (
+        max(1, min(MAX_PREVIEW_EDGE_PX, round(width * dpr))),
+        max(1, min(MAX_PREVIEW_EDGE_PX, round(height * dpr))),
+    )
+
+def preview_geometry(diptych_data, viewport=None, dpi_cap=150):
+    """
+    Resolve a preview's images and compute its pixel geometry.
+
+    Without a viewport the output layout is rendered at no more than
+    ``dpi_cap`` DPI. With one (a device-pixel box from ``parse_viewport``)
+    the layout is scaled to fit it, gap and border included.
+
+    Returns ``(image1, image2, normalized, final_dims, processing_dims,
+    outer_border_px, gap_px)``.
+    """
+    image1 = resolve_uploaded_image(diptych_data.get('image1'), with_proxies=True)
+    image2 = resolve_uploaded_image(diptych_data.get('image2'), with_proxies=True)
     if not image1 and not image2:
         raise ValueError('No images to preview')
+    both_images = bool(image1 and image2)
+    config = diptych_data.get('config', {})
+    if viewport is None:
+        normalized, *geometry = diptych_creator.normalize_config(config, dpi_cap=dpi_cap, both_images=both_images)
+    else:
+        normalized, *_ = diptych_creator.normalize_config(config, both_images=both_images)
+        geometry = diptych_creator.calculate_preview_dimensions(
+            normalized,
+            normalized['dpi'],
+            viewport,
+            both_images=both_images,
+        )
+    return (image1, image2, normalized, *geometry)
+
+class PreviewCancelled(Exception):
+    """Raised inside a preview render that a newer request has superseded."""
+
+def raise_if_cancelled(cancel):
+    """Stop a preview render between stages once its ``cancel`` event is set."""
+    if cancel is not None and cancel.is_set():
+        raise PreviewCancelled('Preview was superseded by a newer request')
+
+def preview_group(data):
+    """Return the coalescing group of a preview request, or None."""
+    client_id = data.get('client_id')
+    target = data.get('target')
+    if not client_id or target is None:
+        return None
+    return (str(client_id), str(target))
+
+def supersede_preview(group, job):
+    """
+    Make ``job`` the newest preview of ``group`` and cancel the one it replaces.
+
+    A replaced job that has not started is dropped from the pool, a running
+    one stops at its next stage boundary, and a finished one releases its
+    JPEG bytes.
+    """
+    if group is None:
+        return
+    with preview_lock:
+        previous = preview_groups.get(group)
+        preview_groups[group] = job
+    if previous is None or previous is job:
+        return
+    with previous['lock']:
+        previous['cancel'].set()
+        future = previous.get('future')
+        if previous.get('status') == 'done' or (future is not None and future.cancel()):
+            previous['status'] = 'cancelled'
+            if previous.get('id'):
+                preview_jobs.drop_payload(previous['id'])
+                preview_jobs.save(previous['id'], previous)
+
+def release_preview_group(group, job):
+    """Forget ``job`` as its group's newest preview if nothing replaced it."""
+    if group is None:
+        return
+    with preview_lock:
+        if preview_groups.get(group) is job:
+            preview_groups.pop(group, None)
 
-    normalized, final_dims, processing_dims, outer_border_px, gap_px = normalize_config(
-        config,
+def render_diptych_preview(diptych_data, dpi_cap=150, timings=None, admission_key=None, viewport=None, cancel=None):
+    """Build a JPEG preview canvas from the same sizing logic used for output.
+
+    ``viewport`` is a device-pixel box from ``parse_viewport``; when given,
+    the preview is rendered to fit it instead of at ``dpi_cap`` DPI.
+
+    Rendering waits for ``memory_governor`` admission, ahead of any queued
+    batch renders; ``admission_key`` lets status endpoints report the queue
+    position while it waits. When the ``cancel`` event is set the render
+    raises PreviewCancelled at the next stage boundary.
+
+    When ``timings`` is a dict it receives the seconds spent in each stage:
+    ``prepare``, ``admission`` (waiting for memory), ``image1``/``image2``
+    (per half), ``images`` (both halves, processed concurrently) and
+    ``compose``.
+    """
+    started = time.perf_counter()
+    image1, image2, normalized, final_dims, processing_dims, outer_border_px, gap_px = preview_geometry(
+        diptych_data,
+        viewport=viewport,
         dpi_cap=dpi_cap,
-        both_images=bool(image1 and image2),
     )
     border_color = normalized['border_color']
     fit_mode = normalized['fit_mode']
     is_landscape = final_dims[0] >= final_dims[1]
+    stage_times = {} if timings is None else timings
+    cost = estimate_job_bytes(image1, image2, final_dims, processing_dims)
+    stage_times['prepare'] = time.perf_counter() - started
+    raise_if_cancelled(cancel)
 
-    img1 = img2 = None
-    if image1:
-        img1 = diptych_creator.process_source_image(
-            image1['path'],
-            processing_dims,
-            image1['rotation'],
-            fit_mode,
-            True,
-            border_color,
-            image1['crop_focus'],
-            is_landscape,
-        )
-        if img1 is None:
-            raise RuntimeError(f"Error processing image: {os.path.basename(image1['path'])}")
-    if image2:
-        img2 = diptych_creator.process_source_image(
-            image2['path'],
+    started = time.perf_counter()
+    with memory_governor.admit(
+        cost,
+        key=admission_key,
+        timeout=PREVIEW_ADMISSION_TIMEOUT_SECONDS,
+        priority=resource_governor.PRIORITY_PREVIEW,
+    ):
+        stage_times['admission'] = time.perf_counter() - started
+        raise_if_cancelled(cancel)
+
+        started = time.perf_counter()
+        img1, img2 = diptych_creator.process_image_pair(
+            image1,
+            image2,
             processing_dims,
-            image2['rotation'],
             fit_mode,
-            True,
             border_color,
-            image2['crop_focus'],
+            image1['crop_focus'] if image1 else None,
+            image2['crop_focus'] if image2 else None,
             is_landscape,
+            timings=stage_times,
+            use_cache=True,
         )
-        if img2 is None:
-            raise RuntimeError(f"Error processing image: {os.path.basename(image2['path'])}")
-    return diptych_creator.create_diptych_canvas(img1, img2, final_dims, gap_px, outer_border_px, border_color)
+        stage_times['images'] = time.perf_counter() - started
+        raise_if_cancelled(cancel)
+
+        started = time.perf_counter()
+        canvas = diptych_creator.create_diptych_canvas(img1, img2, final_dims, gap_px, outer_border_px, border_color)
+        stage_times['compose'] = time.perf_counter() - started
+    return canvas
+
+def server_timing_header(timings):
+    """Format stage timings (in seconds) as a Server-Timing header value."""
+    return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
 
 def pair_image_at(pair, index):
     if isinstance(pair, list) and len(pair) > index and isinstance(pair[index], dict):
@@ -297,10 +641,74 @@ def job_order_key(job):
 
 def register_download(path):
     download_id = uuid.uuid4().hex
-    with download_lock:
-        download_registry[download_id] = path
+    download_registry.put(download_id, path)
     return download_id
 
+class IncrementalZipWriter:
+    """Append finished outputs to a ZIP archive in requested order.
+
+    Entries use ZIP_STORED because the JPEGs are already compressed. The
+    archive is written under a temporary name and moved into place on close.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.partial_path = f"{path}.part"
+        self.next_index = 0
+        self.zipf = zipfile.ZipFile(self.partial_path, 'w', compression=zipfile.ZIP_STORED)
+
+    def add_ready(self, items):
+        """Write every leading item whose render has settled.
+
+        ``items`` is a list of ``(settled, path)`` in requested order; failed
+        items settle with a path of None and are skipped.
+        """
+        while self.next_index < len(items) and items[self.next_index][0]:
+            path = items[self.next_index][1]
+            if path and os.path.exists(path):
+                self.zipf.write(path, os.path.basename(path))
+            self.next_index += 1
+
+    def close(self):
+        self.zipf.close()
+        os.replace(self.partial_path, self.path)
+        return self.path
+
+class _ZipStreamBuffer:
+    """Write-only, non-seekable sink that lets zipfile emit a streamed archive."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_zip_archive(paths, chunk_size=1024 * 1024):
+    """Yield a STORED ZIP archive of ``paths`` chunk by chunk."""
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as zipf:
+        for path in paths:
+            info = zipfile.ZipInfo.from_file(path, os.path.basename(path))
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as src, zipf.open(info, 'w') as dest:
+                while True:
+                    block = src.read(chunk_size)
+                    if not block:
+                        break
+                    dest.write(block)
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
 def is_safe_output_path(path):
     try:
         base = os.path.abspath(OUTPUT_DIR_BASE)
@@ -309,19 +717,36 @@ def is_safe_output_path(path):
     except (TypeError, ValueError):
         return False
 
+def is_library_path(path):
+    """Return True when ``path`` resolves to a location inside LIBRARY_DIRS."""
+    try:
+        target = os.path.realpath(path)
+        return any(os.path.commonpath([root, target]) == root for root in LIBRARY_DIRS)
+    except (TypeError, ValueError):
+        return False
+
+def exif_capture_time(img):
+    """Return the EXIF capture datetime of an opened image, or None."""
+    try:
+        exif = img._getexif()
+    except Exception:
+        return None
+    if exif:
+        for tag in DATE_TAGS:
+            if tag and tag in exif:
+                try:
+                    return datetime.strptime(exif[tag], '%Y:%m:%d %H:%M:%S')
+                except Exception:
+                    pass
+    return None
+
 def get_capture_time(full_path):
     """Return capture datetime from EXIF or file modified time."""
     try:
         with Image.open(full_path) as img:
-            exif = img._getexif()
-            if exif:
-                for tag in DATE_TAGS:
-                    if tag and tag in exif:
-                        dt_str = exif[tag]
-                        try:
-                            return datetime.strptime(dt_str, '%Y:%m:%d %H:%M:%S')
-                        except Exception:
-                            pass
+            captured = exif_capture_time(img)
+            if captured:
+                return captured
     except Exception:
         pass
     base = os.path.basename(full_path)
@@ -330,24 +755,528 @@ def get_capture_time(full_path):
             return UPLOAD_TIMES[base]
     return datetime.fromtimestamp(os.path.getmtime(full_path))
 
-# Background task to generate a preview image
-def _generate_preview_job(job_id: str, diptych_data: dict) -> None:
-    """Worker function executed on the thread pool to create a preview."""
+def header_metadata(img):
+    """Return the index columns readable from an opened image's header."""
+    orientation, (width, height) = diptych_creator.oriented_image_size(img)
+    captured = exif_capture_time(img)
+    return {
+        'width': width,
+        'height': height,
+        'orientation': orientation,
+        'aspect': width / height if height else 1.0,
+        'capture_time': captured.timestamp() if captured else None,
+    }
+
+def colour_metadata(img):
+    """Return the mean colour index columns for a (small) image."""
+    # Downscale to 1x1 to approximate dominant colour quickly
+    r, g, b = img.convert('RGB').resize((1, 1)).getpixel((0, 0))
+    return {
+        'red': r,
+        'green': g,
+        'blue': b,
+        'hue': colorsys.rgb_to_hsv(r / 255, g / 255, b / 255)[0],
+    }
+
+def extract_image_metadata(full_path):
+    """
+    Read the metadata index columns for an image that was not ingested.
+
+    Dimensions, orientation and capture time come from the file header. The
+    mean colour is taken from the upload's thumbnail when it is newer than
+    the source, and otherwise from a reduced-scale decode of the source.
+    """
+    record = {}
+    # Called when the file's identity changed, so a referenced file's proxies
+    # are stale too.
+    refresh_reference(os.path.basename(full_path))
+    try:
+        with Image.open(full_path) as img:
+            record.update(header_metadata(img))
+        thumb_path = os.path.join(THUMB_CACHE_DIR, thumbnail_cache_name(os.path.basename(full_path)))
+        thumb_current = (
+            os.path.exists(thumb_path)
+            and os.path.getmtime(thumb_path) >= os.path.getmtime(full_path)
+        )
+        with Image.open(thumb_path if thumb_current else full_path) as img:
+            img.draft(img.mode, (64, 64))
+            record.update(colour_metadata(img))
+    except Exception:
+        logger.warning("Could not read metadata for %s", os.path.basename(full_path), exc_info=True)
+    return record
+
+def object_path(sha256):
+    """Return the content store path for a SHA-256 hex digest."""
+    return os.path.join(OBJECT_DIR, sha256)
+
+def has_stored_object(sha256, size):
+    """
+    Return True when the content store holds ``sha256`` with ``size`` bytes.
+
+    Clients may claim stored content without sending it, so they must know
+    its size as well as its digest.
+    """
+    if not SHA256_PATTERN.fullmatch(sha256) or isinstance(size, bool):
+        return False
+    try:
+        return os.path.getsize(object_path(sha256)) == int(size)
+    except (OSError, TypeError, ValueError):
+        return False
+
+def store_upload_object(uploaded, chunk_size=1024 * 1024):
+    """
+    Stream an upload into the content store while hashing it.
+
+    Returns ``(sha256, created)``; ``created`` is False when the store
+    already held the same bytes, in which case the new copy is dropped.
+    """
+    digest = hashlib.sha256()
+    partial = os.path.join(OBJECT_DIR, f"{uuid.uuid4().hex}.part")
+    with open(partial, 'wb') as out:
+        while True:
+            chunk = uploaded.stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    sha256 = digest.hexdigest()
+    return sha256, commit_object(partial, sha256)
+
+def commit_object(partial, sha256):
+    """Move a fully written file into the content store under its digest.
+
+    Returns False (and drops ``partial``) when the store already has it.
+    """
+    target = object_path(sha256)
+    if os.path.exists(target):
+        os.remove(partial)
+        return False
+    os.replace(partial, target)
+    return True
+
+def admit_stored_object(original_name, sha256, created):
+    """
+    Register a stored object as an upload and return its name, or None when
+    a newly stored object is not a readable image (it is then removed).
+    """
+    if created:
+        # Only the header is read here; the single full decode happens in
+        # ingest_upload on the background pool.
+        try:
+            with Image.open(object_path(sha256)):
+                pass
+        except Exception:
+            remove_file(object_path(sha256))
+            return None
+    return register_upload(original_name, sha256)
+
+def allowed_upload_name(raw_name):
+    """Return the sanitized upload name, or None for unsupported files."""
+    original_name = secure_filename(str(raw_name or ''))
+    ext = os.path.splitext(original_name)[1].lstrip('.').lower()
+    if not original_name or ext not in ALLOWED_EXTENSIONS:
+        return None
+    return original_name
+
+def link_or_copy(source, target):
+    """Hard-link ``source`` to ``target`` (replacing it), copying if links fail."""
+    partial = f"{target}.{uuid.uuid4().hex}.part"
+    try:
+        os.link(source, partial)
+    except OSError:
+        shutil.copyfile(source, partial)
+    os.replace(partial, target)
+
+def has_content(path, sha256):
+    """Return True when the file at ``path`` holds the stored object's bytes."""
+    try:
+        if os.path.samefile(path, object_path(sha256)):
+            return True
+    except OSError:
+        return False
+    row = image_index.get(os.path.basename(path))
+    return bool(row and row.get('sha256') == sha256 and row['mtime_ns'] == os.stat(path).st_mtime_ns)
+
+def claim_alias(original_name, is_same, create):
+    """
+    Choose the UPLOAD_DIR name for a file and create it there.
+
+    A name for which ``is_same(path)`` holds is reused; otherwise name
+    collisions are resolved by appending a counter and ``create(path)``
+    makes the entry. Returns ``(filename, reused)``.
+    """
+    name, extension = os.path.splitext(original_name)
+    filename = original_name
+    counter = 1
+    with alias_lock:
+        while True:
+            path = os.path.join(UPLOAD_DIR, filename)
+            if not os.path.exists(path):
+                create(path)
+                return filename, False
+            if is_same(path):
+                return filename, True
+            filename = f"{name}_{counter}{extension}"
+            counter += 1
+
+def alias_upload(original_name, sha256):
+    """Expose a stored object in UPLOAD_DIR under a user-facing name."""
+    return claim_alias(
+        original_name,
+        lambda path: has_content(path, sha256),
+        lambda path: link_or_copy(object_path(sha256), path),
+    )
+
+def alias_reference(original_name, source):
+    """
+    Expose a local library file in UPLOAD_DIR through a symbolic link.
+
+    Where symbolic links are not permitted (Windows without Developer Mode
+    or administrator rights) the file is hard-linked instead and its source
+    recorded in REFERENCE_SOURCES, which requires the library and the cache
+    to be on the same volume.
+    """
+    def create(path):
+        partial = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            os.symlink(source, partial)
+            hard_linked = False
+        except OSError:
+            os.link(source, partial)
+            hard_linked = True
+        os.replace(partial, path)
+        if hard_linked:
+            REFERENCE_SOURCES[os.path.basename(path)] = source
+    return claim_alias(
+        original_name,
+        lambda path: reference_source(path) == source,
+        create,
+    )
+
+def reference_source(path):
+    """Return the library file an UPLOAD_DIR entry refers to, or None for uploads."""
+    if os.path.islink(path):
+        return os.path.realpath(path)
+    return REFERENCE_SOURCES.get(os.path.basename(path))
+
+def relink_reference(path, source):
+    """
+    Point a hard-linked reference at the current ``source`` file again.
+
+    An editor that saves by renaming a new file over the old one leaves a
+    hard link on the old content, where a symbolic link would follow.
+    """
+    if os.path.samefile(path, source):
+        return
+    partial = f"{path}.{uuid.uuid4().hex}.part"
+    os.link(source, partial)
+    os.replace(partial, path)
+
+def register_upload(original_name, sha256):
+    """Alias a stored object as an upload and schedule its ingest; return its name."""
+    filename, reused = alias_upload(original_name, sha256)
+    # Record upload time with thread safety
+    uploaded_at = datetime.now()
+    with upload_times_lock:
+        UPLOAD_TIMES[filename] = uploaded_at
+    with ingest_failures_lock:
+        ingest_failures.pop(filename, None)
+    thumb_path = os.path.join(THUMB_CACHE_DIR, thumbnail_cache_name(filename))
+    if not (reused and os.path.exists(thumb_path)):
+        ingest_executor.submit(ingest_upload, os.path.join(UPLOAD_DIR, filename), uploaded_at, sha256)
+    return filename
+
+def register_reference(source):
+    """
+    Register a local library file in place and schedule its ingest.
+
+    Returns the upload name, or None when ``source`` is not a readable
+    image of a supported type inside LIBRARY_DIRS.
+    """
+    source = os.path.realpath(source)
+    original_name = allowed_upload_name(os.path.basename(source))
+    if original_name is None or not is_library_path(source) or not os.path.isfile(source):
+        return None
+    try:
+        with Image.open(source):
+            pass
+        filename, reused = alias_reference(original_name, source)
+    except Exception:
+        logger.warning("Could not register local file %s", source, exc_info=True)
+        return None
+    uploaded_at = datetime.now()
+    with upload_times_lock:
+        UPLOAD_TIMES[filename] = uploaded_at
+    with ingest_failures_lock:
+        ingest_failures.pop(filename, None)
+    if not (reused and refresh_reference(filename)):
+        schedule_reference_ingest(filename, uploaded_at)
+    return filename
+
+def schedule_reference_ingest(filename, uploaded_at=None):
+    """Queue an ingest of a referenced file unless one is already pending."""
+    with pending_reference_lock:
+        if filename in pending_reference_ingests:
+            return
+        pending_reference_ingests[filename] = time.time()
+    ingest_executor.submit(ingest_reference, os.path.join(UPLOAD_DIR, filename), uploaded_at)
+
+def ingest_reference(full_path, uploaded_at=None):
+    """Ingest a referenced file and clear its pending flag."""
+    try:
+        ingest_upload(full_path, uploaded_at)
+    finally:
+        with pending_reference_lock:
+            pending_reference_ingests.pop(os.path.basename(full_path), None)
+
+def refresh_reference(filename):
+    """
+    Return True when an upload's proxies and metadata match its file.
+
+    Only references to library files can change behind the app's back. When
+    one's size or mtime differs from what was ingested, or its ingest is
+    still pending, a (re-)ingest is scheduled and False is returned.
+    """
+    path = os.path.join(UPLOAD_DIR, filename)
+    source = reference_source(path)
+    if source is None:
+        return True
+    with pending_reference_lock:
+        if filename in pending_reference_ingests:
+            return False
+    row = image_index.get(filename)
     try:
-        canvas = render_diptych_preview(diptych_data)
+        if not os.path.islink(path):
+            relink_reference(path, source)
+        identity = metadata_index.file_identity(path)
+    except OSError:
+        return False
+    if row and all(row[column] == identity[column] for column in ('mtime_ns', 'size')):
+        return True
+    schedule_reference_ingest(filename)
+    return False
+
+def link_ingested_copy(filename, sha256, uploaded_at=None):
+    """
+    Reuse the proxies, thumbnail and metadata of another upload with the
+    same content. Returns False when no such upload has been ingested.
+    """
+    for row in image_index.find_by_sha256(sha256):
+        sibling = row['name']
+        if sibling == filename or not os.path.exists(os.path.join(UPLOAD_DIR, sibling)):
+            continue
+        sibling_levels = proxy_level_paths(sibling)
+        smallest = min(sibling_levels)
+        if not os.path.exists(sibling_levels[smallest]):
+            continue
+        for edge, target in proxy_level_paths(filename).items():
+            if os.path.exists(sibling_levels[edge]):
+                link_or_copy(sibling_levels[edge], target)
+            else:
+                remove_file(target)
+        image_index.put({
+            **row,
+            **metadata_index.file_identity(os.path.join(UPLOAD_DIR, filename)),
+            'name': filename,
+            'uploaded_at': uploaded_at.timestamp() if uploaded_at else None,
+        })
+        return True
+    return False
+
+def remove_file(path):
+    """Delete a file if it exists."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def discard_upload(filename):
+    """Remove an upload together with its proxies, thumbnail and index row."""
+    for path in [os.path.join(UPLOAD_DIR, filename), *proxy_level_paths(filename).values()]:
+        remove_file(path)
+    image_index.remove(filename)
+    REFERENCE_SOURCES.pop(filename, None)
+    with upload_times_lock:
+        UPLOAD_TIMES.pop(filename, None)
+
+def ingest_upload(full_path, uploaded_at=None, sha256=None):
+    """
+    Validate and prepare a new upload with a single decode.
+
+    The source is opened once: its header supplies the index metadata, and
+    one (reduced-scale, where possible) decode validates the pixels and
+    writes the proxy pyramid and thumbnail, whose smallest level supplies
+    the colour features. A file that cannot be decoded is discarded and its
+    error kept in ``ingest_failures`` for the thumbnail endpoint to report.
+
+    When another upload with the same ``sha256`` was already ingested, its
+    proxies and metadata are linked instead and nothing is decoded.
+
+    The outcome is published on ``thumbnail_events``.
+    """
+    filename = os.path.basename(full_path)
+    try:
+        ensure_cache_dirs()
+        if not (sha256 and link_ingested_copy(filename, sha256, uploaded_at)):
+            ingest_source(full_path, uploaded_at, sha256)
+    except Exception as e:
+        logger.warning("Discarding upload %s that could not be decoded", filename, exc_info=True)
+        discard_upload(filename)
+        error = str(e) or type(e).__name__
+        with ingest_failures_lock:
+            ingest_failures[filename] = error
+        thumbnail_events.publish('failed', {'name': filename, 'error': error})
+    else:
+        thumbnail_events.publish('ready', {'name': filename})
+
+def ingest_source(full_path, uploaded_at=None, sha256=None):
+    """Decode an upload once into its proxies and metadata index row."""
+    filename = os.path.basename(full_path)
+    levels = proxy_level_paths(filename)
+    # Taken before decoding so a change made meanwhile is noticed later.
+    identity = metadata_index.file_identity(full_path)
+    with Image.open(full_path) as source:
+        record = header_metadata(source)
+        written, smallest = diptych_creator.write_proxy_pyramid(source, levels, quality=85)
+    # Drop levels left behind by an earlier file with the same name.
+    for path in set(levels.values()) - set(written):
+        remove_file(path)
+    record.update(colour_metadata(smallest))
+    image_index.put({
+        **record,
+        **identity,
+        'name': filename,
+        'uploaded_at': uploaded_at.timestamp() if uploaded_at else None,
+        'sha256': sha256,
+    })
+
+def indexed_capture_time(row):
+    """Return the grouping time for an index row, like ``get_capture_time``."""
+    if row.get('capture_time') is not None:
+        return datetime.fromtimestamp(row['capture_time'])
+    with upload_times_lock:
+        if row['name'] in UPLOAD_TIMES:
+            return UPLOAD_TIMES[row['name']]
+    if row.get('uploaded_at') is not None:
+        return datetime.fromtimestamp(row['uploaded_at'])
+    return datetime.fromtimestamp(row['mtime_ns'] / 1e9)
+
+def preview_cache_key(diptych_data, dpi_cap=150, viewport=None):
+    """Return a canonical hash of everything that determines a preview.
+
+    The hash covers the normalized config, the preview's pixel geometry and,
+    per image, the uploaded file identity (name, mtime, size), rotation and
+    crop focus. It doubles as the preview's weak ETag: it does not cover
+    which proxy level the pixels were read from, so a proxy written or
+    removed since can give slightly different bytes for the same key.
+    """
+    image1, image2, normalized, *geometry = preview_geometry(
+        diptych_data,
+        viewport=viewport,
+        dpi_cap=dpi_cap,
+    )
+    sources = []
+    for image in (image1, image2):
+        if not image:
+            sources.append(None)
+            continue
+        stat = os.stat(image['path'])
+        sources.append({
+            'name': os.path.basename(image['path']),
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'rotation': image['rotation'],
+            'crop_focus': image['crop_focus'],
+        })
+    canonical = json.dumps(
+        {'config': normalized, 'geometry': geometry, 'images': sources},
+        sort_keys=True,
+        separators=(',', ':'),
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def render_preview_jpeg(diptych_data, timings=None, admission_key=None, viewport=None, cancel=None, etag=None):
+    """
+    Return ``(etag, jpeg_bytes)`` for a preview, using the result cache.
+
+    ``etag`` is the request's ``preview_cache_key`` when the caller already
+    computed it.
+    """
+    if etag is None:
+        etag = preview_cache_key(diptych_data, viewport=viewport)
+    data = preview_cache.get(etag)
+    if data is None:
+        stage_times = {} if timings is None else timings
+        canvas = render_diptych_preview(
+            diptych_data,
+            timings=stage_times,
+            admission_key=admission_key,
+            viewport=viewport,
+            cancel=cancel,
+        )
+        raise_if_cancelled(cancel)
+        started = time.perf_counter()
         buf = io.BytesIO()
         canvas.save(buf, format='JPEG', quality=90)
-        buf.seek(0)
-        with preview_lock:
-            if job_id in preview_jobs:
-                preview_jobs[job_id]['status'] = 'done'
-                preview_jobs[job_id]['data'] = buf.read()
+        data = buf.getvalue()
+        stage_times['encode'] = time.perf_counter() - started
+        preview_cache.put(etag, data)
+    return etag, data
+
+def preview_response(etag, data, timings=None):
+    """Send preview bytes with a weak ETag, or 304 when the client has them."""
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    response = send_file(io.BytesIO(data), mimetype='image/jpeg', etag=False)
+    response.set_etag(etag, weak=True)
+    # Let clients keep the image but revalidate it on every use.
+    response.headers['Cache-Control'] = 'no-cache'
+    if timings:
+        response.headers['Server-Timing'] = server_timing_header(timings)
+    return response
+
+# Background task to generate a preview image
+def _generate_preview_job(job_id: str, diptych_data: dict, viewport=None) -> None:
+    """Worker function executed on the preview thread pool to create a preview."""
+    job = preview_jobs.get(job_id)
+    if job is None:
+        return
+    with job['lock']:
+        if job['cancel'].is_set():
+            job['status'] = 'cancelled'
+            preview_jobs.save(job_id, job)
+            return
+        job['status'] = 'running'
+        preview_jobs.save(job_id, job)
+    try:
+        timings = {}
+        etag, data = render_preview_jpeg(
+            diptych_data,
+            timings=timings,
+            admission_key=job_id,
+            viewport=viewport,
+            cancel=job['cancel'],
+        )
+        with job['lock']:
+            if job['cancel'].is_set():
+                raise PreviewCancelled('Preview was superseded by a newer request')
+            preview_jobs.set_payload(job_id, data)
+            job['status'] = 'done'
+            job['etag'] = etag
+            job['timings'] = timings
+            preview_jobs.save(job_id, job)
+    except PreviewCancelled:
+        with job['lock']:
+            job['status'] = 'cancelled'
+            preview_jobs.save(job_id, job)
     except Exception as e:  # pragma: no cover - hard to trigger in tests
         logger.exception("Preview job %s failed", job_id)
-        with preview_lock:
-            if job_id in preview_jobs:
-                preview_jobs[job_id]['status'] = 'error'
-                preview_jobs[job_id]['error'] = str(e)
+        with job['lock']:
+            job['status'] = 'error'
+            job['error'] = str(e)
+            preview_jobs.save(job_id, job)
 
 # --- Flask Routes ---
 @app.route('/')
@@ -358,7 +1287,12 @@ def index():
 
 @app.route('/upload_images', methods=['POST'])
 def upload_images():
-    """Handles file uploads and kicks off background thumbnail generation."""
+    """Handles file uploads and kicks off background thumbnail generation.
+
+    Bytes are stored once per content hash. Uploading content the server
+    already has reuses its stored copy, derived files and, when the name
+    matches too, its existing upload name.
+    """
     ensure_cache_dirs()
     if 'files[]' not in request.files:
         return jsonify({"error": "No files part in the request"}), 400
@@ -377,45 +1311,269 @@ def upload_images():
             if ext not in ALLOWED_EXTENSIONS:
                 invalid_files.append(original_name)
                 continue
-            # Resolve name collisions by appending a counter
-            filename = original_name
-            save_path = os.path.join(UPLOAD_DIR, filename)
-            name, extension = os.path.splitext(original_name)
-            counter = 1
-            while os.path.exists(save_path):
-                filename = f"{name}_{counter}{extension}"
-                save_path = os.path.join(UPLOAD_DIR, filename)
-                counter += 1
-            uploaded.save(save_path)
-            try:
-                with Image.open(save_path) as img:
-                    img.verify()
-            except Exception:
-                try:
-                    os.remove(save_path)
-                except OSError:
-                    pass
+            sha256, created = store_upload_object(uploaded)
+            filename = admit_stored_object(original_name, sha256, created)
+            if filename is None:
                 invalid_files.append(original_name)
                 continue
-            # Record upload time with thread safety
-            with upload_times_lock:
-                UPLOAD_TIMES[filename] = datetime.now()
-            executor.submit(create_single_thumbnail, save_path)
             uploaded_filenames.append(filename)
     response = {"uploaded": uploaded_filenames}
     if invalid_files:
         response["invalid"] = invalid_files
     return jsonify(response), (400 if invalid_files and not uploaded_filenames else 200)
 
+@app.route('/check_uploads', methods=['POST'])
+def check_uploads():
+    """
+    Register files the server already stores, given their SHA-256 digests.
+
+    The body is ``{"files": [{"name": ..., "size": ..., "sha256": ...}, ...]}``.
+    Files whose content is already stored with that digest and size are
+    added as uploads without sending their bytes and listed in
+    ``uploaded``; ``missing`` holds the indexes of the entries the client
+    still has to upload.
+    """
+    ensure_cache_dirs()
+    data = request.get_json(silent=True) or {}
+    entries = data.get('files')
+    if not isinstance(entries, list):
+        return jsonify({"error": "files must be a list"}), 400
+    uploaded_filenames: list[str] = []
+    missing: list[int] = []
+    for index, entry in enumerate(entries):
+        entry = entry if isinstance(entry, dict) else {}
+        original_name = secure_filename(str(entry.get('name') or ''))
+        sha256 = str(entry.get('sha256') or '').lower()
+        ext = os.path.splitext(original_name)[1].lstrip('.').lower()
+        known = ext in ALLOWED_EXTENSIONS and has_stored_object(sha256, entry.get('size'))
+        if known:
+            uploaded_filenames.append(register_upload(original_name, sha256))
+        else:
+            missing.append(index)
+    return jsonify({"uploaded": uploaded_filenames, "missing": missing})
+
+@app.route('/register_local_files', methods=['POST'])
+def register_local_files():
+    """
+    Add files from an allow-listed local folder without copying them.
+
+    The body is ``{"paths": [...], "recursive": false}``; each path is a
+    file or a folder whose supported images are added. Paths must lie in
+    one of the DIPTYCH_LIBRARY_DIRS folders. Registered files are linked
+    into the upload directory, ingested like uploads and re-ingested when
+    their size or mtime changes. Returns 403 when no library is configured.
+    """
+    ensure_cache_dirs()
+    if not LIBRARY_DIRS:
+        return jsonify({"error": "Local library access is not enabled"}), 403
+    data = request.get_json(silent=True) or {}
+    paths = data.get('paths')
+    if not isinstance(paths, list):
+        return jsonify({"error": "paths must be a list"}), 400
+    recursive = bool(data.get('recursive', False))
+    sources: list[str] = []
+    for raw_path in paths:
+        path = os.path.realpath(str(raw_path))
+        if os.path.isdir(path) and is_library_path(path):
+            for root, dirs, names in os.walk(path):
+                # Other files in a listed folder are skipped, not reported.
+                sources.extend(os.path.join(root, name) for name in sorted(names) if allowed_upload_name(name))
+                if not recursive:
+                    break
+                dirs.sort()
+        else:
+            sources.append(str(raw_path))
+    uploaded_filenames: list[str] = []
+    invalid_files: list[str] = []
+    for source in sources:
+        filename = register_reference(source)
+        if filename is None:
+            invalid_files.append(source)
+        else:
+            uploaded_filenames.append(filename)
+    response = {"uploaded": uploaded_filenames}
+    if invalid_files:
+        response["invalid"] = invalid_files
+    return jsonify(response), (400 if invalid_files and not uploaded_filenames else 200)
+
+# --- Chunked Upload API ---
+def upload_session_status(upload_id, session):
+    return {
+        'upload_id': upload_id,
+        'size': session['size'],
+        'chunk_size': session['chunk_size'],
+        'chunks': session['chunks'],
+        'received': sorted(session['received']),
+    }
+
+@app.route('/upload_sessions', methods=['POST'])
+def create_upload_session():
+    """
+    Start a chunked upload for one file.
+
+    The body is ``{"name": ..., "size": bytes, "sha256": optional}``. When the
+    digest and size match content the server already stores, the file is
+    registered at once and ``filename`` is returned instead of a session. Otherwise the
+    response describes the session: its id, chunk size and chunk count.
+    Chunks are sent with PUT /upload_sessions/<id>/chunks/<index> in any
+    order and in parallel, and GET /upload_sessions/<id> lists the chunks
+    received so an interrupted upload can resume.
+    """
+    ensure_cache_dirs()
+    data = request.get_json(silent=True) or {}
+    original_name = allowed_upload_name(data.get('name'))
+    if original_name is None:
+        return jsonify({"error": "Unsupported file type"}), 400
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "size must be an integer"}), 400
+    if size <= 0:
+        return jsonify({"error": "size must be greater than zero"}), 400
+    if size > MAX_UPLOAD_BYTES:
+        return jsonify({"error": f"Files larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB cannot be uploaded"}), 413
+    sha256 = str(data.get('sha256') or '').lower()
+    if has_stored_object(sha256, size):
+        return jsonify({"filename": register_upload(original_name, sha256)})
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(UPLOAD_SESSION_DIR, f"{upload_id}.part")
+    with open(path, 'wb') as out:
+        out.truncate(size)
+    now = time.time()
+    session = {
+        'name': original_name,
+        'size': size,
+        'chunk_size': UPLOAD_CHUNK_BYTES,
+        'chunks': -(-size // UPLOAD_CHUNK_BYTES),
+        'received': set(),
+        'path': path,
+        'created_at': now,
+        'updated_at': now,
+    }
+    with upload_sessions_lock:
+        upload_sessions[upload_id] = session
+    return jsonify(upload_session_status(upload_id, session)), 201
+
+@app.route('/upload_sessions/<upload_id>')
+def get_upload_session(upload_id):
+    """Return which chunks of an upload session have been received."""
+    with upload_sessions_lock:
+        session = upload_sessions.get(upload_id)
+        if not session:
+            return jsonify({"error": "Unknown upload session"}), 404
+        return jsonify(upload_session_status(upload_id, session))
+
+@app.route('/upload_sessions/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def put_upload_chunk(upload_id, index):
+    """Write one chunk (the raw request body) of an upload session."""
+    with upload_sessions_lock:
+        session = upload_sessions.get(upload_id)
+    if not session:
+        return jsonify({"error": "Unknown upload session"}), 404
+    if index < 0 or index >= session['chunks']:
+        return jsonify({"error": "Chunk index out of range"}), 400
+    offset = index * session['chunk_size']
+    expected = min(session['chunk_size'], session['size'] - offset)
+    written = 0
+    with open(session['path'], 'r+b') as out:
+        out.seek(offset)
+        while written <= expected:
+            block = request.stream.read(1024 * 1024)
+            if not block:
+                break
+            out.write(block[:expected - written])
+            written += len(block)
+    if written != expected:
+        return jsonify({"error": f"Chunk {index} must be {expected} bytes, got {written}"}), 400
+    def mark_received(session):
+        session['received'].add(index)
+        session['updated_at'] = time.time()
+        return session
+    with upload_sessions_lock:
+        session = upload_sessions.modify(upload_id, mark_received)
+    if session is None:
+        return jsonify({"error": "Unknown upload session"}), 404
+    return jsonify({"received": len(session['received']), "chunks": session['chunks']})
+
+@app.route('/upload_sessions/<upload_id>/complete', methods=['POST'])
+def complete_upload_session(upload_id):
+    """
+    Finish an upload session once every chunk has arrived.
+
+    The file is hashed, moved into the content store and registered, which
+    starts its ingest straight away. Returns 409 with the missing chunk
+    indexes when the file is incomplete.
+    """
+    with upload_sessions_lock:
+        session = upload_sessions.get(upload_id)
+        if not session:
+            return jsonify({"error": "Unknown upload session"}), 404
+        missing = sorted(set(range(session['chunks'])) - session['received'])
+        if missing:
+            return jsonify({"error": "Upload is incomplete", "missing": missing}), 409
+        try:
+            del upload_sessions[upload_id]
+        except KeyError:
+            # Completed meanwhile through another server process.
+            return jsonify({"error": "Unknown upload session"}), 404
+    digest = hashlib.sha256()
+    with open(session['path'], 'rb') as source:
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(block)
+    sha256 = digest.hexdigest()
+    created = commit_object(session['path'], sha256)
+    filename = admit_stored_object(session['name'], sha256, created)
+    if filename is None:
+        return jsonify({"error": f"{session['name']} is not a readable image"}), 400
+    return jsonify({"filename": filename})
+
 @app.route('/thumbnail/<filename>')
 def get_thumbnail(filename):
-    """Serves a pre-generated thumbnail image for the image pool."""
+    """Serves a pre-generated thumbnail image for the image pool.
+
+    Returns 404 while the upload is still being ingested (or a changed
+    local reference is re-ingested) and 422 when it failed to decode.
+    """
     thumb_path = os.path.join(THUMB_CACHE_DIR, thumbnail_cache_name(filename))
-    if os.path.exists(thumb_path):
+    if os.path.exists(thumb_path) and refresh_reference(secure_filename(filename)):
         return send_file(thumb_path, mimetype='image/jpeg')
+    with ingest_failures_lock:
+        failure = ingest_failures.get(filename)
+    if failure:
+        return jsonify({"error": f"Could not read image: {failure}"}), 422
     else:
         return "Thumbnail not ready", 404
 
+def event_stream_response(log, after):
+    """
+    Return a server-sent event response for ``log``, or 503 when this
+    process already serves ``MAX_EVENT_STREAMS`` streams. Browsers do not
+    retry a refused EventSource, so the page falls back to polling.
+    """
+    if not event_stream_slots.acquire(blocking=False):
+        response = app.response_class("Too many open event streams", status=503)
+        response.headers['Retry-After'] = '30'
+        return response
+    response = app.response_class(event_stream.sse_stream(log, after), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Runs when the server closes the response, also for disconnected clients.
+    response.call_on_close(event_stream_slots.release)
+    return response
+
+@app.route('/thumbnail_events')
+def get_thumbnail_events():
+    """
+    Stream ingest outcomes as server-sent events.
+
+    Each ``ready`` event carries the ``name`` of an upload whose thumbnail
+    can now be fetched; ``failed`` events add the decode ``error``. A client
+    that reconnects resumes after its ``Last-Event-ID`` (or ``?after=``);
+    a new connection only receives events published from then on, and
+    probes thumbnails it is still waiting for itself.
+    """
+    after = event_stream.last_event_id(request.headers, request.args, default=thumbnail_events.last_id)
+    return event_stream_response(thumbnail_events, after)
+
 @app.route('/auto_group', methods=['POST'])
 def auto_group():
     """
@@ -434,37 +1592,28 @@ def auto_group():
     - ``dominant_color``: approximate the dominant colour of each image and
       pair by similar hues.
     - ``random``: shuffle images randomly before pairing.
+
+    Image metadata comes from the persistent index; only files that are new
+    or changed since they were indexed are read.
     """
     data = request.get_json(silent=True) or {}
     method = (data.get('method') or 'chronological').lower()
     # Gather file metadata
     ensure_cache_dirs()
-    files = [
-        f for f in os.listdir(UPLOAD_DIR)
-        if os.path.isfile(os.path.join(UPLOAD_DIR, f))
-        and os.path.splitext(f)[1].lstrip('.').lower() in ALLOWED_EXTENSIONS
-    ]
+    rows = image_index.refresh(
+        UPLOAD_DIR,
+        extract_image_metadata,
+        include=lambda f: os.path.splitext(f)[1].lstrip('.').lower() in ALLOWED_EXTENSIONS,
+    )
     info: list[dict] = []
-    for f in files:
-        path = os.path.join(UPLOAD_DIR, f)
-        try:
-            with Image.open(path) as img:
-                img = diptych_creator.apply_exif_orientation(img)
-                landscape = img.width >= img.height
-                ratio = img.width / img.height if img.height else 1.0
-                # Downscale to 1x1 to approximate dominant colour quickly
-                r, g, b = img.resize((1, 1)).convert('RGB').getpixel((0, 0))
-                hue = colorsys.rgb_to_hsv(r / 255, g / 255, b / 255)[0]
-        except Exception:
-            landscape = True
-            ratio = 1.0
-            hue = 0.0
+    for row in rows:
+        width, height = row['width'], row['height']
         info.append({
-            'name': f,
-            'time': get_capture_time(path),
-            'landscape': landscape,
-            'ratio': ratio,
-            'hue': hue,
+            'name': row['name'],
+            'time': indexed_capture_time(row),
+            'landscape': width >= height if width and height else True,
+            'ratio': row['aspect'] or 1.0,
+            'hue': row['hue'] or 0.0,
         })
     pairs: list[list[str]] = []
     if method == 'orientation':
@@ -520,48 +1669,75 @@ def auto_group():
 @app.route('/update_diptych_order', methods=['POST'])
 def update_diptych_order():
     """Persist the client-provided diptych order on the server."""
-    global diptych_order
     data = request.get_json() or {}
     order = data.get('order')
     if not isinstance(order, list):
         return jsonify({"status": "error", "message": "Invalid order"}), 400
-    with order_lock:
-        diptych_order = order
+    state.set_value('diptych_order', order)
     return jsonify({"status": "ok"})
 
 # --- Asynchronous Preview API ---
 @app.route('/request_preview', methods=['POST'])
 def request_preview():
-    """Start preview generation in the background and return a job id."""
+    """Start preview generation in the background and return a job id.
+
+    An optional ``viewport`` sizes the preview to the client's display box.
+    Requests carrying the same ``client_id`` and ``target`` (the diptych or
+    view the preview is for) supersede each other: the older job is
+    cancelled if it has not started, stops between stages if it has, and
+    reports status ``cancelled``.
+    """
     data = request.get_json() or {}
     diptych = data.get('diptych')
     if not diptych:
         return "Invalid preview request", 400
+    try:
+        viewport = parse_viewport(data.get('viewport'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     job_id = uuid.uuid4().hex
-    with preview_lock:
-        preview_jobs[job_id] = {'status': 'pending', 'data': None, 'error': None, 'created_at': time.time()}
-    executor.submit(_generate_preview_job, job_id, diptych)
+    job = {
+        'id': job_id,
+        'status': 'pending',
+        'error': None,
+        'created_at': time.time(),
+        'cancel': threading.Event(),
+        'lock': threading.Lock(),
+    }
+    preview_jobs.put(job_id, job)
+    supersede_preview(preview_group(data), job)
+    future = preview_executor.submit(_generate_preview_job, job_id, diptych, viewport)
+    with job['lock']:
+        job['future'] = future
     return jsonify({'job_id': job_id})
 
 @app.route('/preview_status/<job_id>')
 def preview_status(job_id):
     """Return the status of an asynchronous preview job."""
-    with preview_lock:
-        job = preview_jobs.get(job_id)
+    job = preview_jobs.get(job_id)
     if not job:
         return "Invalid job id", 404
-    return jsonify({'status': job['status'], 'error': job['error']})
+    return jsonify({
+        'status': job['status'],
+        'error': job['error'],
+        'timings': job.get('timings'),
+        'queue_position': memory_governor.position(job_id),
+    })
 
 @app.route('/preview_result/<job_id>')
 def preview_result(job_id):
     """Return the final preview JPEG when ready."""
-    with preview_lock:
-        job = preview_jobs.get(job_id)
+    job = preview_jobs.get(job_id)
     if not job:
         return "Invalid job id", 404
+    if job['status'] == 'cancelled':
+        return jsonify({"error": "Preview was superseded by a newer request"}), 409
     if job['status'] != 'done':
         return "Preview not ready", 202
-    return send_file(io.BytesIO(job['data']), mimetype='image/jpeg')
+    data = preview_jobs.get_payload(job_id)
+    if data is None:
+        return "Invalid job id", 404
+    return preview_response(job['etag'], data, job.get('timings'))
 
 # --- WYSIWYG PREVIEW ENDPOINT ---
 @app.route('/get_wysiwyg_preview', methods=['POST'])
@@ -569,36 +1745,63 @@ def get_wysiwyg_preview():
     """
     Generates a high-fidelity, WYSIWYG preview using the exact same
     logic as the final diptych creation.
+
+    An optional ``viewport`` (``{'width', 'height', 'dpr'}`` in CSS pixels)
+    renders the preview at the client's display resolution instead of the
+    150 DPI fallback.
+
+    Responses carry a weak ETag derived from the normalized request, and
+    a matching If-None-Match header is answered with 304 without rendering.
+
+    Like /request_preview, a request with the same ``client_id`` and
+    ``target`` as one still rendering stops the older one, which is then
+    answered with 409.
     """
+    group = None
+    job = {'cancel': threading.Event(), 'lock': threading.Lock(), 'created_at': time.time()}
     try:
         data = request.get_json()
         if not data or 'diptych' not in data:
             return "Invalid preview request", 400
-        canvas = render_diptych_preview(data['diptych'])
-        buf = io.BytesIO()
-        canvas.save(buf, format='JPEG', quality=90)
-        buf.seek(0)
-        return send_file(buf, mimetype='image/jpeg')
+        group = preview_group(data)
+        supersede_preview(group, job)
+        viewport = parse_viewport(data.get('viewport'))
+        etag = preview_cache_key(data['diptych'], viewport=viewport)
+        if request.if_none_match.contains_weak(etag):
+            return preview_response(etag, None)
+        timings = {}
+        etag, jpeg = render_preview_jpeg(
+            data['diptych'], timings=timings, viewport=viewport, cancel=job['cancel'], etag=etag,
+        )
+        return preview_response(etag, jpeg, timings)
+    except PreviewCancelled as e:
+        return jsonify({"error": str(e)}), 409
     except FileNotFoundError as e:
         return jsonify({"error": str(e)}), 404
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except resource_governor.AdmissionTimeout as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
     except Exception as e:
         logger.exception("Preview generation error")
         return f"Error generating preview: {str(e)}", 500
+    finally:
+        release_preview_group(group, job)
 
 @app.route('/generate_diptychs', methods=['POST'])
 def generate_diptychs():
     """Handle the final generation of one or more diptychs.
 
     This endpoint accepts a list of jobs, each containing a pair of images
-    and a configuration dictionary.  A background task is scheduled on the
-    thread pool to process all jobs sequentially.  Progress is tracked in
-    `progress_data` and can be polled via `/get_generation_progress`.  If an
-    error occurs during processing, the progress data will contain an
-    `error` field describing the failure.
+    and a configuration dictionary.  A background task on the batch thread pool
+    submits one render per diptych to the generation process pool (or, with
+    DIPTYCH_RENDER_SPOOL, to the render spool) and collects results as they
+    finish.  Output files are still numbered in the requested order.  Progress is tracked in `progress_data` and can be
+    polled via `/get_generation_progress` or followed as server-sent events
+    on `/generation_events/<job_id>`.  Failed items are listed in `errors`
+    by index, and `error` holds the first failure message.
     """
-    global progress_data, diptych_order, current_generation_job_id
+    global progress_data
     data = request.get_json() or {}
     diptych_jobs = data.get('pairs', [])
     if not isinstance(diptych_jobs, list):
@@ -611,13 +1814,13 @@ def generate_diptychs():
         return jsonify({"error": "At least one image is required for generation"}), 400
 
     should_zip = bool(data.get('zip', True))
+    # Streamed archives are assembled in the download response instead of on disk.
+    stream_zip = should_zip and bool(data.get('stream_zip', False))
     order = data.get('order')
     if isinstance(order, list):
-        with order_lock:
-            diptych_order = order
+        state.set_value('diptych_order', order)
     else:
-        with order_lock:
-            order = list(diptych_order)
+        order = state.get_value('diptych_order', [])
     if order:
         order_map = {
             (item.get('image1'), item.get('image2')): idx
@@ -641,109 +1844,374 @@ def generate_diptychs():
         "total": len(diptych_jobs),
         "output_dir": output_dir,
         "should_zip": should_zip,
+        "stream_zip": stream_zip,
+        "zip_path": None,
         "final_paths": [],
+        "failed": 0,
+        "errors": [],
         "error": None,
         "created_at": time.time(),
+        "spooled": bool(RENDER_SPOOL_DIR),
         "done": False,
     }
+    results: list[str | None] = [None] * len(diptych_jobs)
+    settled = [False] * len(diptych_jobs)
+    completed: queue.Queue = queue.Queue()
+    archive_writer = None
+    if should_zip and not stream_zip:
+        archive_writer = IncrementalZipWriter(os.path.join(output_dir, "diptych_results.zip"))
+    # Room for one event per item plus the summary, so a reconnecting
+    # client can replay the whole job.
+    events = event_stream.EventLog(maxlen=len(diptych_jobs) + 1)
     with progress_lock:
         progress_data = progress_entry
-    with generation_lock:
-        generation_jobs[job_id] = progress_entry
-        current_generation_job_id = job_id
+        running_generations.add(job_id)
+    generation_jobs.put(job_id, progress_entry)
+    generation_events.put(job_id, events)
+    state.set_value('current_generation_job', job_id)
+
+    def record_result(idx, created_path=None, error=None):
+        with progress_lock:
+            settled[idx] = True
+            progress_entry["processed"] += 1
+            if error is None:
+                results[idx] = created_path
+            else:
+                progress_entry["failed"] += 1
+                progress_entry["errors"].append({"index": idx, "error": error})
+                if progress_entry["error"] is None:
+                    progress_entry["error"] = error
+            # Only the counters: final_paths and errors grow with the batch
+            # and are written once the job is done.
+            generation_jobs.save(job_id, progress_entry, fields=("processed", "failed", "error"))
+            counts = {
+                "processed": progress_entry["processed"],
+                "failed": progress_entry["failed"],
+                "total": progress_entry["total"],
+            }
+        # Each event describes one item, so a batch streams O(n) bytes.
+        if error is None:
+            events.publish("item", {"index": idx, "file": os.path.basename(created_path or ''), **counts})
+        else:
+            events.publish("failed", {"index": idx, "error": error, **counts})
+
+    def flush_archive():
+        if archive_writer is not None:
+            # Only the generation task writes the archive, so the lock is not
+            # held for I/O.
+            with progress_lock:
+                ready = list(zip(settled, results))
+            archive_writer.add_ready(ready)
+
+    def on_render_done(future, idx, final_path, ticket):
+        # Runs as soon as the render finishes, even while the generation task
+        # is still waiting to admit later items, so progress stays current.
+        if ticket is not None:
+            memory_governor.release(ticket)
+            generation_slots.release()
+        try:
+            if future.cancelled():
+                return
+            created_path = future.result()
+            if not created_path or not os.path.exists(created_path):
+                raise RuntimeError(f"Output was not created: {os.path.basename(final_path)}")
+        except Exception as e:
+            logger.error("Generation job %s item %d failed: %s", job_id, idx + 1, e)
+            record_result(idx, error=str(e))
+        else:
+            record_result(idx, created_path)
+        finally:
+            completed.put(future)
 
     def run_generation_task():
+        futures = {}
         try:
+            pool = get_generation_executor()
             for idx, job in enumerate(diptych_jobs):
-                pair = job.get('pair', [])
-                config = job.get('config', {})
-                image1 = resolve_uploaded_image(pair_image_at(pair, 0))
-                image2 = resolve_uploaded_image(pair_image_at(pair, 1))
-                if not image1 and not image2:
-                    raise ValueError('At least one image is required for each output')
-                normalized, final_dims, _, outer_border_px, gap_px = normalize_config(
-                    config,
-                    both_images=bool(image1 and image2),
-                )
+                try:
+                    pair = job.get('pair', [])
+                    config = job.get('config', {})
+                    image1 = resolve_uploaded_image(pair_image_at(pair, 0))
+                    image2 = resolve_uploaded_image(pair_image_at(pair, 1))
+                    if not image1 and not image2:
+                        raise ValueError('At least one image is required for each output')
+                    normalized, final_dims, processing_dims, outer_border_px, gap_px = diptych_creator.normalize_config(
+                        config,
+                        both_images=bool(image1 and image2),
+                    )
+                    low_memory = (
+                        normalized['low_memory']
+                        or final_dims[0] * final_dims[1] > LOW_MEMORY_CANVAS_PIXELS
+                    )
+                    cost = estimate_job_bytes(image1, image2, final_dims, processing_dims, low_memory)
+                    if not low_memory and cost > memory_governor.budget_bytes:
+                        # Fall back to strip rendering before rejecting the item.
+                        low_memory = True
+                        cost = estimate_job_bytes(image1, image2, final_dims, processing_dims, low_memory)
+                    if RENDER_SPOOL_DIR:
+                        # Spool workers render within their own machine's memory.
+                        ticket = None
+                    else:
+                        generation_slots.acquire()
+                        try:
+                            # Waits here (reported as queue_position) until memory frees up.
+                            ticket = memory_governor.acquire(cost, key=job_id, priority=resource_governor.PRIORITY_BATCH)
+                        except BaseException:
+                            generation_slots.release()
+                            raise
+                except Exception as e:
+                    logger.warning("Generation job %s item %d is invalid: %s", job_id, idx + 1, e)
+                    record_result(idx, error=str(e))
+                    if progress_entry["spooled"]:
+                        # The spool has no outcome for this item, so the record
+                        # keeps it for recover_spooled_progress.
+                        with progress_lock:
+                            generation_jobs.save(job_id, progress_entry, fields=("errors",))
+                    flush_archive()
+                    continue
                 final_path = os.path.join(output_dir, f"diptych_{idx + 1}.jpg")
-                created_path = diptych_creator.create_diptych(
-                    image1,
-                    image2,
-                    final_path,
-                    final_dims,
-                    gap_px,
-                    normalized['fit_mode'],
-                    normalized['dpi'],
-                    outer_border_px,
-                    normalized['border_color'],
-                    image1.get('crop_focus') if image1 else None,
-                    image2.get('crop_focus') if image2 else None,
-                    normalized['preserve_exif'],
+                # Spool tasks carry the job and item so their outcomes can be
+                # read back after a restart.
+                task_tags = {'job_id': job_id, 'item': idx} if progress_entry["spooled"] else {}
+                try:
+                    future = pool.submit(
+                        diptych_creator.create_diptych,
+                        image1,
+                        image2,
+                        final_path,
+                        final_dims,
+                        gap_px,
+                        normalized['fit_mode'],
+                        normalized['dpi'],
+                        outer_border_px,
+                        normalized['border_color'],
+                        image1.get('crop_focus') if image1 else None,
+                        image2.get('crop_focus') if image2 else None,
+                        normalized['preserve_exif'],
+                        low_memory=low_memory,
+                        **task_tags,
+                    )
+                except Exception:
+                    if ticket is not None:
+                        memory_governor.release(ticket)
+                        generation_slots.release()
+                    raise
+                futures[future] = idx
+                future.add_done_callback(
+                    lambda done, idx=idx, final_path=final_path, ticket=ticket:
+                        on_render_done(done, idx, final_path, ticket)
                 )
-                if not created_path or not os.path.exists(created_path):
-                    raise RuntimeError(f"Output was not created: {os.path.basename(final_path)}")
-                with progress_lock:
-                    progress_data["processed"] += 1
-                    progress_data["final_paths"].append(created_path)
+                flush_archive()
+            for _ in range(len(futures)):
+                future = completed.get()
+                if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                    raise future.exception()
+                flush_archive()
         except Exception as e:
             # Record the error so the client can be notified
             logger.exception("Generation job %s failed", job_id)
+            if isinstance(e, BrokenProcessPool):
+                reset_generation_executor()
+            for future in futures:
+                future.cancel()
             with progress_lock:
-                progress_data["error"] = str(e)
+                progress_entry["error"] = progress_entry["error"] or str(e)
+                generation_jobs.save(job_id, progress_entry)
         finally:
+            zip_path = None
+            if archive_writer is not None:
+                try:
+                    zip_path = archive_writer.close()
+                except Exception as e:
+                    logger.exception("Could not write archive for generation job %s", job_id)
+                    with progress_lock:
+                        progress_entry["error"] = progress_entry["error"] or str(e)
             with progress_lock:
-                progress_data["done"] = True
-    # Schedule the generation on the thread pool
-    executor.submit(run_generation_task)
+                # Kept in the requested order even though renders finish out
+                # of order.
+                progress_entry["final_paths"] = [path for path in results if path]
+                progress_entry["errors"].sort(key=lambda item: item["index"])
+                progress_entry["zip_path"] = zip_path
+                progress_entry["done"] = True
+                generation_jobs.save(job_id, progress_entry)
+                running_generations.discard(job_id)
+                summary = {
+                    "processed": progress_entry["processed"],
+                    "failed": progress_entry["failed"],
+                    "total": progress_entry["total"],
+                    "error": progress_entry["error"],
+                }
+            events.publish("done", summary)
+            events.close()
+    # Schedule the generation on the batch thread pool
+    batch_executor.submit(run_generation_task)
     return jsonify({"status": "started", "total": len(diptych_jobs), "job_id": job_id})
 
+@app.route('/cache_stats')
+def cache_stats():
+    """Return render cache, memory budget and job store counters for diagnostics."""
+    return jsonify({
+        'cells': diptych_creator.cell_cache.stats(),
+        'previews': preview_cache.stats(),
+        'memory': memory_governor.snapshot(),
+        'jobs': {
+            'previews': preview_jobs.stats(),
+            'generations': generation_jobs.stats(),
+            'downloads': download_registry.stats(),
+        },
+    })
+
+def recover_spooled_progress(snapshot):
+    """
+    Fill in a spooled generation job from the outcomes left in the spool.
+
+    The stored record only gets its output paths when the generation task
+    finishes. When that task is not running in this process, for instance
+    after a restart, the outcomes the spool workers wrote for the job say
+    which items settled. Once all of them have, the recovered record is
+    saved as done; its outputs are then offered as a streamed ZIP, since the
+    archive the task was writing was never finished.
+    """
+    if not RENDER_SPOOL_DIR or not snapshot.get("spooled") or snapshot.get("done"):
+        return snapshot
+    job_id = snapshot["job_id"]
+    with progress_lock:
+        if job_id in running_generations:
+            return snapshot
+    outcomes = render_spool.RenderSpool(RENDER_SPOOL_DIR).job_results(job_id)
+    if not outcomes:
+        return snapshot
+    errors = {item["index"]: item for item in snapshot.get("errors", [])}
+    paths = {}
+    for outcome in outcomes:
+        idx = outcome.get("item")
+        if idx is None:
+            continue
+        if "error" in outcome:
+            errors[idx] = {"index": idx, "error": outcome["error"]}
+        elif outcome.get("value") and os.path.exists(outcome["value"]):
+            paths[idx] = outcome["value"]
+        else:
+            errors[idx] = {"index": idx, "error": f"Output was not created: diptych_{idx + 1}.jpg"}
+    recovered = dict(snapshot)
+    recovered["errors"] = [errors[idx] for idx in sorted(errors)]
+    recovered["failed"] = max(snapshot.get("failed", 0), len(errors))
+    recovered["processed"] = max(snapshot.get("processed", 0), len(paths) + len(errors))
+    recovered["error"] = snapshot.get("error") or (recovered["errors"][0]["error"] if errors else None)
+    recovered["final_paths"] = [paths[idx] for idx in sorted(paths)]
+    if recovered["processed"] >= recovered["total"]:
+        recovered["done"] = True
+        recovered["stream_zip"] = recovered["should_zip"]
+        recovered["zip_path"] = None
+        generation_jobs.save(job_id, recovered)
+    return recovered
+
 @app.route('/get_generation_progress')
 def get_generation_progress():
     """Return the current generation progress.  If an error occurred during
     background processing, include the error message in the response."""
-    job_id = request.args.get('job_id') or current_generation_job_id
+    job_id = request.args.get('job_id') or state.get_value('current_generation_job')
     if job_id:
-        with generation_lock:
-            job = generation_jobs.get(job_id)
+        job = generation_jobs.get(job_id)
         if job:
-            return jsonify(job)
+            with progress_lock:
+                snapshot = dict(job)
+            snapshot = recover_spooled_progress(snapshot)
+            snapshot['queue_position'] = memory_governor.position(job_id)
+            return jsonify(snapshot)
     with progress_lock:
         return jsonify(progress_data)
 
+@app.route('/generation_events/<job_id>')
+def get_generation_events(job_id):
+    """
+    Stream a generation job's progress as server-sent events.
+
+    ``item`` and ``failed`` events report each diptych as it settles, with
+    its index and the running ``processed``/``failed``/``total`` counts. A
+    final ``done`` event carries the job summary and ends the stream. A
+    client that reconnects resumes after its ``Last-Event-ID``.
+    """
+    events = generation_events.get(job_id)
+    if events is None:
+        return "Invalid job id", 404
+    after = event_stream.last_event_id(request.headers, request.args)
+    return event_stream_response(events, after)
+
 @app.route('/finalize_download')
 def finalize_download():
-    job_id = request.args.get('job_id') or current_generation_job_id
-    with generation_lock:
+    """Return download handles for a finished generation job.
+
+    ZIP archives are written while the job runs, so this only waits for the
+    job to finish (it may be called right after the last item is counted)
+    and registers the result; no lock is held during file I/O. When some
+    items failed, the others are still offered and ``failed``, ``errors``
+    and a ``warning`` describe what is missing.
+    """
+    job_id = request.args.get('job_id') or state.get_value('current_generation_job')
+    deadline = time.time() + FINALIZE_WAIT_SECONDS
+    while True:
+        # Fetched on every pass: a record shared by another process is a copy.
         selected_progress = generation_jobs.get(job_id) if job_id else None
-    if selected_progress is None:
         with progress_lock:
-            selected_progress = dict(progress_data)
-    with progress_lock:
-        if not selected_progress.get("final_paths"):
-            return jsonify({"error": "No files to download"}), 400
-        if selected_progress.get("error"):
-            return jsonify({"error": selected_progress["error"]}), 400
-        if selected_progress["should_zip"]:
-            zip_path = os.path.join(selected_progress["output_dir"], "diptych_results.zip")
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for file_path in selected_progress["final_paths"]:
-                    if os.path.exists(file_path):
-                        zipf.write(file_path, os.path.basename(file_path))
-            return jsonify({"download_path": zip_path, "download_id": register_download(zip_path), "is_zip": True})
-        else:
+            snapshot = dict(selected_progress if selected_progress is not None else progress_data)
+        snapshot = recover_spooled_progress(snapshot)
+        if snapshot.get("done", True) or time.time() >= deadline:
+            break
+        time.sleep(0.05)
+    if not snapshot.get("final_paths"):
+        return jsonify({"error": snapshot.get("error") or "No files to download"}), 400
+    report = {}
+    if snapshot.get("error"):
+        missing = snapshot.get("total", 0) - len(snapshot["final_paths"])
+        report = {
+            "failed": snapshot.get("failed", 0),
+            "errors": snapshot.get("errors", []),
+            "warning": f"{missing} of {snapshot.get('total', 0)} diptychs could not be generated: {snapshot['error']}",
+        }
+    if snapshot["should_zip"]:
+        if snapshot.get("stream_zip"):
             return jsonify({
-                "download_paths": selected_progress["final_paths"],
-                "download_ids": [register_download(path) for path in selected_progress["final_paths"]],
-                "is_zip": False,
+                "download_url": f"/stream_zip?job_id={snapshot['job_id']}",
+                "is_zip": True,
+                **report,
             })
+        zip_path = snapshot.get("zip_path")
+        if not zip_path or not os.path.exists(zip_path):
+            return jsonify({"error": "Archive is not ready yet"}), 409
+        return jsonify({"download_path": zip_path, "download_id": register_download(zip_path), "is_zip": True, **report})
+    return jsonify({
+        "download_paths": snapshot["final_paths"],
+        "download_ids": [register_download(path) for path in snapshot["final_paths"]],
+        "is_zip": False,
+        **report,
+    })
+
+@app.route('/stream_zip')
+def stream_zip():
+    """Stream a finished job's outputs as a ZIP without writing an archive file."""
+    job_id = request.args.get('job_id')
+    job = generation_jobs.get(job_id) if job_id else None
+    if not job:
+        return "File not found or access denied", 404
+    with progress_lock:
+        job = dict(job)
+    job = recover_spooled_progress(job)
+    paths = list(job.get("final_paths") or [])
+    done = job.get("done")
+    paths = [path for path in paths if is_safe_output_path(path) and os.path.exists(path)]
+    if not done or not paths:
+        return "File not found or access denied", 404
+    response = app.response_class(stream_zip_archive(paths), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename=diptych_results.zip'
+    return response
 
 @app.route('/download_file')
 def download_file():
     download_id = request.args.get('id')
     path = None
     if download_id:
-        with download_lock:
-            path = download_registry.get(download_id)
+        path = download_registry.get(download_id)
         if not path:
             return "File not found or access denied", 404
     else:
@@ -754,7 +2222,8 @@ def download_file():
     return "File not found or access denied", 404
 
 if __name__ == '__main__':
-    # Running directly will start the Flask server
+    # Running directly will start the Flask development server; serve.py
+    # runs the same app under a production WSGI server.
     logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
     start_background_services(clean_cache=os.environ.get('DIPTYCH_CLEAN_CACHE', '1') != '0')
     host = os.environ.get('FLASK_HOST', '127.0.0.1')
@@ -5,13 +5,35 @@ This module contains the core logic for processing and combining images into
 diptychs. It provides helpers to calculate output dimensions based on the
 requested print size and DPI, applies EXIF orientation correction, crops or
 fits images into their half of the diptych, and stitches the images onto a
-final canvas. The functions are deliberately stateless so they can be reused
-for both WYSIWYG previews and final generation.
+final canvas. The rendering functions take everything they need as
+arguments so they can be reused for both WYSIWYG previews and final
+generation. The only state they share within a process is the bounded
+``cell_cache`` of processed preview halves and the thread pool that
+processes the second half.
+
+The end of the module holds a batch command line that renders a manifest
+without the web app and keeps a report in the output folder, so a rerun
+skips outputs that are already up to date.
 """
 
-from PIL import Image, ExifTags
+from PIL import Image, ExifTags, ImageColor
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import argparse
+import csv
+import hashlib
+import json
 import logging
+import math
+import mmap
+import multiprocessing
 import os
+import sys
+import tempfile
+import threading
+import time
+
+import resource_governor
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +44,24 @@ try:
 except (AttributeError, StopIteration):
     ORIENTATION_TAG = None
 
+# Pillow releases the GIL while decoding and resampling, so the second half of
+# a diptych is processed on this pool while the caller handles the first.
+_half_executor: ThreadPoolExecutor | None = None
+_half_executor_lock = threading.Lock()
+
+def _get_half_executor():
+    global _half_executor
+    with _half_executor_lock:
+        if _half_executor is None:
+            _half_executor = ThreadPoolExecutor(
+                max_workers=os.cpu_count() or 2,
+                thread_name_prefix='diptych-half',
+            )
+        return _half_executor
+
+VALID_FIT_MODES = {"fill", "fit"}
+VALID_ORIENTATIONS = {"landscape", "portrait"}
+
 def calculate_pixel_dimensions(width_in, height_in, dpi):
     """Convert physical inches and DPI into pixel dimensions."""
     return (int(width_in * dpi), int(height_in * dpi))
@@ -55,6 +95,93 @@ def calculate_diptych_dimensions(config, dpi, both_images=True):
         processing_dims = (inner_w - effective_gap, inner_h)
     return final_dims, processing_dims, outer_border_px, gap_px
 
+def normalize_config(config, dpi_cap=None, both_images=True):
+    """Validate and normalize a diptych config, returning dimensions and values."""
+    config = config or {}
+    try:
+        width = float(config.get('width', 10))
+        height = float(config.get('height', 8))
+        dpi = int(config.get('dpi', 72))
+        gap = int(config.get('gap', 0))
+        outer_border = int(config.get('outer_border', 0))
+    except (TypeError, ValueError) as exc:
+        raise ValueError('Width, height, DPI, spacing, and border must be numeric') from exc
+
+    if width <= 0 or height <= 0:
+        raise ValueError('Width and height must be greater than zero')
+    if dpi <= 0 or dpi > 1200:
+        raise ValueError('DPI must be between 1 and 1200')
+    if gap < 0 or outer_border < 0:
+        raise ValueError('Spacing and outer border cannot be negative')
+    if dpi_cap is not None:
+        dpi = min(dpi, dpi_cap)
+
+    orientation = config.get('orientation') or 'landscape'
+    if orientation not in VALID_ORIENTATIONS:
+        raise ValueError('Orientation must be landscape or portrait')
+
+    fit_mode = config.get('fit_mode', 'fill')
+    if fit_mode not in VALID_FIT_MODES:
+        raise ValueError('Image fitting must be fill or fit')
+
+    border_color = config.get('border_color', 'white')
+    try:
+        ImageColor.getrgb(border_color)
+    except ValueError as exc:
+        raise ValueError('Border color is not valid') from exc
+
+    normalized = {
+        'width': width,
+        'height': height,
+        'dpi': dpi,
+        'gap': gap,
+        'outer_border': outer_border,
+        'orientation': orientation,
+        'fit_mode': fit_mode,
+        'border_color': border_color,
+        'preserve_exif': bool(config.get('preserve_exif')),
+        'low_memory': bool(config.get('low_memory')),
+    }
+    final_dims, processing_dims, outer_border_px, gap_px = calculate_diptych_dimensions(
+        normalized,
+        dpi,
+        both_images=both_images,
+    )
+    return normalized, final_dims, processing_dims, outer_border_px, gap_px
+
+def calculate_preview_dimensions(config, dpi, box, both_images=True):
+    """
+    Return ``calculate_diptych_dimensions`` output scaled to fit a pixel box.
+
+    The canvas is scaled uniformly so it fits within ``box`` (never above
+    its output size), and the gap and outer border are scaled by the same
+    factor so the preview keeps the output's proportions. A non-zero gap
+    or border stays at least one pixel wide so it remains visible.
+    """
+    final_dims, processing_dims, outer_border_px, gap_px = calculate_diptych_dimensions(
+        config, dpi, both_images
+    )
+    scale = min(1.0, box[0] / final_dims[0], box[1] / final_dims[1])
+    if scale >= 1.0:
+        return final_dims, processing_dims, outer_border_px, gap_px
+
+    def scaled(value):
+        return max(1, round(value * scale)) if value > 0 else 0
+
+    preview_dims = (scaled(final_dims[0]), scaled(final_dims[1]))
+    border = scaled(outer_border_px)
+    gap = scaled(gap_px)
+    effective_gap = gap if both_images else 0
+    inner_w = preview_dims[0] - 2 * border
+    inner_h = preview_dims[1] - 2 * border
+    if config.get('orientation') == 'portrait':
+        processing = (inner_w, inner_h - effective_gap)
+    else:
+        processing = (inner_w - effective_gap, inner_h)
+    if processing[0] <= 0 or processing[1] <= 0:
+        raise ValueError('Preview area is too small for the selected spacing and border')
+    return preview_dims, processing, border, gap
+
 def calculate_processing_dimensions_from_final(final_dims, gap_px, outer_border_px=0, both_images=True):
     """Return combined processing dimensions from an already-final canvas size."""
     final_width, final_height = final_dims
@@ -71,6 +198,226 @@ def calculate_processing_dimensions_from_final(final_dims, gap_px, outer_border_
         raise ValueError('Image spacing is too large for the selected output size')
     return (inner_w, inner_h - effective_gap)
 
+def estimate_render_bytes(final_dims, processing_dims, source_sizes=(), low_memory=False):
+    """
+    Estimate the peak pixel memory in bytes needed to render one diptych.
+
+    Pillow keeps RGB pixels in 4 bytes. The in-memory path holds the canvas,
+    both processed halves and both decoded sources at once; the strip path
+    holds a few bands and one decoded source at a time.
+    """
+    source_bytes = [width * height * 4 for width, height in source_sizes]
+    if low_memory:
+        # A band plus its resampling intermediate.
+        return 2 * STRIP_HEIGHT * final_dims[0] * 4 + max(source_bytes, default=0)
+    canvas_bytes = final_dims[0] * final_dims[1] * 4
+    cell_bytes = processing_dims[0] * processing_dims[1] * 4
+    return canvas_bytes + cell_bytes + sum(source_bytes)
+
+def calculate_reduced_decode_scale(oriented_size, cell_size, fit_mode='fill'):
+    """
+    Return the smallest decode scale that still covers the target cell, or None
+    when a reduced decode would not save anything.
+
+    ``oriented_size`` is the source size after EXIF orientation, manual and
+    automatic rotation, so it can be compared directly with ``cell_size``.
+    The scale factor is uniform, which means it applies to the
+    raw (stored) image dimensions as well.
+    """
+    width, height = oriented_size
+    if width <= 0 or height <= 0:
+        return None
+    scale = _cover_scale(oriented_size, cell_size, fit_mode)
+    # JPEG DCT scaling only offers 1/2, 1/4 and 1/8 reductions.
+    if scale * 2 > 1:
+        return None
+    return scale
+
+def _cover_scale(oriented_size, cell_size, fit_mode='fill'):
+    """Return the resize factor from an upright source to its cell."""
+    width, height = oriented_size
+    half_w, half_h = cell_size
+    if fit_mode == 'fill':
+        # The crop keeps the full extent of one axis, so that axis decides.
+        return max(half_w / width, half_h / height)
+    return min(half_w / width, half_h / height)
+
+def _exif_orientation(img):
+    """Return the EXIF orientation value of an image, defaulting to 1."""
+    if not ORIENTATION_TAG or not hasattr(img, '_getexif'):
+        return 1
+    try:
+        exif = img._getexif()
+        if exif and ORIENTATION_TAG in exif:
+            return int(exif[ORIENTATION_TAG])
+    except Exception:
+        pass
+    return 1
+
+def oriented_image_size(img):
+    """
+    Return ``(orientation, (width, height))`` for an opened image, where the
+    size is the upright size after EXIF orientation. Only the header is read.
+    """
+    orientation = _exif_orientation(img)
+    transform = EXIF_ORIENTATION_TRANSFORMS.get(orientation, IDENTITY_TRANSFORM)
+    return orientation, _transform_size(img.size, transform)
+
+def _request_reduced_decode(img, oriented_size, cell_size, fit_mode='fill'):
+    """
+    Ask the JPEG decoder to decode at 1/2, 1/4 or 1/8 scale when the target
+    cell is small enough. Must be called before the pixel data is loaded.
+    Returns True when the decoder accepted a reduced size.
+    """
+    if img.format != 'JPEG':
+        return False
+    scale = calculate_reduced_decode_scale(oriented_size, cell_size, fit_mode)
+    if scale is None:
+        return False
+    raw_size = img.size
+    img.draft(img.mode, (math.ceil(raw_size[0] * scale), math.ceil(raw_size[1] * scale)))
+    return img.size != raw_size
+
+# Right-angle transforms are stored as (quarter_turns, mirrored): the image is
+# mirrored left-right first (when mirrored) and then rotated counter-clockwise
+# by quarter_turns * 90 degrees. Every EXIF orientation, UI rotation and
+# auto-rotation can be folded into one of these eight values.
+IDENTITY_TRANSFORM = (0, False)
+EXIF_ORIENTATION_TRANSFORMS = {
+    1: (0, False),
+    2: (0, True),
+    3: (2, False),
+    4: (2, True),
+    5: (1, True),
+    6: (3, False),
+    7: (3, True),
+    8: (1, False),
+}
+_TRANSFORMS_BY_METHOD = {}
+TRANSPOSE_METHODS = {
+    (0, False): None,
+    (1, False): Image.Transpose.ROTATE_90,
+    (2, False): Image.Transpose.ROTATE_180,
+    (3, False): Image.Transpose.ROTATE_270,
+    (0, True): Image.Transpose.FLIP_LEFT_RIGHT,
+    (1, True): Image.Transpose.TRANSPOSE,
+    (2, True): Image.Transpose.FLIP_TOP_BOTTOM,
+    (3, True): Image.Transpose.TRANSVERSE,
+}
+_TRANSFORMS_BY_METHOD.update((method, transform) for transform, method in TRANSPOSE_METHODS.items())
+
+# Rows rendered per band by the low-memory writer. Peak memory for the output
+# is roughly one band per cell rather than the whole canvas.
+STRIP_HEIGHT = 256
+
+def compose_transforms(first, second):
+    """Return the single transform equivalent to applying first, then second."""
+    turns1, mirrored1 = first
+    turns2, mirrored2 = second
+    # Mirroring after a rotation reverses the direction of that rotation.
+    turns = turns2 - turns1 if mirrored2 else turns2 + turns1
+    return (turns % 4, mirrored1 != mirrored2)
+
+def _invert_transform(transform):
+    turns, mirrored = transform
+    if mirrored:
+        return transform
+    return ((-turns) % 4, False)
+
+def _transform_size(size, transform):
+    width, height = size
+    if transform[0] % 2:
+        return (height, width)
+    return (width, height)
+
+def transform_box(box, size, transform):
+    """Map a (left, top, right, bottom) box through a right-angle transform."""
+    left, top, right, bottom = box
+    width, height = size
+    turns, mirrored = transform
+    if mirrored:
+        left, right = width - right, width - left
+    for _ in range(turns):
+        # A 90° counter-clockwise turn sends (x, y) to (y, width - x).
+        left, top, right, bottom = top, width - right, bottom, width - left
+        width, height = height, width
+    return (left, top, right, bottom)
+
+def _fit_size(size, cell_size):
+    """Return the size Image.thumbnail would produce for size within cell_size."""
+    width, height = size
+    max_w, max_h = cell_size
+    if max_w >= width and max_h >= height:
+        return (width, height)
+    aspect = width / height
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    if max_w / max_h >= aspect:
+        return (round_aspect(max_h * aspect, key=lambda n: abs(aspect - n / max_h)), max_h)
+    return (max_w, round_aspect(max_w / aspect, key=lambda n: 0 if n == 0 else abs(aspect - max_w / n)))
+
+def plan_source_geometry(
+    source_size,
+    cell_size,
+    orientation=1,
+    rotation_override=0,
+    fit_mode='fill',
+    auto_rotate=True,
+    crop_focus=None,
+):
+    """
+    Fold EXIF orientation, the manual rotation, auto-rotation and the fill
+    crop into a single crop/resize/transpose plan on the stored pixels.
+
+    Returns ``(source_box, resized_size, transpose_method, oriented_size)``:
+    resize ``source_box`` of the stored image to ``resized_size`` (both in
+    stored orientation), then apply ``transpose_method`` when it is not None.
+    ``oriented_size`` is the upright size of the whole source before cropping.
+    ``rotation_override`` must be a multiple of 90 degrees clockwise.
+    """
+    half_w, half_h = cell_size
+    transform = compose_transforms(
+        EXIF_ORIENTATION_TRANSFORMS.get(orientation, IDENTITY_TRANSFORM),
+        ((-int(rotation_override) // 90) % 4, False),
+    )
+    width, height = _transform_size(source_size, transform)
+    # Auto rotate to match cell orientation
+    if auto_rotate and half_w != half_h:
+        cell_landscape = half_w > half_h
+        img_landscape = width > height
+        if cell_landscape != img_landscape:
+            transform = compose_transforms(transform, (1, False))
+            width, height = height, width
+    if fit_mode == 'fill':
+        target_aspect = half_w / half_h
+        img_aspect = width / height
+        # Choose crop focus; default center
+        focus_x, focus_y = 0.5, 0.5
+        if crop_focus:
+            fx, fy = crop_focus
+            focus_x = min(max(float(fx), 0.0), 1.0)
+            focus_y = min(max(float(fy), 0.0), 1.0)
+        if img_aspect > target_aspect:
+            # Image is wider than target; crop horizontally
+            new_width = int(target_aspect * height)
+            offset = int((width - new_width) * focus_x)
+            box = (offset, 0, offset + new_width, height)
+        else:
+            # Image is taller than target; crop vertically
+            new_height = int(width / target_aspect)
+            offset = int((height - new_height) * focus_y)
+            box = (0, offset, width, offset + new_height)
+        resized = (half_w, half_h)
+    else:
+        box = (0, 0, width, height)
+        resized = _fit_size((width, height), (half_w, half_h))
+    inverse = _invert_transform(transform)
+    source_box = transform_box(box, (width, height), inverse)
+    resized_size = _transform_size(resized, inverse)
+    return source_box, resized_size, TRANSPOSE_METHODS[transform], (width, height)
+
 def _flatten_to_rgb(img, background_color='white'):
     """Return an RGB image, compositing alpha against the configured background."""
     if img.mode == 'RGB':
@@ -104,40 +451,298 @@ def apply_exif_orientation(img):
     If the orientation tag is missing or an unexpected value is encountered,
     the image is returned unchanged.
     """
-    if not ORIENTATION_TAG or not hasattr(img, '_getexif'):
-        return img
-    try:
-        exif = img._getexif()
-        if exif and ORIENTATION_TAG in exif:
-            orientation = exif[ORIENTATION_TAG]
-            # Map of orientation codes to operations.
-            if orientation == 2:
-                # Mirror horizontally
-                img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
-            elif orientation == 3:
-                # Rotate 180 degrees
-                img = img.rotate(180, expand=True)
-            elif orientation == 4:
-                # Mirror vertically
-                img = img.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
-            elif orientation == 5:
-                # Mirror horizontally and rotate 90° CCW
-                img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
-                img = img.rotate(90, expand=True)
-            elif orientation == 6:
-                # Rotate 90° CW
-                img = img.rotate(-90, expand=True)
-            elif orientation == 7:
-                # Mirror horizontally and rotate 90° CW
-                img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
-                img = img.rotate(-90, expand=True)
-            elif orientation == 8:
-                # Rotate 90° CCW
-                img = img.rotate(90, expand=True)
-    except Exception:
-        # If anything goes wrong while reading EXIF, return original
+    method = TRANSPOSE_METHODS.get(EXIF_ORIENTATION_TRANSFORMS.get(_exif_orientation(img)))
+    if method is None:
         return img
-    return img
+    return img.transpose(method)
+
+# Long edges of the EXIF-normalized proxies kept for each upload, largest
+# first. The smallest level doubles as the image pool thumbnail.
+PROXY_LEVELS = (4096, 2048, 1024, 300)
+
+def _has_transparency(img):
+    return img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+
+def write_proxy_pyramid(source, level_paths, quality=90):
+    """
+    Write EXIF-normalized JPEG proxies from an opened source image.
+
+    Parameters
+    ----------
+    source : PIL.Image
+        The full-resolution source, opened but not yet loaded so a reduced
+        JPEG decode can still be requested.
+    level_paths : dict
+        Maps a long edge in pixels to the proxy path for that level.
+    quality : int, optional
+        JPEG quality used for every level.
+
+    Each level is fitted within a square of its long edge, downscaled from
+    the next larger level so the source is decoded only once (at a reduced
+    JPEG scale when possible). Levels that would not be smaller than the
+    source are skipped, except the smallest, which is always written for
+    use as a thumbnail. Transparent sources only get the smallest level,
+    flattened against white, because a JPEG proxy cannot carry their alpha.
+    Files are written under a temporary name and moved into place.
+
+    Returns
+    -------
+    tuple of (list of str, PIL.Image)
+        The proxy paths written, largest first, and the smallest level.
+    """
+    edges = sorted(level_paths, reverse=True)
+    written = []
+    transparent = _has_transparency(source)
+    _, oriented_size = oriented_image_size(source)
+    long_edge = max(oriented_size)
+    wanted = [edge for edge in edges if edge < long_edge and not transparent]
+    if edges[-1] not in wanted:
+        wanted.append(edges[-1])
+    if source.format == 'JPEG':
+        scale = min(1.0, wanted[0] / long_edge)
+        source.draft(source.mode, (math.ceil(source.width * scale), math.ceil(source.height * scale)))
+    img = apply_exif_orientation(source)
+    if transparent:
+        img = _flatten_to_rgb(img, 'white')
+    elif img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    elif img is source:
+        # Keep the result usable after the caller closes the source.
+        img = img.copy()
+    for edge in wanted:
+        size = _fit_size(img.size, (edge, edge))
+        if size != img.size:
+            img = img.resize(size, Image.Resampling.LANCZOS)
+        path = level_paths[edge]
+        partial = f"{path}.part"
+        img.save(partial, 'JPEG', quality=quality)
+        os.replace(partial, path)
+        written.append(path)
+    return written, img
+
+def build_proxy_pyramid(image_path, level_paths, quality=90):
+    """Open ``image_path`` and return the paths ``write_proxy_pyramid`` wrote."""
+    with Image.open(image_path) as source:
+        written, _ = write_proxy_pyramid(source, level_paths, quality)
+    return written
+
+def select_proxy(
+    image_path,
+    proxies,
+    cell_size,
+    rotation_override=0,
+    fit_mode='fill',
+    auto_rotate=True,
+    crop_focus=None,
+):
+    """
+    Return the smallest proxy that still covers the cell, else ``image_path``.
+
+    A proxy covers the cell when producing the cell from it needs no
+    upscaling. Proxies no smaller than the source are ignored, as are all
+    proxies of transparent sources and arbitrary-angle rotations. Missing
+    or unreadable proxies are skipped.
+
+    Choices are remembered in ``proxy_choices`` under the identity of the
+    source and of every existing proxy, so repeated previews of the same
+    cell only stat the files instead of reading their headers.
+    """
+    if not proxies or rotation_override % 90:
+        return image_path
+    key = _proxy_choice_key(image_path, proxies, cell_size, rotation_override, fit_mode, auto_rotate, crop_focus)
+    choice = proxy_choices.get(key)
+    if choice is None:
+        choice = _choose_proxy(image_path, proxies, cell_size, rotation_override, fit_mode, auto_rotate, crop_focus)
+        proxy_choices.put(key, choice)
+    return choice
+
+def _proxy_choice_key(image_path, proxies, cell_size, rotation_override, fit_mode, auto_rotate, crop_focus):
+    """Return the ``proxy_choices`` key: the inputs plus each file's identity."""
+    files = []
+    for path in (image_path, *proxies):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if path == image_path:
+                raise
+            continue  # A missing proxy is skipped, so it is not part of the key.
+        files.append((os.path.abspath(path), stat.st_mtime_ns, stat.st_size, stat.st_ino))
+    focus = tuple(crop_focus) if crop_focus else None
+    return (tuple(files), tuple(cell_size), rotation_override, fit_mode, bool(auto_rotate), focus)
+
+def _choose_proxy(image_path, proxies, cell_size, rotation_override, fit_mode, auto_rotate, crop_focus):
+    with Image.open(image_path) as source:
+        if _has_transparency(source):
+            return image_path
+        source_pixels = source.width * source.height
+    candidates = []
+    for path in proxies:
+        try:
+            with Image.open(path) as proxy:
+                size = proxy.size
+        except (OSError, ValueError):
+            continue
+        if size[0] * size[1] < source_pixels:
+            candidates.append((size[0] * size[1], path, size))
+    for _, path, size in sorted(candidates):
+        # Proxies are upright, so only the UI and auto rotations remain.
+        oriented_size = plan_source_geometry(
+            size, cell_size, 1, rotation_override, fit_mode, auto_rotate, crop_focus
+        )[3]
+        if _cover_scale(oriented_size, cell_size, fit_mode) <= 1:
+            return path
+    return image_path
+
+class ByteBoundedLRU:
+    """
+    Thread-safe LRU cache bounded by the total size of its values.
+
+    Values larger than the whole budget are not stored. Counters for hits,
+    misses and evictions are kept for diagnostics.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def sizeof(self, value):
+        return len(value)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+class ProcessedCellCache(ByteBoundedLRU):
+    """
+    LRU cache of processed cells, stored before background flattening.
+
+    Cached images are shared between callers and must be treated as read-only.
+    """
+
+    def sizeof(self, img):
+        return self.image_bytes(img)
+
+    @staticmethod
+    def image_bytes(img):
+        # Pillow stores every multi-band mode in 4 bytes per pixel.
+        per_pixel = 1 if img.mode in ('1', 'L', 'P') else 4
+        return img.width * img.height * per_pixel
+
+# Paths picked by select_proxy; values are short strings, so 1 MB holds
+# thousands of choices.
+proxy_choices = ByteBoundedLRU(1024 * 1024)
+
+# Preview cells of this process, which repeat as the user adjusts colours and
+# borders. Final renders bypass it: their full-resolution cells would evict
+# every preview cell and bloat render worker processes. Sized by
+# DIPTYCH_CELL_CACHE_MB; 0 disables caching.
+cell_cache = ProcessedCellCache(int(float(os.environ.get('DIPTYCH_CELL_CACHE_MB', 256)) * 1024 * 1024))
+
+def processed_cell_key(image_path, cell_size, rotation_override=0, fit_mode='fill', auto_rotate=True, crop_focus=None):
+    """
+    Return the cache key for a processed cell.
+
+    The key covers every input that changes the cell pixels: the source
+    identity (path, mtime, size, inode), rotation, fit mode, auto-rotation,
+    crop focus and cell size. Border and background colours are excluded.
+    """
+    stat = os.stat(image_path)
+    focus = None
+    if fit_mode == 'fill' and crop_focus:
+        focus = tuple(min(max(float(value), 0.0), 1.0) for value in crop_focus)
+    return (
+        os.path.abspath(image_path),
+        stat.st_mtime_ns,
+        stat.st_size,
+        stat.st_ino,
+        rotation_override,
+        fit_mode,
+        bool(auto_rotate),
+        focus,
+        tuple(cell_size),
+    )
+
+def _half_cell_size(target_diptych_dims, is_landscape_diptych=None):
+    """Return the (width, height) of one half of the diptych processing area."""
+    diptych_w, diptych_h = target_diptych_dims
+    # Determine orientation, allowing the caller to override the
+    # automatic inference.  This is useful for square layouts where
+    # subtracting the gap can make the width appear smaller than the
+    # height even when the diptych should be treated as landscape.
+    if is_landscape_diptych is None:
+        is_landscape_diptych = diptych_w >= diptych_h
+    # Determine the size of one half of the diptych
+    half_w = diptych_w // 2 if is_landscape_diptych else diptych_w
+    half_h = diptych_h if is_landscape_diptych else diptych_h // 2
+    if half_w <= 0 or half_h <= 0:
+        raise ValueError('Target image cell must be at least 1 pixel in each dimension')
+    return half_w, half_h
+
+def _prepare_planned_source(img, cell_size, rotation_override=0, fit_mode='fill', auto_rotate=True, crop_focus=None):
+    """
+    Plan the geometry for an opened (not yet loaded) source image.
+
+    Returns ``(img, source_box, resized_size, transpose_method)`` as described
+    by ``plan_source_geometry``. ``img`` is a new image only when an arbitrary
+    rotation had to be applied up front.
+    """
+    orientation = _exif_orientation(img)
+    if rotation_override % 90:
+        # Arbitrary angles cannot be folded into a transpose, so apply
+        # them up front and plan the rest on the rotated pixels.
+        img = apply_exif_orientation(img)
+        # UI rotations are expressed as clockwise degrees.
+        img = img.rotate(-rotation_override, expand=True)
+        orientation, rotation_override = 1, 0
+    plan_args = (cell_size, orientation, rotation_override, fit_mode, auto_rotate, crop_focus)
+    source_box, resized_size, transpose_method, oriented_size = plan_source_geometry(img.size, *plan_args)
+    # Decode JPEGs at a reduced DCT scale when the cell is small, then
+    # re-plan against the reduced pixel grid.
+    if _request_reduced_decode(img, oriented_size, cell_size, fit_mode):
+        source_box, resized_size, transpose_method, _ = plan_source_geometry(img.size, *plan_args)
+    return img, source_box, resized_size, transpose_method
 
 def process_source_image(
     image_path: str,
@@ -148,11 +753,17 @@ def process_source_image(
     background_color: str = 'white',
     crop_focus: tuple | None = None,
     is_landscape_diptych: bool | None = None,
+    proxies: list[str] | None = None,
+    use_cache: bool = False,
 ) -> Image.Image | None:
     """
     Load an image from disk, apply EXIF orientation and manual rotation, then
     crop or fit it to the target dimensions.
 
+    Orientation, rotation, auto-rotation and cropping are planned together by
+    ``plan_source_geometry`` so the source is resampled once from the cropped
+    region and transposed once, instead of copying the full frame per step.
+
     Parameters
     ----------
     image_path : str
@@ -175,6 +786,15 @@ def process_source_image(
         image to keep during cropping.  The tuple values represent the
         horizontal and vertical position as fractions between 0.0 and 1.0
         (0.5, 0.5 corresponds to the center).  If None, the center is used.
+    is_landscape_diptych : bool or None, optional
+        Overrides the orientation inferred from ``target_diptych_dims``.
+    proxies : list of str or None, optional
+        Paths of downscaled, EXIF-normalized copies of the source (see
+        ``build_proxy_pyramid``). The smallest one that covers the cell
+        without upscaling is read instead of the source.
+    use_cache : bool, optional
+        Look the cell up in, and store it in, ``cell_cache``. Meant for
+        previews; final renders leave it off.
 
     Returns
     -------
@@ -182,113 +802,302 @@ def process_source_image(
         The processed image, or None if an error occurred.
     """
     try:
-        with Image.open(image_path) as img:
-            img = apply_exif_orientation(img)
-            if rotation_override:
-                # UI rotations are expressed as clockwise degrees.
-                img = img.rotate(-rotation_override, expand=True)
-            diptych_w, diptych_h = target_diptych_dims
-            # Determine orientation, allowing the caller to override the
-            # automatic inference.  This is useful for square layouts where
-            # subtracting the gap can make the width appear smaller than the
-            # height even when the diptych should be treated as landscape.
-            if is_landscape_diptych is None:
-                is_landscape_diptych = diptych_w >= diptych_h
-            # Determine the size of one half of the diptych
-            half_w = diptych_w // 2 if is_landscape_diptych else diptych_w
-            half_h = diptych_h if is_landscape_diptych else diptych_h // 2
-            if half_w <= 0 or half_h <= 0:
-                raise ValueError('Target image cell must be at least 1 pixel in each dimension')
-            if fit_mode not in {'fill', 'fit'}:
-                raise ValueError(f'Unsupported fit mode: {fit_mode}')
-            # Auto rotate to match cell orientation
-            if auto_rotate and half_w != half_h:
-                cell_landscape = half_w > half_h
-                img_landscape = img.width > img.height
-                if cell_landscape != img_landscape:
-                    img = img.rotate(90, expand=True)
-            target_aspect = half_w / half_h
-            if fit_mode == 'fill':
-                img_aspect = img.width / img.height
-                # Choose crop focus; default center
-                focus_x, focus_y = 0.5, 0.5
-                if crop_focus:
-                    fx, fy = crop_focus
-                    focus_x = min(max(float(fx), 0.0), 1.0)
-                    focus_y = min(max(float(fy), 0.0), 1.0)
-                if img_aspect > target_aspect:
-                    # Image is wider than target; crop horizontally
-                    new_width = int(target_aspect * img.height)
-                    max_offset = img.width - new_width
-                    offset = int(max_offset * focus_x)
-                    img = img.crop((offset, 0, offset + new_width, img.height))
-                else:
-                    # Image is taller than target; crop vertically
-                    new_height = int(img.width / target_aspect)
-                    max_offset = img.height - new_height
-                    offset = int(max_offset * focus_y)
-                    img = img.crop((0, offset, img.width, offset + new_height))
-                return _flatten_to_rgb(
-                    img.resize((half_w, half_h), Image.Resampling.LANCZOS),
-                    background_color,
+        half_w, half_h = _half_cell_size(target_diptych_dims, is_landscape_diptych)
+        if fit_mode not in {'fill', 'fit'}:
+            raise ValueError(f'Unsupported fit mode: {fit_mode}')
+        read_path = select_proxy(
+            image_path,
+            proxies,
+            (half_w, half_h),
+            rotation_override,
+            fit_mode,
+            auto_rotate,
+            crop_focus,
+        )
+        img = cache_key = None
+        if use_cache:
+            cache_key = processed_cell_key(
+                read_path,
+                (half_w, half_h),
+                rotation_override,
+                fit_mode,
+                auto_rotate,
+                crop_focus,
+            )
+            img = cell_cache.get(cache_key)
+        if img is None:
+            with Image.open(read_path) as source:
+                source, source_box, resized_size, transpose_method = _prepare_planned_source(
+                    source,
+                    (half_w, half_h),
+                    rotation_override,
+                    fit_mode,
+                    auto_rotate,
+                    crop_focus,
                 )
-            else:
-                # Fit mode: scale to fit within the cell and pad with background color
-                img.thumbnail((half_w, half_h), Image.Resampling.LANCZOS)
-                background = Image.new('RGB', (half_w, half_h), background_color)
-                paste_x = (half_w - img.width) // 2
-                paste_y = (half_h - img.height) // 2
-                if img.mode in ('RGBA', 'LA') or ('transparency' in img.info):
-                    rgba = img.convert('RGBA')
-                    background.paste(rgba.convert('RGB'), (paste_x, paste_y), rgba.getchannel('A'))
-                else:
-                    background.paste(img.convert('RGB'), (paste_x, paste_y))
-                return background
+                # One resampling pass reads only the cropped region, and the single
+                # transpose runs on the already-small result.
+                img = source.resize(resized_size, Image.Resampling.LANCZOS, box=source_box)
+            if transpose_method is not None:
+                img = img.transpose(transpose_method)
+            if cache_key is not None:
+                cell_cache.put(cache_key, img)
+        # Flattening and padding depend on the background colour, so they run
+        # after the cache and colour changes never need a re-decode.
+        if fit_mode == 'fill':
+            return _flatten_to_rgb(img, background_color)
+        # Fit mode: pad the scaled image with the background color
+        background = Image.new('RGB', (half_w, half_h), background_color)
+        paste_x = (half_w - img.width) // 2
+        paste_y = (half_h - img.height) // 2
+        if img.mode in ('RGBA', 'LA') or ('transparency' in img.info):
+            rgba = img.convert('RGBA')
+            background.paste(rgba.convert('RGB'), (paste_x, paste_y), rgba.getchannel('A'))
+        else:
+            background.paste(img.convert('RGB'), (paste_x, paste_y))
+        return background
     except Exception:
         logger.exception("Error processing %s", image_path)
         return None
 
-def create_diptych_canvas(img1, img2, final_dims, gap_px, outer_border_px=0, border_color='white'):
+def process_image_pair(
+    image_data1: dict | None,
+    image_data2: dict | None,
+    processing_dims: tuple[int, int],
+    fit_mode: str = 'fill',
+    background_color: str = 'white',
+    crop_focus1: tuple | None = None,
+    crop_focus2: tuple | None = None,
+    is_landscape_diptych: bool | None = None,
+    timings: dict | None = None,
+    use_cache: bool = False,
+) -> tuple[Image.Image | None, Image.Image | None]:
     """
-    Create the diptych canvas using the processed images. The gap is only
-    applied when both images are present. The images are centered within
-    their respective halves, respecting orientation and outer borders.
+    Process both halves of a diptych concurrently and return them in order.
+
+    ``image_data1``/``image_data2`` follow the ``create_diptych`` format, plus
+    an optional ``'proxies'`` list passed to ``process_source_image``. When a
+    ``timings`` dict is given, the seconds spent on each half are stored under
+    ``'image1'`` and ``'image2'``. ``use_cache`` is passed on to
+    ``process_source_image``. Raises RuntimeError naming the first image
+    that could not be processed.
     """
+    def run(image_data, crop_focus, key):
+        started = time.perf_counter()
+        img = process_source_image(
+            image_data['path'],
+            processing_dims,
+            image_data.get('rotation', 0),
+            fit_mode,
+            True,
+            background_color,
+            crop_focus,
+            is_landscape_diptych,
+            image_data.get('proxies'),
+            use_cache,
+        )
+        if timings is not None:
+            timings[key] = time.perf_counter() - started
+        return img
+
+    future2 = None
+    if image_data1 and image_data2:
+        future2 = _get_half_executor().submit(run, image_data2, crop_focus2, 'image2')
+    img1 = run(image_data1, crop_focus1, 'image1') if image_data1 else None
+    if future2 is not None:
+        img2 = future2.result()
+    else:
+        img2 = run(image_data2, crop_focus2, 'image2') if image_data2 else None
+    if image_data1 and img1 is None:
+        raise RuntimeError(f"Error processing image: {os.path.basename(image_data1['path'])}")
+    if image_data2 and img2 is None:
+        raise RuntimeError(f"Error processing image: {os.path.basename(image_data2['path'])}")
+    return img1, img2
+
+def _cell_layout(final_dims, gap_px, outer_border_px=0, both_images=True):
+    """Return the cell size and the top-left corner of each cell on the canvas."""
     final_width, final_height = final_dims
     is_landscape_diptych = final_width >= final_height
     # Use gap only when both images are present
-    effective_gap = gap_px if img1 and img2 else 0
+    effective_gap = gap_px if both_images else 0
     # Compute the size of each cell inside the fixed final dimensions
     inner_w = final_width - 2 * outer_border_px
     inner_h = final_height - 2 * outer_border_px
     if is_landscape_diptych:
         cell_w = (inner_w - effective_gap) // 2
         cell_h = inner_h
+        second = (outer_border_px + cell_w + effective_gap, outer_border_px)
     else:
         cell_w = inner_w
         cell_h = (inner_h - effective_gap) // 2
-    canvas = Image.new('RGB', (final_width, final_height), border_color)
+        second = (outer_border_px, outer_border_px + cell_h + effective_gap)
+    return (cell_w, cell_h), [(outer_border_px, outer_border_px), second]
+
+def create_diptych_canvas(img1, img2, final_dims, gap_px, outer_border_px=0, border_color='white'):
+    """
+    Create the diptych canvas using the processed images. The gap is only
+    applied when both images are present. The images are centered within
+    their respective halves, respecting orientation and outer borders.
+    """
+    (cell_w, cell_h), origins = _cell_layout(final_dims, gap_px, outer_border_px, bool(img1 and img2))
+    canvas = Image.new('RGB', final_dims, border_color)
     # Center images in their cells
-    if is_landscape_diptych:
-        if img1:
-            x1 = outer_border_px + (cell_w - img1.width) // 2
-            y1 = outer_border_px + (cell_h - img1.height) // 2
-            canvas.paste(img1, (x1, y1))
-        if img2:
-            x2 = outer_border_px + cell_w + effective_gap + (cell_w - img2.width) // 2
-            y2 = outer_border_px + (cell_h - img2.height) // 2
-            canvas.paste(img2, (x2, y2))
-    else:
-        if img1:
-            x1 = outer_border_px + (cell_w - img1.width) // 2
-            y1 = outer_border_px + (cell_h - img1.height) // 2
-            canvas.paste(img1, (x1, y1))
-        if img2:
-            x2 = outer_border_px + (cell_w - img2.width) // 2
-            y2 = outer_border_px + cell_h + effective_gap + (cell_h - img2.height) // 2
-            canvas.paste(img2, (x2, y2))
+    for img, (cell_x, cell_y) in zip((img1, img2), origins):
+        if img:
+            canvas.paste(img, (cell_x + (cell_w - img.width) // 2, cell_y + (cell_h - img.height) // 2))
     return canvas
 
+def _write_cell_strips(
+    buffer,
+    canvas_width,
+    image_data,
+    crop_focus,
+    cell_size,
+    cell_origin,
+    processed_size,
+    fit_mode,
+    background_color,
+    strip_height,
+):
+    """
+    Render one source image into an RGBX canvas buffer band by band.
+
+    Each band is resampled straight from the matching source region, so only
+    ``strip_height`` output rows of this image exist in memory at a time.
+    """
+    half_w, half_h = processed_size
+    with Image.open(image_data['path']) as img:
+        img, source_box, resized_size, transpose_method = _prepare_planned_source(
+            img,
+            processed_size,
+            image_data.get('rotation', 0),
+            fit_mode,
+            True,
+            crop_focus,
+        )
+        transform = _TRANSFORMS_BY_METHOD[transpose_method]
+        inverse = _invert_transform(transform)
+        out_w, out_h = _transform_size(resized_size, transform)
+        # Processed cells are centered in the canvas cell, and fit-mode
+        # content is centered within the processed cell.
+        x0 = cell_origin[0] + (cell_size[0] - half_w) // 2 + (half_w - out_w) // 2
+        y0 = cell_origin[1] + (cell_size[1] - half_h) // 2 + (half_h - out_h) // 2
+        scale_x = (source_box[2] - source_box[0]) / resized_size[0]
+        scale_y = (source_box[3] - source_box[1]) / resized_size[1]
+        stride = canvas_width * 4
+        row_bytes = out_w * 4
+        for top in range(0, out_h, strip_height):
+            bottom = min(top + strip_height, out_h)
+            left, upper, right, lower = transform_box((0, top, out_w, bottom), (out_w, out_h), inverse)
+            band = img.resize(
+                (right - left, lower - upper),
+                Image.Resampling.LANCZOS,
+                box=(
+                    source_box[0] + left * scale_x,
+                    source_box[1] + upper * scale_y,
+                    source_box[0] + right * scale_x,
+                    source_box[1] + lower * scale_y,
+                ),
+            )
+            if transpose_method is not None:
+                band = band.transpose(transpose_method)
+            data = _flatten_to_rgb(band, background_color).tobytes('raw', 'RGBX')
+            for row in range(bottom - top):
+                offset = (y0 + top + row) * stride + x0 * 4
+                buffer[offset:offset + row_bytes] = data[row * row_bytes:(row + 1) * row_bytes]
+
+def save_diptych_in_strips(
+    image_data1: dict | None,
+    image_data2: dict | None,
+    output_path: str,
+    final_dims: tuple[int, int],
+    gap_px: int,
+    fit_mode: str,
+    save_kwargs: dict,
+    outer_border_px: int = 0,
+    border_color: str = 'white',
+    crop_focus1: tuple | None = None,
+    crop_focus2: tuple | None = None,
+    strip_height: int | None = None,
+) -> None:
+    """
+    Assemble and save a diptych without holding the canvas in RAM.
+
+    The canvas lives in a memory-mapped temporary file next to the output and
+    is filled one image band at a time; the JPEG encoder then reads it
+    sequentially, so resident memory stays near one band per cell plus the
+    decoded source. The JPEG bytes match the in-memory path for the same
+    pixels and ``save_kwargs``.
+    """
+    final_width, final_height = final_dims
+    is_landscape = final_width >= final_height
+    both_images = bool(image_data1 and image_data2)
+    processing_dims = calculate_processing_dimensions_from_final(
+        final_dims,
+        gap_px,
+        outer_border_px,
+        both_images=both_images,
+    )
+    processed_size = _half_cell_size(processing_dims, is_landscape)
+    cell_size, origins = _cell_layout(final_dims, gap_px, outer_border_px, both_images)
+    strip_height = strip_height or STRIP_HEIGHT
+    stride = final_width * 4
+    border_row = Image.new('RGB', (final_width, 1), border_color).tobytes('raw', 'RGBX')
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    with tempfile.TemporaryFile(dir=output_dir) as raw:
+        raw.truncate(stride * final_height)
+        buffer = mmap.mmap(raw.fileno(), stride * final_height)
+        try:
+            for top in range(0, final_height, strip_height):
+                rows = min(strip_height, final_height - top)
+                buffer[top * stride:(top + rows) * stride] = border_row * rows
+            for image_data, crop_focus, origin in zip((image_data1, image_data2), (crop_focus1, crop_focus2), origins):
+                if not image_data:
+                    continue
+                try:
+                    _write_cell_strips(
+                        buffer,
+                        final_width,
+                        image_data,
+                        crop_focus,
+                        cell_size,
+                        origin,
+                        processed_size,
+                        fit_mode,
+                        border_color,
+                        strip_height,
+                    )
+                except Exception as exc:
+                    logger.exception("Error processing %s", image_data['path'])
+                    raise RuntimeError(f"Error processing image: {os.path.basename(image_data['path'])}") from exc
+            canvas = Image.frombuffer('RGBX', final_dims, buffer, 'raw', 'RGBX', 0, 1)
+            try:
+                canvas.save(output_path, 'jpeg', **save_kwargs)
+            finally:
+                # The image borrows the mapping; release it before closing.
+                del canvas
+        finally:
+            buffer.close()
+
+def _jpeg_save_kwargs(image_data1, image_data2, dpi, preserve_exif):
+    """Return JPEG save options: quality 95, DPI and optional source EXIF."""
+    # Save with the specified DPI and optional EXIF from the first available image.
+    exif_bytes = None
+    if preserve_exif:
+        try:
+            exif_source = image_data1 or image_data2
+            with Image.open(exif_source['path']) as src:
+                exif = src.getexif()
+                if ORIENTATION_TAG and ORIENTATION_TAG in exif:
+                    exif[ORIENTATION_TAG] = 1
+                exif_bytes = exif.tobytes()
+        except Exception:
+            exif_bytes = None
+    save_kwargs = {'quality': 95, 'dpi': (dpi, dpi)}
+    if exif_bytes:
+        save_kwargs['exif'] = exif_bytes
+    return save_kwargs
+
 def create_diptych(
     image_data1: dict | None,
     image_data2: dict | None,
@@ -302,6 +1111,7 @@ def create_diptych(
     crop_focus1: tuple | None = None,
     crop_focus2: tuple | None = None,
     preserve_exif: bool = False,
+    low_memory: bool = False,
 ) -> str:
     """
     Process one or two source images and save the resulting diptych with the correct
@@ -331,10 +1141,31 @@ def create_diptych(
     preserve_exif : bool, optional
         When True, embed the EXIF metadata from the first image in the
         generated diptych. Orientation is normalised to 1.
+    low_memory : bool, optional
+        When True, build the output in horizontal bands on a memory-mapped
+        buffer (see ``save_diptych_in_strips``) instead of an in-memory canvas.
     """
     if not image_data1 and not image_data2:
         raise ValueError('At least one image is required to create a diptych')
 
+    save_kwargs = _jpeg_save_kwargs(image_data1, image_data2, dpi, preserve_exif)
+    if low_memory:
+        save_diptych_in_strips(
+            image_data1,
+            image_data2,
+            output_path,
+            final_dims,
+            gap_px,
+            fit_mode,
+            save_kwargs,
+            outer_border_px,
+            border_color,
+            crop_focus1,
+            crop_focus2,
+        )
+        logger.info("Successfully created diptych: %s", os.path.basename(output_path))
+        return output_path
+
     # Determine processing dimensions for each half based on final canvas size.
     is_landscape = final_dims[0] >= final_dims[1]
     processing_dims = calculate_processing_dimensions_from_final(
@@ -344,50 +1175,285 @@ def create_diptych(
         both_images=bool(image_data1 and image_data2),
     )
 
-    img1 = img2 = None
-    if image_data1:
-        img1 = process_source_image(
-            image_data1['path'],
-            processing_dims,
-            image_data1.get('rotation', 0),
-            fit_mode,
-            True,
-            border_color,
-            crop_focus1,
-            is_landscape,
-        )
-        if img1 is None:
-            raise RuntimeError(f"Error processing image: {os.path.basename(image_data1['path'])}")
-    if image_data2:
-        img2 = process_source_image(
-            image_data2['path'],
-            processing_dims,
-            image_data2.get('rotation', 0),
-            fit_mode,
-            True,
-            border_color,
-            crop_focus2,
-            is_landscape,
-        )
-        if img2 is None:
-            raise RuntimeError(f"Error processing image: {os.path.basename(image_data2['path'])}")
+    img1, img2 = process_image_pair(
+        image_data1,
+        image_data2,
+        processing_dims,
+        fit_mode,
+        border_color,
+        crop_focus1,
+        crop_focus2,
+        is_landscape,
+    )
 
     canvas = create_diptych_canvas(img1, img2, final_dims, gap_px, outer_border_px, border_color)
-    # Save with the specified DPI and optional EXIF from the first available image.
-    exif_bytes = None
-    if preserve_exif:
-        try:
-            exif_source = image_data1 or image_data2
-            with Image.open(exif_source['path']) as src:
-                exif = src.getexif()
-                if ORIENTATION_TAG and ORIENTATION_TAG in exif:
-                    exif[ORIENTATION_TAG] = 1
-                exif_bytes = exif.tobytes()
-        except Exception:
-            exif_bytes = None
-    save_kwargs = {'quality': 95, 'dpi': (dpi, dpi)}
-    if exif_bytes:
-        save_kwargs['exif'] = exif_bytes
     canvas.save(output_path, 'jpeg', **save_kwargs)
     logger.info("Successfully created diptych: %s", os.path.basename(output_path))
     return output_path
+
+# --- Batch command line ---
+# ``python diptych_creator.py manifest.csv output_dir`` renders a manifest
+# without the web app. Each row names one or two images plus optional
+# per-row settings; missing settings fall back to the manifest defaults and
+# then to the same defaults the web app uses.
+CONFIG_KEYS = (
+    'width',
+    'height',
+    'dpi',
+    'gap',
+    'outer_border',
+    'orientation',
+    'fit_mode',
+    'border_color',
+    'preserve_exif',
+    'low_memory',
+)
+BOOLEAN_KEYS = {'preserve_exif', 'low_memory'}
+REPORT_NAME = 'diptych_report.json'
+
+def load_manifest(path):
+    """
+    Read a manifest and return ``(rows, defaults)``.
+
+    A CSV manifest has a header row with ``image1``, ``image2``, ``output``,
+    ``rotation1``/``rotation2``, ``crop_focus1``/``crop_focus2`` (``x y``
+    fractions, or ``crop_focus`` for both) and any of CONFIG_KEYS. A JSON manifest is a list of rows
+    with the same keys, or ``{"defaults": {...}, "rows": [...]}``. In JSON,
+    an image may also be a ``{"path", "rotation", "crop_focus"}`` object
+    and the settings may be nested under ``"config"``, as the web API sends
+    them.
+    """
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8-sig') as source:
+            return list(csv.DictReader(source)), {}
+    with open(path, encoding='utf-8') as source:
+        manifest = json.load(source)
+    if isinstance(manifest, dict):
+        return manifest.get('rows', []), manifest.get('defaults', {})
+    return manifest, {}
+
+def _parse_crop_focus(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, str):
+        value = value.replace(',', ' ').replace(';', ' ').split()
+    x, y = (float(part) for part in value)
+    return (x, y)
+
+def _manifest_image(row, index, base_dir):
+    value = row.get(f'image{index}')
+    image = dict(value) if isinstance(value, dict) else {'path': value}
+    if not image.get('path'):
+        return None
+    rotation = row.get(f'rotation{index}') or image.get('rotation') or 0
+    crop_focus = (
+        row.get(f'crop_focus{index}')
+        or image.get('crop_focus')
+        or row.get('crop_focus')
+        or (row.get('config') or {}).get('crop_focus')
+    )
+    return {
+        'path': os.path.join(base_dir, os.path.expanduser(str(image['path']))),
+        'rotation': int(float(rotation)) % 360,
+        'crop_focus': _parse_crop_focus(crop_focus),
+    }
+
+def _manifest_config(row, defaults):
+    config = dict(defaults)
+    for key in CONFIG_KEYS:
+        value = (row.get('config') or {}).get(key, row.get(key))
+        if value in (None, ''):
+            continue
+        if key in BOOLEAN_KEYS and isinstance(value, str):
+            value = value.strip().lower() in ('1', 'true', 'yes', 'on')
+        config[key] = value
+    return config
+
+def plan_manifest(rows, output_dir, base_dir, defaults=None, low_memory_pixels=100_000_000):
+    """
+    Turn manifest rows into render jobs.
+
+    Every job has its 1-based ``row``, its ``output`` path and either the
+    ``create_diptych`` arguments in ``args`` and a settings ``fingerprint``,
+    or the ``error`` that makes the row invalid. A row whose output is
+    already written by an earlier row is invalid.
+    """
+    jobs = []
+    claimed = {}
+    for number, row in enumerate(rows, start=1):
+        output = os.path.join(output_dir, (row.get('output') or f'diptych_{number}.jpg'))
+        job = {'row': number, 'output': output}
+        target = os.path.normcase(os.path.abspath(output))
+        if target in claimed:
+            job['error'] = f"Output {os.path.basename(output)} is already written by row {claimed[target]}"
+            jobs.append(job)
+            continue
+        claimed[target] = number
+        try:
+            image1 = _manifest_image(row, 1, base_dir)
+            image2 = _manifest_image(row, 2, base_dir)
+            if not image1 and not image2:
+                raise ValueError('At least one image is required for each output')
+            normalized, final_dims, processing_dims, outer_border_px, gap_px = normalize_config(
+                _manifest_config(row, defaults or {}),
+                both_images=bool(image1 and image2),
+            )
+            low_memory = normalized['low_memory'] or final_dims[0] * final_dims[1] > low_memory_pixels
+            job['args'] = [
+                image1,
+                image2,
+                output,
+                list(final_dims),
+                gap_px,
+                normalized['fit_mode'],
+                normalized['dpi'],
+                outer_border_px,
+                normalized['border_color'],
+                image1['crop_focus'] if image1 else None,
+                image2['crop_focus'] if image2 else None,
+                normalized['preserve_exif'],
+                low_memory,
+            ]
+            job['sources'] = [image['path'] for image in (image1, image2) if image]
+            job['peak_bytes'] = estimate_render_bytes(final_dims, processing_dims, low_memory=low_memory)
+            job['fingerprint'] = hashlib.sha256(
+                json.dumps(job['args'][:2] + job['args'][3:], sort_keys=True).encode('utf-8')
+            ).hexdigest()
+        except (TypeError, ValueError) as e:
+            job['error'] = str(e)
+        jobs.append(job)
+    return jobs
+
+def is_up_to_date(job, previous):
+    """
+    Return True when ``job``'s output can be kept from an earlier run.
+
+    The earlier report must list the output as rendered with the same
+    settings, and the file must be newer than every source image.
+    """
+    earlier = previous.get(job['output'])
+    if not earlier or earlier.get('fingerprint') != job.get('fingerprint'):
+        return False
+    try:
+        output_mtime = os.path.getmtime(job['output'])
+        return all(os.path.getmtime(source) <= output_mtime for source in job['sources'])
+    except OSError:
+        return False
+
+def render_manifest_job(args):
+    """Render one job into a partial file and move it into place; return seconds taken."""
+    started = time.perf_counter()
+    output = args[2]
+    partial = f"{output}.part"
+    try:
+        create_diptych(args[0], args[1], partial, *args[3:-1], low_memory=args[-1])
+        os.replace(partial, output)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return time.perf_counter() - started
+
+def _read_report(path):
+    try:
+        with open(path, encoding='utf-8') as source:
+            report = json.load(source)
+    except (OSError, ValueError):
+        return {}
+    return {
+        item['output']: item
+        for item in report.get('results', [])
+        if item.get('status') in ('rendered', 'skipped')
+    }
+
+def _write_report(path, results, started):
+    counts = {status: 0 for status in ('rendered', 'skipped', 'failed')}
+    for item in results:
+        counts[item['status']] += 1
+    partial = f"{path}.part"
+    with open(partial, 'w', encoding='utf-8') as out:
+        json.dump({
+            'finished_at': time.time(),
+            'seconds': round(time.perf_counter() - started, 3),
+            **counts,
+            'results': sorted(results, key=lambda item: item['row']),
+        }, out, indent=2)
+    os.replace(partial, path)
+
+def render_manifest(jobs, report_path, workers=None, force=False):
+    """
+    Render planned jobs across a process pool and write the results report.
+
+    Outputs recorded as up to date in the previous report at
+    ``report_path`` are skipped unless ``force`` is set. The report is
+    rewritten even when the run is interrupted, so a rerun resumes where
+    this one stopped. Returns the list of per-row results.
+    """
+    started = time.perf_counter()
+    previous = {} if force else _read_report(report_path)
+    results = []
+    pending = []
+    for job in jobs:
+        result = {'row': job['row'], 'output': job['output'], 'fingerprint': job.get('fingerprint')}
+        if 'error' in job:
+            results.append(dict(result, status='failed', error=job['error']))
+        elif is_up_to_date(job, previous):
+            results.append(dict(result, status='skipped'))
+        else:
+            pending.append((job, result))
+    if workers is None and pending:
+        workers = resource_governor.default_worker_count(max(job['peak_bytes'] for job, _ in pending))
+    try:
+        if pending:
+            for directory in {os.path.dirname(job['output']) for job, _ in pending}:
+                os.makedirs(directory or '.', exist_ok=True)
+            # Spawned workers do not inherit this process's threads or locks.
+            with ProcessPoolExecutor(
+                max_workers=max(1, workers),
+                mp_context=multiprocessing.get_context('spawn'),
+            ) as pool:
+                futures = {pool.submit(render_manifest_job, job['args']): result for job, result in pending}
+                for future in as_completed(futures):
+                    result = futures[future]
+                    try:
+                        result.update(status='rendered', seconds=round(future.result(), 3))
+                    except Exception as e:
+                        logger.error("Row %d failed: %s", result['row'], e)
+                        result.update(status='failed', error=str(e))
+                    results.append(result)
+                    logger.info("%d/%d done", len(results), len(jobs))
+    finally:
+        _write_report(report_path, results, started)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render a manifest of diptychs without the web app.')
+    parser.add_argument('manifest', help='JSON or CSV manifest of image pairs and settings')
+    parser.add_argument('output_dir', help='directory for the outputs and the results report')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='render processes (default: CPU count, capped by the memory budget)')
+    parser.add_argument('--report', default=None,
+                        help=f'results report path (default: <output_dir>/{REPORT_NAME})')
+    parser.add_argument('--force', action='store_true', help='render every row even if its output is up to date')
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+
+    rows, defaults = load_manifest(options.manifest)
+    jobs = plan_manifest(
+        rows,
+        options.output_dir,
+        os.path.dirname(os.path.abspath(options.manifest)),
+        defaults,
+        low_memory_pixels=int(os.environ.get('DIPTYCH_LOW_MEMORY_PIXELS', 100_000_000)),
+    )
+    report_path = options.report or os.path.join(options.output_dir, REPORT_NAME)
+    os.makedirs(options.output_dir, exist_ok=True)
+    results = render_manifest(jobs, report_path, workers=options.workers, force=options.force)
+    failed = sum(1 for item in results if item['status'] == 'failed')
+    print(
+        f"{len(results) - failed} of {len(jobs)} outputs ready, {failed} failed; report: {report_path}",
+        file=sys.stderr,
+    )
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# event_stream.py
+
+"""
+Server-sent event channels for background work.
+
+An ``EventLog`` is an append-only, bounded sequence of numbered events.
+Background threads publish to it and any number of readers wait for events
+after the last id they saw, so a browser that reconnects with its
+``Last-Event-ID`` picks up where it left off as long as the events are still
+retained. ``sse_stream`` turns a log into the ``text/event-stream`` body of
+a response, with periodic keepalive comments so idle connections stay open.
+"""
+
+from collections import deque
+import json
+import threading
+import time
+
+class EventLog:
+    """Numbered events that readers can wait on, keeping the newest ``maxlen``."""
+
+    def __init__(self, maxlen=1000):
+        self._events: deque[tuple[int, str, dict]] = deque(maxlen=maxlen)
+        self._next_id = 1
+        self._closed = False
+        self._condition = threading.Condition()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def last_id(self):
+        """Return the id of the newest event, or 0 before the first one."""
+        with self._condition:
+            return self._next_id - 1
+
+    def publish(self, event, data=None):
+        """Append an event and wake waiting readers; return its id."""
+        with self._condition:
+            event_id = self._next_id
+            self._next_id += 1
+            self._events.append((event_id, event, data or {}))
+            self._condition.notify_all()
+        return event_id
+
+    def close(self):
+        """Mark the log finished so readers stop once they have drained it."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def read(self, after=0, timeout=None):
+        """
+        Return the retained events with an id above ``after``.
+
+        Waits up to ``timeout`` seconds (forever for None) while there are
+        none and the log is open. An ``after`` beyond the newest id comes
+        from an earlier server run, so everything retained is returned.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            if after >= self._next_id:
+                after = 0
+            while not self._closed and (not self._events or self._events[-1][0] <= after):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return []
+                self._condition.wait(remaining)
+            return [item for item in self._events if item[0] > after]
+
+def format_sse(event_id, event, data):
+    """Return one event in ``text/event-stream`` framing."""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+def sse_stream(log, after=0, keepalive_seconds=15.0):
+    """Yield a log's events after ``after`` until it is closed and drained."""
+    while True:
+        batch = log.read(after, timeout=keepalive_seconds)
+        if not batch:
+            if log.closed:
+                return
+            yield ': keepalive\n\n'
+            continue
+        for event_id, event, data in batch:
+            yield format_sse(event_id, event, data)
+            after = event_id
+
+def last_event_id(headers, args, default=0):
+    """
+    Return the resume point from a Last-Event-ID header or ``after`` query value.
+
+    ``default`` applies to a connection that names neither, e.g. a log's
+    ``last_id`` for streams whose history a fresh client does not need.
+    """
+    raw = headers.get('Last-Event-ID') or args.get('after')
+    if raw is None:
+        return default
+    try:
+        return max(0, int(raw))
+    except (TypeError, ValueError):
+        return default
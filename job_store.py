@@ -0,0 +1,347 @@
+# job_store.py
+
+"""
+Bounded in-process storage for job records and their result payloads.
+
+A ``JobStore`` holds one class of job records (preview jobs, generation
+jobs, download handles) within a count limit, an idle TTL and, for payloads
+such as preview JPEG bytes, a memory byte limit. Least recently used entries
+are evicted first; payloads above a size threshold, or pushed out of the
+memory budget, are spilled to files in a disk directory instead of being
+dropped. Spill files are written without any shard lock held.
+
+Entries are spread over independently locked shards so concurrent jobs
+rarely contend for the same lock, while the limits apply to the store as a
+whole: a write that takes it over a limit releases the least recently used
+entries of any shard, so skewed keys do not evict early. Records
+are returned by reference: callers keep mutating them under their own
+per-record locking, while the store only guards membership and payloads.
+"""
+
+from collections import OrderedDict
+import os
+import threading
+import time
+import uuid
+
+class _Entry:
+    __slots__ = ('record', 'payload', 'spilling', 'spill_path', 'touched')
+
+    def __init__(self, record, touched):
+        self.record = record
+        self.payload: bytes | None = None
+        # Payload detached for a spill whose file is still being written.
+        self.spilling: bytes | None = None
+        self.spill_path: str | None = None
+        self.touched = touched
+
+class _Shard:
+    __slots__ = ('lock', 'entries', 'payload_bytes')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, _Entry] = OrderedDict()
+        self.payload_bytes = 0
+
+class JobStore:
+    """
+    Sharded map of job records with count, byte and TTL limits.
+
+    ``evictable(record)`` may veto eviction and expiry, e.g. for jobs that
+    are still running. ``spill_dir`` enables disk spill: payloads of at
+    least ``spill_bytes`` go straight to disk, and in-memory payloads are
+    spilled in LRU order when the store exceeds ``max_bytes``.
+    Without it, whole entries are evicted to stay within ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        max_entries,
+        max_bytes=0,
+        ttl_seconds=None,
+        spill_dir=None,
+        spill_bytes=None,
+        evictable=None,
+        shards=8,
+        clock=time.monotonic,
+    ):
+        self.shard_count = max(1, min(int(shards), int(max_entries)))
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = int(max_bytes)
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir
+        self.spill_bytes = spill_bytes
+        self._evictable = evictable or (lambda record: True)
+        self._clock = clock
+        self._shards = [_Shard() for _ in range(self.shard_count)]
+        # Serialises eviction across shards; taken without any shard lock held.
+        self._limit_lock = threading.Lock()
+        self.evictions = 0
+        self.spills = 0
+
+    def _shard(self, key):
+        return self._shards[hash(key) % self.shard_count]
+
+    def _expired(self, entry, now):
+        return (
+            self.ttl_seconds is not None
+            and now - entry.touched > self.ttl_seconds
+            and self._evictable(entry.record)
+        )
+
+    def _discard(self, shard, key):
+        entry = shard.entries.pop(key)
+        if entry.payload is not None:
+            shard.payload_bytes -= len(entry.payload)
+        if entry.spill_path:
+            _remove(entry.spill_path)
+        return entry
+
+    def _detach_payload(self, shard, entry):
+        """Take an entry's payload out of the memory budget for spilling (shard lock held)."""
+        payload, entry.payload = entry.payload, None
+        shard.payload_bytes -= len(payload)
+        entry.spilling = payload
+        return payload
+
+    def _spill(self, shard, key, entry, payload):
+        """
+        Write a detached payload to disk and attach the file (shard lock not
+        held). If the payload was replaced or dropped meanwhile, the file is
+        removed again.
+        """
+        path = os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.bin")
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(path, 'wb') as out:
+                out.write(payload)
+        except OSError:
+            _remove(path)
+            with shard.lock:
+                if shard.entries.get(key) is entry and entry.spilling is payload:
+                    # Keep it in memory rather than lose it.
+                    entry.spilling = None
+                    entry.payload = payload
+                    shard.payload_bytes += len(payload)
+            raise
+        with shard.lock:
+            if shard.entries.get(key) is entry and entry.spilling is payload:
+                entry.spilling = None
+                entry.spill_path = path
+                self.spills += 1
+                return
+        _remove(path)
+
+    def _expire(self, shard, keep=None):
+        now = self._clock()
+        for key in [k for k, e in shard.entries.items() if k != keep and self._expired(e, now)]:
+            self._discard(shard, key)
+            self.evictions += 1
+
+    def _over_limits(self):
+        over_count = sum(len(shard.entries) for shard in self._shards) > self.max_entries
+        over_bytes = bool(self.max_bytes) and sum(shard.payload_bytes for shard in self._shards) > self.max_bytes
+        return over_count, over_bytes
+
+    def _oldest(self, shard, over_count, keep):
+        """Return the least recently used entry of a shard that may be released."""
+        for key, entry in shard.entries.items():
+            if key == keep:
+                continue
+            if over_count:
+                if self._evictable(entry.record):
+                    return key, entry
+            elif entry.payload is not None and (self.spill_dir or self._evictable(entry.record)):
+                return key, entry
+        return None, None
+
+    def _enforce_limits(self, keep=None):
+        """Bring the store back within its limits, oldest entries of any shard first."""
+        if not any(self._over_limits()):
+            return
+        with self._limit_lock:
+            while True:
+                over_count, over_bytes = self._over_limits()
+                if not (over_count or over_bytes):
+                    return
+                candidates = []
+                for shard in self._shards:
+                    with shard.lock:
+                        key, entry = self._oldest(shard, over_count, keep)
+                        if key is not None:
+                            candidates.append((entry.touched, key, shard))
+                if not candidates:
+                    return
+                _, key, shard = min(candidates, key=lambda candidate: candidate[0])
+                payload = None
+                with shard.lock:
+                    # Re-checked: the entry may have been used meanwhile.
+                    if self._oldest(shard, over_count, keep)[0] != key:
+                        continue
+                    entry = shard.entries[key]
+                    if not over_count and self.spill_dir:
+                        payload = self._detach_payload(shard, entry)
+                    else:
+                        self._discard(shard, key)
+                        self.evictions += 1
+                if payload is not None:
+                    self._spill(shard, key, entry, payload)
+
+    def put(self, key, record):
+        """Insert or replace the record for ``key`` (dropping any payload)."""
+        shard = self._shard(key)
+        with shard.lock:
+            if key in shard.entries:
+                self._discard(shard, key)
+            shard.entries[key] = _Entry(record, self._clock())
+            self._expire(shard, keep=key)
+        self._enforce_limits(keep=key)
+
+    def save(self, key, record, fields=None):
+        """
+        Replace the record for ``key`` in place, keeping its payload; returns
+        False if it is gone. ``fields`` is accepted for the shared stores of
+        ``state_backend``; records here are held by reference anyway.
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is None:
+                return False
+            entry.record = record
+            entry.touched = self._clock()
+            shard.entries.move_to_end(key)
+            return True
+
+    def get(self, key, default=None):
+        """Return the record for ``key`` and mark it recently used."""
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is None:
+                return default
+            if self._expired(entry, self._clock()):
+                self._discard(shard, key)
+                self.evictions += 1
+                return default
+            entry.touched = self._clock()
+            shard.entries.move_to_end(key)
+            return entry.record
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def pop(self, key, default=None):
+        """Remove ``key`` and return its record."""
+        shard = self._shard(key)
+        with shard.lock:
+            if key not in shard.entries:
+                return default
+            return self._discard(shard, key).record
+
+    def set_payload(self, key, payload):
+        """Attach result bytes to an existing record; returns False if it is gone."""
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is None:
+                return False
+            self._drop_payload(shard, entry)
+            entry.payload = bytes(payload)
+            shard.payload_bytes += len(entry.payload)
+            detached = None
+            if self.spill_dir and self.spill_bytes is not None and len(entry.payload) >= self.spill_bytes:
+                detached = self._detach_payload(shard, entry)
+            entry.touched = self._clock()
+            shard.entries.move_to_end(key)
+            self._expire(shard, keep=key)
+        if detached is not None:
+            self._spill(shard, key, entry, detached)
+        self._enforce_limits(keep=key)
+        return True
+
+    def get_payload(self, key):
+        """Return the bytes attached to ``key``, reading spilled ones from disk."""
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is None:
+                return None
+            entry.touched = self._clock()
+            shard.entries.move_to_end(key)
+            if entry.spilling is not None:
+                return entry.spilling
+            if entry.payload is not None or not entry.spill_path:
+                return entry.payload
+            path = entry.spill_path
+        try:
+            with open(path, 'rb') as source:
+                return source.read()
+        except FileNotFoundError:
+            return None
+
+    def _drop_payload(self, shard, entry):
+        entry.spilling = None
+        if entry.payload is not None:
+            shard.payload_bytes -= len(entry.payload)
+            entry.payload = None
+        if entry.spill_path:
+            _remove(entry.spill_path)
+            entry.spill_path = None
+
+    def drop_payload(self, key):
+        """Release the bytes attached to ``key`` but keep its record."""
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is not None:
+                self._drop_payload(shard, entry)
+
+    def purge(self):
+        """Drop expired entries from every shard; return how many went."""
+        before = self.evictions
+        for shard in self._shards:
+            with shard.lock:
+                now = self._clock()
+                for key in [k for k, e in shard.entries.items() if self._expired(e, now)]:
+                    self._discard(shard, key)
+                    self.evictions += 1
+        return self.evictions - before
+
+    def items(self):
+        """Return a snapshot list of ``(key, record)`` pairs."""
+        pairs = []
+        for shard in self._shards:
+            with shard.lock:
+                pairs.extend((key, entry.record) for key, entry in shard.entries.items())
+        return pairs
+
+    def spilled_paths(self):
+        """Return the files currently holding spilled payloads."""
+        paths = set()
+        for shard in self._shards:
+            with shard.lock:
+                paths.update(e.spill_path for e in shard.entries.values() if e.spill_path)
+        return paths
+
+    def stats(self):
+        """Return entry, byte, eviction and spill counters."""
+        entries = payload_bytes = spilled = 0
+        for shard in self._shards:
+            with shard.lock:
+                entries += len(shard.entries)
+                payload_bytes += shard.payload_bytes
+                spilled += sum(1 for e in shard.entries.values() if e.spill_path)
+        return {
+            'entries': entries,
+            'payload_bytes': payload_bytes,
+            'spilled': spilled,
+            'evictions': self.evictions,
+            'spills': self.spills,
+        }
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,192 @@
+# metadata_index.py
+
+"""
+Persistent per-image metadata for grouping uploads.
+
+Each row records a file's identity (name, mtime, size, inode) and its
+ctime next to the values auto-grouping needs: upright dimensions, EXIF
+orientation, aspect ratio, capture and upload times, the mean colour with
+its hue, and the content hash recorded at upload. Rows are written when an
+upload is ingested and refreshed lazily: ``refresh`` only re-reads files
+whose mtime, size or inode changed and drops rows for files that are gone,
+so grouping a large session reads the index instead of every image.
+"""
+
+import os
+import sqlite3
+import threading
+
+COLUMNS = (
+    'name',
+    'mtime_ns',
+    'ctime_ns',
+    'size',
+    'inode',
+    'width',
+    'height',
+    'orientation',
+    'aspect',
+    'capture_time',
+    'uploaded_at',
+    'red',
+    'green',
+    'blue',
+    'hue',
+    'sha256',
+)
+
+# Columns compared to tell whether a file changed. ctime is recorded but not
+# compared: adding or removing a hard link to a content-addressed upload
+# changes the ctime of every alias sharing its inode, not its content.
+IDENTITY_COLUMNS = ('mtime_ns', 'size', 'inode')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    ctime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    orientation INTEGER,
+    aspect REAL,
+    capture_time REAL,
+    uploaded_at REAL,
+    red REAL,
+    green REAL,
+    blue REAL,
+    hue REAL,
+    sha256 TEXT
+)
+"""
+
+# Columns added after the first schema, with their declarations.
+COLUMN_MIGRATIONS = {
+    'sha256': 'TEXT',
+}
+
+def file_identity(path):
+    """Return the identity columns for a file on disk."""
+    stat = os.stat(path)
+    return {
+        'mtime_ns': stat.st_mtime_ns,
+        'ctime_ns': stat.st_ctime_ns,
+        'size': stat.st_size,
+        'inode': stat.st_ino,
+    }
+
+class ImageMetadataIndex:
+    """SQLite-backed metadata rows keyed by uploaded filename."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute(SCHEMA)
+            # Add columns introduced after an index file was created.
+            existing = {row['name'] for row in self._connection.execute('PRAGMA table_info(images)')}
+            for column, declaration in COLUMN_MIGRATIONS.items():
+                if column not in existing:
+                    self._connection.execute(f'ALTER TABLE images ADD COLUMN {column} {declaration}')
+            self._connection.commit()
+        return self._connection
+
+    def close(self):
+        """Close the database; the next call reopens (and recreates) it."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def get(self, name):
+        """Return the row for ``name`` as a dict, or None."""
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT * FROM images WHERE name = ?', (name,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def put(self, record):
+        """
+        Insert or replace a row.
+
+        An existing ``uploaded_at`` is kept when the new record has none, so
+        re-reading a changed file does not forget when it was uploaded.
+        """
+        values = [record.get(column) for column in COLUMNS]
+        placeholders = ', '.join('?' for _ in COLUMNS)
+        updates = ', '.join(
+            f'{column} = excluded.{column}' for column in COLUMNS
+            if column not in ('name', 'uploaded_at')
+        )
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                f'INSERT INTO images ({", ".join(COLUMNS)}) VALUES ({placeholders}) '
+                f'ON CONFLICT(name) DO UPDATE SET {updates}, '
+                'uploaded_at = COALESCE(excluded.uploaded_at, images.uploaded_at)',
+                values,
+            )
+            connection.commit()
+
+    def find_by_sha256(self, sha256):
+        """Return the rows recorded with a content hash, oldest upload first."""
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT * FROM images WHERE sha256 = ? ORDER BY uploaded_at',
+                (sha256,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def remove(self, name):
+        """Delete the row for ``name`` if present."""
+        with self._lock:
+            connection = self._connect()
+            connection.execute('DELETE FROM images WHERE name = ?', (name,))
+            connection.commit()
+
+    def refresh(self, directory, extract, include=None):
+        """
+        Bring the index in line with ``directory`` and return its rows.
+
+        ``extract(path)`` returns the metadata columns for a file and is only
+        called for files that are new or whose identity changed. ``include``
+        optionally filters filenames. Rows for missing files are deleted.
+        Rows are returned in filename order.
+        """
+        names = sorted(
+            name for name in os.listdir(directory)
+            if os.path.isfile(os.path.join(directory, name))
+            and (include is None or include(name))
+        )
+        with self._lock:
+            known = {
+                row['name']: dict(row)
+                for row in self._connect().execute('SELECT * FROM images')
+            }
+        rows = []
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                identity = file_identity(path)
+            except OSError:
+                continue
+            row = known.get(name)
+            if row is None or any(row[column] != identity[column] for column in IDENTITY_COLUMNS):
+                self.put({**extract(path), **identity, 'name': name})
+                row = self.get(name)
+            rows.append(row)
+        stale = set(known) - set(names)
+        if stale:
+            with self._lock:
+                connection = self._connect()
+                connection.executemany('DELETE FROM images WHERE name = ?', [(name,) for name in stale])
+                connection.commit()
+        return rows
@@ -0,0 +1,382 @@
+# render_spool.py
+
+"""
+Durable spool of render tasks for a fleet of separately launched workers.
+
+With ``DIPTYCH_RENDER_SPOOL`` set, the server does not render final outputs
+itself. It writes each diptych as a task file into a spool directory, which
+can live on storage shared by several machines. Worker processes started
+with ``python render_spool.py <spool dir>`` on any machine that mounts the
+spool claim tasks and render them with ``diptych_creator.create_diptych``.
+They write an outcome file that the server collects into the job's progress.
+Outcomes of tasks submitted for a job keep the job id and item index and
+stay in the spool until purged, so a restarted server can read a job's
+progress back from them.
+
+A spool directory holds::
+
+    tasks/<task>.<attempt>.json    waiting to be claimed
+    claims/<task>.<attempt>.json   being rendered; the mtime is the lease
+    results/<task>.json            outcome, waiting for the server
+    tmp/                           files being written
+
+Every step is a rename within the spool, which is atomic, so exactly one
+worker wins each claim. A worker touches its claim while it renders. A
+claim whose lease has run out, because its worker crashed or lost the
+storage, is put back as the next attempt. After ``max_attempts`` it fails
+the task instead, so one poison task cannot take down every worker in turn.
+"""
+
+import argparse
+from concurrent.futures import Future, InvalidStateError
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+
+import diptych_creator
+
+logger = logging.getLogger(__name__)
+
+def create_diptych_in_place(image_data1, image_data2, output_path, *args, **kwargs):
+    """Render like ``create_diptych`` but publish the output with one rename.
+
+    A task picked up again after its lease ran out may still be finishing on
+    the first worker, so neither copy writes to ``output_path`` directly.
+    """
+    partial = f"{output_path}.{uuid.uuid4().hex[:8]}.part"
+    try:
+        diptych_creator.create_diptych(image_data1, image_data2, partial, *args, **kwargs)
+        os.replace(partial, output_path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return output_path
+
+# Functions a task may name, and the name the server records for each.
+TASK_FUNCTIONS = {'create_diptych': create_diptych_in_place}
+TASK_NAMES = {diptych_creator.create_diptych: 'create_diptych'}
+
+class RenderTaskError(RuntimeError):
+    """A spooled render failed on its worker."""
+
+def _write_json(spool, path, data):
+    partial = os.path.join(spool.tmp_dir, f"{uuid.uuid4().hex}.json")
+    with open(partial, 'w', encoding='utf-8') as out:
+        json.dump(data, out)
+    os.replace(partial, path)
+
+def _parse_name(name):
+    """Split ``<task>.<attempt>.json`` into the task id and attempt number."""
+    task_id, attempt, _ = name.rsplit('.', 2)
+    return task_id, int(attempt)
+
+class RenderSpool:
+    """Task, claim and result files under one spool directory."""
+
+    def __init__(self, root, lease_seconds=60.0, max_attempts=3):
+        self.root = root
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.tasks_dir = os.path.join(root, 'tasks')
+        self.claims_dir = os.path.join(root, 'claims')
+        self.results_dir = os.path.join(root, 'results')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        for directory in (self.tasks_dir, self.claims_dir, self.results_dir, self.tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def submit(self, call, args=(), kwargs=None, job_id=None, item=None):
+        """Queue a call of ``TASK_FUNCTIONS[call]`` and return the task id."""
+        if call not in TASK_FUNCTIONS:
+            raise ValueError(f"Unknown spool task: {call}")
+        # Ids sort by submission time, so workers claim tasks in order.
+        task_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:12]}"
+        task = {
+            'task_id': task_id,
+            'job_id': job_id,
+            'item': item,
+            'call': call,
+            'args': list(args),
+            'kwargs': kwargs or {},
+            'submitted_at': time.time(),
+        }
+        _write_json(self, os.path.join(self.tasks_dir, f"{task_id}.1.json"), task)
+        return task_id
+
+    def cancel(self, task_id):
+        """Withdraw a task nobody has claimed yet; returns True if it was waiting."""
+        for name in os.listdir(self.tasks_dir):
+            if name.startswith(f"{task_id}."):
+                try:
+                    os.remove(os.path.join(self.tasks_dir, name))
+                    return True
+                except FileNotFoundError:
+                    pass
+        return False
+
+    def claim(self):
+        """Take the oldest waiting task; return ``(claim_path, task)`` or None."""
+        for name in sorted(os.listdir(self.tasks_dir)):
+            if not name.endswith('.json'):
+                continue
+            claim_path = os.path.join(self.claims_dir, name)
+            try:
+                os.rename(os.path.join(self.tasks_dir, name), claim_path)
+                # Renaming keeps the old mtime; start the lease now.
+                os.utime(claim_path)
+                with open(claim_path, encoding='utf-8') as source:
+                    return claim_path, json.load(source)
+            except FileNotFoundError:
+                continue  # Another worker won it (or already reclaimed it).
+        return None
+
+    def heartbeat(self, claim_path):
+        """Extend a claim's lease; returns False once the claim was taken back."""
+        try:
+            os.utime(claim_path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, claim_path, task, value=None, error=None):
+        """Record a claimed task's outcome and release the claim."""
+        outcome = {
+            'task_id': task['task_id'],
+            'job_id': task.get('job_id'),
+            'item': task.get('item'),
+            'finished_at': time.time(),
+        }
+        if error is None:
+            outcome['value'] = value
+        else:
+            outcome['error'] = error
+        _write_json(self, os.path.join(self.results_dir, f"{task['task_id']}.json"), outcome)
+        if claim_path:
+            try:
+                os.remove(claim_path)
+            except FileNotFoundError:
+                pass
+
+    def reclaim_expired(self, now=None):
+        """Put back or fail claims whose lease ran out; return how many."""
+        now = time.time() if now is None else now
+        reclaimed = 0
+        for name in os.listdir(self.claims_dir):
+            claim_path = os.path.join(self.claims_dir, name)
+            try:
+                if now - os.stat(claim_path).st_mtime <= self.lease_seconds:
+                    continue
+                task_id, attempt = _parse_name(name)
+            except (FileNotFoundError, ValueError):
+                continue
+            if attempt >= self.max_attempts:
+                try:
+                    with open(claim_path, encoding='utf-8') as source:
+                        task = json.load(source)
+                except (FileNotFoundError, ValueError):
+                    continue
+                self.complete(
+                    claim_path,
+                    task,
+                    error=f"Render was abandoned by its worker {attempt} times",
+                )
+            else:
+                try:
+                    os.rename(claim_path, os.path.join(self.tasks_dir, f"{task_id}.{attempt + 1}.json"))
+                except FileNotFoundError:
+                    continue
+            logger.warning("Reclaimed spool task %s after attempt %d", task_id, attempt)
+            reclaimed += 1
+        return reclaimed
+
+    def finished(self):
+        """Return the ids of tasks with an outcome waiting to be collected."""
+        return {name[:-len('.json')] for name in os.listdir(self.results_dir) if name.endswith('.json')}
+
+    def read_result(self, task_id):
+        """Return a task's outcome, or None if there is none yet."""
+        try:
+            with open(os.path.join(self.results_dir, f"{task_id}.json"), encoding='utf-8') as source:
+                return json.load(source)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def take_result(self, task_id):
+        """Return and remove a task's outcome, or None if there is none yet."""
+        outcome = self.read_result(task_id)
+        if outcome is not None:
+            try:
+                os.remove(os.path.join(self.results_dir, f"{task_id}.json"))
+            except FileNotFoundError:
+                pass
+        return outcome
+
+    def job_results(self, job_id):
+        """Return the outcomes recorded for ``job_id``, in submission order."""
+        outcomes = []
+        for task_id in sorted(self.finished()):
+            outcome = self.read_result(task_id)
+            if outcome is not None and outcome.get('job_id') == job_id:
+                outcomes.append(outcome)
+        return outcomes
+
+    def purge_results(self, max_age_seconds, now=None):
+        """Delete outcomes no server collected within ``max_age_seconds``."""
+        now = time.time() if now is None else now
+        for directory in (self.results_dir, self.tmp_dir):
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    if now - os.stat(path).st_mtime > max_age_seconds:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+class SpoolExecutor:
+    """
+    Executor front of a spool for the server.
+
+    ``submit`` queues the call as a task and returns a Future that a
+    collector thread settles when a worker's outcome appears. The
+    ``job_id`` and ``item`` keywords are recorded with the task rather than
+    passed to the call; outcomes that carry a job id are left in the spool
+    for ``RenderSpool.job_results``. Cancelling a future withdraws its task
+    if no worker has claimed it. Expired leases are reclaimed by the
+    workers, which know their lease length.
+    """
+
+    def __init__(self, spool, poll_seconds=0.25):
+        self.spool = spool
+        self.poll_seconds = poll_seconds
+        self._futures: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def submit(self, fn, /, *args, job_id=None, item=None, **kwargs):
+        call = TASK_NAMES.get(fn)
+        if call is None:
+            raise TypeError(f"{getattr(fn, '__name__', fn)!r} cannot be run by spool workers")
+        if self._stopped.is_set():
+            raise RuntimeError('cannot schedule new futures after shutdown')
+        future = Future()
+        task_id = self.spool.submit(call, args, kwargs, job_id=job_id, item=item)
+        with self._lock:
+            self._futures[task_id] = future
+        future.add_done_callback(lambda done: done.cancelled() and self.spool.cancel(task_id))
+        return future
+
+    def _collect(self):
+        while not self._stopped.wait(self.poll_seconds):
+            try:
+                with self._lock:
+                    waiting = set(self._futures)
+                for task_id in waiting & self.spool.finished():
+                    outcome = self.spool.read_result(task_id)
+                    if outcome is not None and outcome.get('job_id') is None:
+                        self.spool.take_result(task_id)
+                    with self._lock:
+                        future = self._futures.pop(task_id, None)
+                    if outcome is None or future is None:
+                        continue
+                    try:
+                        if 'error' in outcome:
+                            future.set_exception(RenderTaskError(outcome['error']))
+                        else:
+                            future.set_result(outcome.get('value'))
+                    except InvalidStateError:
+                        pass  # Cancelled while the worker was rendering.
+            except Exception:
+                logger.exception("Collecting spool results failed")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self._stopped.set()
+        if cancel_futures:
+            with self._lock:
+                futures = list(self._futures.values())
+            for future in futures:
+                future.cancel()
+        if wait:
+            self._collector.join()
+
+def run_task(spool, claim_path, task):
+    """Render one claimed task, keeping its lease alive until it finishes."""
+    stop = threading.Event()
+
+    def keep_lease():
+        while not stop.wait(spool.lease_seconds / 3):
+            if not spool.heartbeat(claim_path):
+                logger.warning("Lost the claim on spool task %s", task['task_id'])
+                return
+
+    heartbeat = threading.Thread(target=keep_lease, daemon=True)
+    heartbeat.start()
+    try:
+        value = TASK_FUNCTIONS[task['call']](*task['args'], **task['kwargs'])
+    except Exception as e:
+        logger.error("Spool task %s failed: %s", task['task_id'], e)
+        spool.complete(claim_path, task, error=str(e))
+    else:
+        spool.complete(claim_path, task, value=value)
+    finally:
+        stop.set()
+        heartbeat.join()
+
+def work(root, idle_seconds=1.0, lease_seconds=60.0, max_attempts=3, stop=None):
+    """Claim and render tasks from the spool at ``root`` until ``stop`` is set."""
+    spool = RenderSpool(root, lease_seconds=lease_seconds, max_attempts=max_attempts)
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        spool.reclaim_expired()
+        claimed = spool.claim()
+        if claimed is None:
+            stop.wait(idle_seconds)
+            continue
+        run_task(spool, *claimed)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render diptych tasks from a shared spool directory.')
+    parser.add_argument('spool', help='spool directory, the same as the server\'s DIPTYCH_RENDER_SPOOL')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help='worker processes on this machine (default: CPU count)')
+    parser.add_argument('--lease', type=float, default=60.0,
+                        help='seconds a claim survives without a heartbeat (default: 60)')
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help='claims of one task before it is failed (default: 3)')
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+    logger.info(
+        "Rendering tasks from %s on %s with %d process(es)",
+        options.spool, socket.gethostname(), options.processes,
+    )
+    context = multiprocessing.get_context('spawn')
+    workers = [
+        context.Process(target=work, args=(options.spool,), kwargs={
+            'lease_seconds': options.lease,
+            'max_attempts': options.max_attempts,
+        })
+        for _ in range(max(1, options.processes))
+    ]
+    for process in workers:
+        process.start()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # Tasks still rendering are picked up again once their leases run out.
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        for process in workers:
+            process.terminate()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# resource_governor.py
+
+"""
+Memory-aware admission control for render work.
+
+Every preview or output render declares an estimated peak memory cost before
+it starts (see ``diptych_creator.estimate_render_bytes``). The governor admits
+work in priority order, and in arrival order within a priority, while the
+total admitted cost stays within a configured budget, queues the rest, and
+rejects work that could never fit. Callers can ask for a key's position in
+the queue so status endpoints can report it.
+"""
+
+from bisect import insort
+from contextlib import contextmanager
+import itertools
+import os
+import threading
+import time
+
+# Admission priorities, most urgent first: interactive previews overtake
+# queued batch output renders.
+PRIORITY_PREVIEW = 0
+PRIORITY_BATCH = 1
+
+class MemoryBudgetExceeded(ValueError):
+    """Raised when a single job needs more memory than the whole budget."""
+
+class AdmissionTimeout(TimeoutError):
+    """Raised when a job waited too long for memory to become available."""
+
+def default_memory_budget():
+    """Return the budget in bytes: DIPTYCH_MEMORY_BUDGET_MB, else half of RAM."""
+    configured = os.environ.get('DIPTYCH_MEMORY_BUDGET_MB')
+    if configured:
+        return int(float(configured) * 1024 * 1024)
+    try:
+        physical = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        physical = 0
+    if physical > 0:
+        return physical // 2
+    return 2048 * 1024 * 1024
+
+def default_worker_count(per_worker_bytes, budget_bytes=None):
+    """Return a pool size bounded by the CPU count and by the memory budget."""
+    if budget_bytes is None:
+        budget_bytes = default_memory_budget()
+    return max(1, min(os.cpu_count() or 1, int(budget_bytes // per_worker_bytes)))
+
+def lower_process_priority(increment):
+    """Raise the calling process's nice value where the OS supports it.
+
+    Used as the initializer of batch render processes so they give way to
+    the server's interactive threads.
+    """
+    if increment > 0 and hasattr(os, 'nice'):
+        try:
+            os.nice(increment)
+        except OSError:
+            pass
+
+class AdmissionTicket:
+    """An admitted (or waiting) reservation of ``cost`` bytes."""
+
+    __slots__ = ('key', 'cost', 'order')
+
+    def __init__(self, key, cost, order=(0, 0)):
+        self.key = key
+        self.cost = cost
+        # (priority, arrival) sort key for the waiting queue.
+        self.order = order
+
+    def __lt__(self, other):
+        return self.order < other.order
+
+class MemoryGovernor:
+    """Priority-ordered, first-come, first-served admission against a byte budget."""
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = int(budget_bytes)
+        self.in_use = 0
+        self._waiting: list[AdmissionTicket] = []
+        self._arrivals = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, cost, key=None, timeout=None, priority=PRIORITY_BATCH):
+        """
+        Block until ``cost`` bytes can be admitted and return the ticket.
+
+        Waiting work is admitted by ``priority`` (lower first) and strictly
+        in arrival order within a priority, so a large job is not starved by
+        a stream of small ones of its own class. Raises MemoryBudgetExceeded
+        when the cost exceeds the whole budget and AdmissionTimeout when
+        ``timeout`` seconds pass without admission.
+        """
+        cost = max(0, int(cost))
+        if cost > self.budget_bytes:
+            raise MemoryBudgetExceeded(
+                f'Job needs about {cost // (1024 * 1024)} MB, which exceeds the '
+                f'{self.budget_bytes // (1024 * 1024)} MB render memory budget'
+            )
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            ticket = AdmissionTicket(key, cost, (priority, next(self._arrivals)))
+            insort(self._waiting, ticket)
+            while self._waiting[0] is not ticket or self.in_use + cost > self.budget_bytes:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._waiting.remove(ticket)
+                    self._condition.notify_all()
+                    raise AdmissionTimeout('Timed out waiting for render memory')
+                self._condition.wait(remaining)
+            self._waiting.pop(0)
+            self.in_use += cost
+            self._condition.notify_all()
+        return ticket
+
+    def release(self, ticket):
+        """Return an admitted ticket's bytes to the budget."""
+        with self._condition:
+            self.in_use = max(0, self.in_use - ticket.cost)
+            self._condition.notify_all()
+
+    @contextmanager
+    def admit(self, cost, key=None, timeout=None, priority=PRIORITY_BATCH):
+        """Context manager form of acquire/release."""
+        ticket = self.acquire(cost, key, timeout, priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def position(self, key):
+        """Return the 0-based queue position of the first waiting ticket for key."""
+        with self._condition:
+            for index, ticket in enumerate(self._waiting):
+                if ticket.key == key:
+                    return index
+        return None
+
+    def snapshot(self):
+        """Return budget usage suitable for a status response."""
+        with self._condition:
+            return {
+                'budget_bytes': self.budget_bytes,
+                'in_use_bytes': self.in_use,
+                'waiting': len(self._waiting),
+            }
@@ -16,6 +16,12 @@ const DiptychApp = (() => {
         traySortable: null,
     };
     const PREVIEW_DEBOUNCE_DELAY = 300;
+    // Thumbnails still being ingested, keyed by upload name, with the
+    // callback that settles them once /thumbnail_events reports the result.
+    const pendingThumbnails = new Map();
+    // Ingest results that arrived before the thumbnail asked for them.
+    const thumbnailResults = new Map();
+    let thumbnailEventsConnected = false;
 
     function formatPixels(px) {
         return `${parseInt(px, 10) || 0} px`;
@@ -78,6 +84,39 @@ const DiptychApp = (() => {
         loadSavedSettings();
         initializeDragAndDrop();
         updateMobileMenuIcon();
+        connectThumbnailEvents();
+    }
+
+    function connectThumbnailEvents() {
+        if (typeof EventSource === 'undefined') return;
+        const source = new EventSource('/thumbnail_events');
+        const settle = (name, error) => {
+            const waiting = pendingThumbnails.get(name);
+            if (waiting) {
+                pendingThumbnails.delete(name);
+                waiting(error);
+            } else {
+                thumbnailResults.set(name, error);
+            }
+        };
+        source.addEventListener('ready', e => settle(JSON.parse(e.data).name, null));
+        source.addEventListener('failed', e => {
+            const { name, error } = JSON.parse(e.data);
+            settle(name, error);
+        });
+        source.addEventListener('open', () => {
+            thumbnailEventsConnected = true;
+            // Events sent while disconnected may be gone; check once more.
+            const waiting = Array.from(pendingThumbnails.values());
+            pendingThumbnails.clear();
+            waiting.forEach(retry => retry(null));
+        });
+        source.addEventListener('error', () => {
+            thumbnailEventsConnected = false;
+            // A server at its stream limit refuses the connection; uploads
+            // poll for their thumbnails until a later attempt gets through.
+            if (source.readyState === EventSource.CLOSED) setTimeout(connectThumbnailEvents, 30000);
+        });
     }
 
     // --- EVENT LISTENERS ---
@@ -169,39 +208,213 @@ const DiptychApp = (() => {
         updateMobileMenuIcon();
     }
 
+    // SubtleCrypto can only digest a whole buffer, so larger files are
+    // hashed a slice at a time with this incremental SHA-256 instead.
+    const SHA256_K = new Uint32Array([
+        0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+        0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+        0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+        0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+        0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+        0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+        0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+        0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+    ]);
+
+    function createSha256() {
+        const state = new Uint32Array([
+            0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19,
+        ]);
+        const words = new Uint32Array(64);
+        const block = new Uint8Array(64);
+        let blockLength = 0;
+        let totalLength = 0;
+        const rotr = (x, n) => (x >>> n) | (x << (32 - n));
+        const compress = (bytes, offset) => {
+            for (let i = 0; i < 16; i++) {
+                const j = offset + i * 4;
+                words[i] = (bytes[j] << 24) | (bytes[j + 1] << 16) | (bytes[j + 2] << 8) | bytes[j + 3];
+            }
+            for (let i = 16; i < 64; i++) {
+                const w15 = words[i - 15];
+                const w2 = words[i - 2];
+                const s0 = rotr(w15, 7) ^ rotr(w15, 18) ^ (w15 >>> 3);
+                const s1 = rotr(w2, 17) ^ rotr(w2, 19) ^ (w2 >>> 10);
+                words[i] = words[i - 16] + s0 + words[i - 7] + s1;
+            }
+            let [a, b, c, d, e, f, g, h] = state;
+            for (let i = 0; i < 64; i++) {
+                const t1 = (h + (rotr(e, 6) ^ rotr(e, 11) ^ rotr(e, 25)) + ((e & f) ^ (~e & g)) + SHA256_K[i] + words[i]) | 0;
+                const t2 = ((rotr(a, 2) ^ rotr(a, 13) ^ rotr(a, 22)) + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+                h = g; g = f; f = e; e = (d + t1) | 0;
+                d = c; c = b; b = a; a = (t1 + t2) | 0;
+            }
+            [a, b, c, d, e, f, g, h].forEach((value, i) => { state[i] += value; });
+        };
+        const update = bytes => {
+            let offset = 0;
+            totalLength += bytes.length;
+            if (blockLength) {
+                const take = Math.min(64 - blockLength, bytes.length);
+                block.set(bytes.subarray(0, take), blockLength);
+                blockLength += take;
+                offset = take;
+                if (blockLength < 64) return;
+                compress(block, 0);
+                blockLength = 0;
+            }
+            for (; offset + 64 <= bytes.length; offset += 64) compress(bytes, offset);
+            block.set(bytes.subarray(offset), 0);
+            blockLength = bytes.length - offset;
+        };
+        const hex = () => {
+            const bits = totalLength * 8;
+            const padding = new Uint8Array((blockLength < 56 ? 56 : 120) - blockLength + 8);
+            padding[0] = 0x80;
+            const view = new DataView(padding.buffer);
+            view.setUint32(padding.length - 8, Math.floor(bits / 2 ** 32));
+            view.setUint32(padding.length - 4, bits >>> 0);
+            update(padding);
+            return Array.from(state, word => word.toString(16).padStart(8, '0')).join('');
+        };
+        return { update, hex };
+    }
+
+    // Files are read in slices of this size, so hashing never holds more
+    // than one slice of a file in memory.
+    const HASH_SLICE_BYTES = 8 * 1024 * 1024;
+
+    async function sha256Hex(file) {
+        if (file.size <= HASH_SLICE_BYTES && window.crypto?.subtle) {
+            const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+            return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+        }
+        const hash = createSha256();
+        for (let offset = 0; offset < file.size; offset += HASH_SLICE_BYTES) {
+            hash.update(new Uint8Array(await file.slice(offset, offset + HASH_SLICE_BYTES).arrayBuffer()));
+        }
+        return hash.hex();
+    }
+
+    // Hashing in JavaScript takes a few seconds per gigabyte, so files above
+    // this size are uploaded without asking the server whether it has them.
+    const PRECHECK_HASH_LIMIT = 512 * 1024 * 1024;
+
+    // Digest sent when a file's upload session starts: the server registers
+    // content it already stores at once instead of taking the bytes again.
+    async function uploadDigest(file) {
+        if (file.size > PRECHECK_HASH_LIMIT) return undefined;
+        try {
+            return await sha256Hex(file);
+        } catch (error) {
+            console.warn(`Could not hash ${file.name}, uploading it in full:`, error);
+            return undefined;
+        }
+    }
+
+    const UPLOAD_FILE_CONCURRENCY = 3;
+    const UPLOAD_CHUNK_CONCURRENCY = 4;
+    const UPLOAD_CHUNK_RETRIES = 4;
+    // Open upload sessions by file identity, so retrying a failed batch
+    // resumes each file from the chunks the server already has.
+    const uploadSessionIds = new Map();
+
+    async function runWithConcurrency(items, limit, worker) {
+        let next = 0;
+        const runners = Array.from({ length: Math.min(limit, items.length) }, async () => {
+            while (next < items.length) {
+                await worker(items[next++]);
+            }
+        });
+        await Promise.all(runners);
+    }
+
+    async function putChunk(uploadId, index, blob) {
+        for (let attempt = 0; ; attempt++) {
+            try {
+                const response = await fetch(`/upload_sessions/${uploadId}/chunks/${index}`, { method: 'PUT', body: blob });
+                if (response.ok) return;
+                if (response.status < 500) {
+                    const result = await response.json().catch(() => ({}));
+                    throw Object.assign(new Error(result.error || `Chunk ${index} rejected`), { fatal: true });
+                }
+            } catch (error) {
+                if (error.fatal || attempt >= UPLOAD_CHUNK_RETRIES) throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+        }
+    }
+
+    async function uploadFileInChunks(file) {
+        const key = `${file.name}:${file.size}:${file.lastModified}`;
+        let session = null;
+        if (uploadSessionIds.has(key)) {
+            const response = await fetch(`/upload_sessions/${uploadSessionIds.get(key)}`);
+            if (response.ok) session = await response.json();
+        }
+        if (!session) {
+            const sha256 = await uploadDigest(file);
+            const response = await fetch('/upload_sessions', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ name: file.name, size: file.size, sha256 })
+            });
+            const result = await response.json().catch(() => ({}));
+            if (!response.ok) throw new Error(result.error || 'Upload failed');
+            if (result.filename) return result.filename;
+            session = result;
+            uploadSessionIds.set(key, session.upload_id);
+        }
+        const received = new Set(session.received);
+        const pending = [];
+        for (let i = 0; i < session.chunks; i++) {
+            if (!received.has(i)) pending.push(i);
+        }
+        await runWithConcurrency(pending, UPLOAD_CHUNK_CONCURRENCY, index => putChunk(
+            session.upload_id,
+            index,
+            file.slice(index * session.chunk_size, (index + 1) * session.chunk_size)
+        ));
+        const response = await fetch(`/upload_sessions/${session.upload_id}/complete`, { method: 'POST' });
+        const result = await response.json().catch(() => ({}));
+        if (response.status !== 409) uploadSessionIds.delete(key);
+        if (!response.ok) throw new Error(result.error || 'Upload failed');
+        return result.filename;
+    }
+
+    function addUploadedImages(names) {
+        names.forEach(name => {
+            if (!appState.images.some(existing => existing.path === name)) {
+                appState.images.push({ path: name });
+            }
+        });
+        renderImagePool();
+        showAppContainer();
+    }
+
     async function handleFileUpload(event) {
         const files = event.target.files;
         if (!files.length) return;
         showLoading('Uploading images...');
-        const formData = new FormData();
-        Array.from(files).forEach(file => formData.append('files[]', file));
         try {
-            const response = await fetch('/upload_images', { method: 'POST', body: formData });
-            const result = await response.json().catch(() => ({}));
-            if (!response.ok && !(result.uploaded || []).length) {
-                throw new Error(result.error || 'Upload failed');
-            }
-            let uploadedNames;
-            let invalidNames = [];
-            // The server returns an object with either a list of uploaded names
-            // or both uploaded and invalid keys.  Support both formats.
-            if (Array.isArray(result)) {
-                uploadedNames = result;
-            } else {
-                uploadedNames = result.uploaded || [];
-                invalidNames = result.invalid || [];
-            }
-            if (invalidNames.length) {
-                showStatus(`Some files were not uploaded: ${invalidNames.join(', ')}`, 'warning');
-            }
-            const newImages = uploadedNames.map(name => ({ path: name }));
-            newImages.forEach(newImg => {
-                if (!appState.images.some(existing => existing.path === newImg.path)) {
-                    appState.images.push(newImg);
+            const failedNames = [];
+            // Each file is hashed, checked and uploaded on its own, and added
+            // to the pool (starting its ingest on the server) as soon as it
+            // is done, without waiting for the rest of the batch.
+            await runWithConcurrency(Array.from(files), UPLOAD_FILE_CONCURRENCY, async file => {
+                try {
+                    addUploadedImages([await uploadFileInChunks(file)]);
+                } catch (error) {
+                    console.error(`Upload of ${file.name} failed:`, error);
+                    failedNames.push(file.name);
                 }
             });
-            renderImagePool();
-            showAppContainer();
+            if (failedNames.length === files.length) {
+                throw new Error('No files could be uploaded');
+            }
+            if (failedNames.length) {
+                showStatus(`Some files were not uploaded: ${failedNames.join(', ')}. Upload them again to resume.`, 'warning');
+            }
         } catch (error) {
             console.error('Upload failed:', error);
             showStatus(`Upload failed: ${error.message}`, 'error');
@@ -469,8 +682,58 @@ const DiptychApp = (() => {
             const baseName = imgData.path.split(/[/\\]/).pop();
             imgEl.alt = baseName;
             imgEl.src = `/thumbnail/${encodeURIComponent(imgData.path)}`;
-            imgEl.onload = () => { imgEl.classList.add('loaded'); thumbContainer.classList.remove('thumbnail-loading'); };
-            imgEl.onerror = () => setTimeout(() => { imgEl.src = `/thumbnail/${encodeURIComponent(imgData.path)}?t=${Date.now()}` }, 1000);
+            imgEl.onload = () => {
+                imgEl.classList.add('loaded');
+                thumbContainer.classList.remove('thumbnail-loading');
+                // A result reported after the image had already loaded is never read.
+                thumbnailResults.delete(imgData.path);
+            };
+            const thumbUrl = `/thumbnail/${encodeURIComponent(imgData.path)}`;
+            const markFailed = () => {
+                thumbnailResults.delete(imgData.path);
+                thumbContainer.classList.remove('thumbnail-loading');
+                thumbContainer.classList.add('thumbnail-failed');
+                thumbContainer.title = `${baseName} could not be read`;
+            };
+            const settle = error => {
+                if (error) markFailed();
+                else imgEl.src = `${thumbUrl}?t=${Date.now()}`;
+            };
+            const settleReported = () => {
+                if (!thumbnailResults.has(imgData.path)) return false;
+                const error = thumbnailResults.get(imgData.path);
+                thumbnailResults.delete(imgData.path);
+                settle(error);
+                return true;
+            };
+            imgEl.onerror = async () => {
+                // 404 means the upload is still being ingested; 422 means it
+                // could not be decoded, so stop waiting and show the error.
+                if (settleReported()) return;
+                try {
+                    const probe = await fetch(thumbUrl, { method: 'HEAD' });
+                    if (probe.status === 422) {
+                        markFailed();
+                        return;
+                    }
+                } catch (error) {
+                    // Network hiccup: keep waiting.
+                }
+                if (settleReported()) return;
+                if (thumbnailEventsConnected) {
+                    // /thumbnail_events says when to load it again. Another
+                    // server process may have ingested it and announced it on
+                    // its own stream, so look again now and then regardless.
+                    pendingThumbnails.set(imgData.path, settle);
+                    setTimeout(() => {
+                        if (pendingThumbnails.get(imgData.path) !== settle) return;
+                        pendingThumbnails.delete(imgData.path);
+                        settle(null);
+                    }, 5000);
+                } else {
+                    setTimeout(() => settle(null), 1000);
+                }
+            };
             const filenameDiv = document.createElement('div');
             filenameDiv.className = 'filename';
             filenameDiv.textContent = imgData.path;
@@ -656,6 +919,55 @@ const DiptychApp = (() => {
         container.classList.add('hidden');
     }
 
+    // Preview blobs keyed by request body, revalidated with their ETag so the
+    // server can answer 304 when a diptych has not changed.
+    const previewBlobCache = new Map();
+    const PREVIEW_BLOB_CACHE_LIMIT = 50;
+    // Identifies this page to the server, which cancels a still-running
+    // preview when a newer one arrives for the same target.
+    const previewClientId = window.crypto?.randomUUID?.() ?? `${Date.now()}-${Math.random()}`;
+
+    // Describe an element's on-screen box so the server renders the preview
+    // at display resolution rather than at print DPI.
+    function previewViewport(element) {
+        const rect = element?.getBoundingClientRect();
+        if (!rect || rect.width <= 0 || rect.height <= 0) return undefined;
+        return {
+            width: Math.ceil(rect.width),
+            height: Math.ceil(rect.height),
+            dpr: window.devicePixelRatio || 1
+        };
+    }
+
+    // Resolves to null when a newer preview for the same target replaced this one.
+    async function fetchPreviewBlob(diptychPayload, viewport, target) {
+        const body = JSON.stringify({ diptych: diptychPayload, viewport });
+        const cached = previewBlobCache.get(body);
+        const headers = { 'Content-Type': 'application/json' };
+        if (cached) headers['If-None-Match'] = cached.etag;
+        const requestBody = JSON.stringify({ diptych: diptychPayload, viewport, client_id: previewClientId, target });
+        const response = await fetch('/get_wysiwyg_preview', { method: 'POST', headers, body: requestBody });
+        if (response.status === 409) return null;
+        if (response.status === 304 && cached) {
+            previewBlobCache.delete(body);
+            previewBlobCache.set(body, cached);
+            return cached.blob;
+        }
+        if (!response.ok) {
+            throw new Error(`Preview failed: ${response.statusText}`);
+        }
+        const blob = await response.blob();
+        const etag = response.headers.get('ETag');
+        if (etag) {
+            previewBlobCache.delete(body);
+            previewBlobCache.set(body, { etag, blob });
+            if (previewBlobCache.size > PREVIEW_BLOB_CACHE_LIMIT) {
+                previewBlobCache.delete(previewBlobCache.keys().next().value);
+            }
+        }
+        return blob;
+    }
+
     async function refreshWysiwygPreview() {
         const requestSeq = ++appState.previewRequestSeq;
         const activeDiptych = appState.diptychs[appState.activeDiptychIndex];
@@ -675,15 +987,8 @@ const DiptychApp = (() => {
             const diptychPayload = JSON.parse(JSON.stringify(activeDiptych));
             if (diptychPayload.image1) diptychPayload.image1.crop_focus = activeDiptych.config.crop_focus;
             if (diptychPayload.image2) diptychPayload.image2.crop_focus = activeDiptych.config.crop_focus;
-            const response = await fetch('/get_wysiwyg_preview', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ diptych: diptychPayload })
-            });
-            if (!response.ok) {
-                throw new Error(`Preview failed: ${response.statusText}`);
-            }
-            const blob = await response.blob();
+            const blob = await fetchPreviewBlob(diptychPayload, previewViewport(mainCanvas), 'canvas');
+            if (!blob) return;
             const imageUrl = URL.createObjectURL(blob);
             if (requestSeq !== appState.previewRequestSeq) {
                 URL.revokeObjectURL(imageUrl);
@@ -722,21 +1027,16 @@ const DiptychApp = (() => {
             const diptychPayload = JSON.parse(JSON.stringify(diptych));
             if (diptychPayload.image1) diptychPayload.image1.crop_focus = diptych.config.crop_focus;
             if (diptychPayload.image2) diptychPayload.image2.crop_focus = diptych.config.crop_focus;
-            const response = await fetch('/get_wysiwyg_preview', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ diptych: diptychPayload })
-            });
-            if (response.ok) {
-                const imageBlob = await response.blob();
-                revokeTrayPreviewUrl(element);
-                const objectUrl = URL.createObjectURL(imageBlob);
-                element.dataset.objectUrl = objectUrl;
-                element.style.backgroundImage = `url(${objectUrl})`;
-            } else {
-                revokeTrayPreviewUrl(element);
-                element.style.backgroundImage = 'none';
-            }
+            const imageBlob = await fetchPreviewBlob(
+                diptychPayload,
+                previewViewport(element),
+                `tray-${appState.diptychs.indexOf(diptych)}`
+            );
+            if (!imageBlob) return;
+            revokeTrayPreviewUrl(element);
+            const objectUrl = URL.createObjectURL(imageBlob);
+            element.dataset.objectUrl = objectUrl;
+            element.style.backgroundImage = `url(${objectUrl})`;
         } catch (error) {
             console.error("Tray preview failed:", error);
             revokeTrayPreviewUrl(element);
@@ -845,60 +1145,111 @@ const DiptychApp = (() => {
             if (!startResponse.ok) throw new Error('Failed to start generation on server.');
             const startResult = await startResponse.json();
             const jobId = startResult.job_id;
-            const progressInterval = setInterval(async () => {
+            if (typeof EventSource !== 'undefined') {
+                followGenerationEvents(jobId);
+            } else {
+                pollGenerationProgress(jobId);
+            }
+        } catch (error) {
+            hideLoading();
+            showStatus(`An error occurred: ${error.message}`, 'error');
+            appState.isGenerating = false;
+        }
+    }
+
+    function showGenerationProgress(progress) {
+        const percent = progress.total > 0 ? (progress.processed / progress.total) * 100 : 0;
+        const current = Math.min(progress.processed + 1, progress.total);
+        updateLoadingProgress(percent, `Generating diptych ${current} of ${progress.total}...`);
+    }
+
+    function failGeneration(message) {
+        hideLoading();
+        showStatus(`Generation failed: ${message}`, 'error');
+        appState.isGenerating = false;
+    }
+
+    // A failed item does not stop the others, so the outcome is decided
+    // from the final summary: whatever was rendered is offered for download
+    // (with the failures reported), and only a job with no output fails.
+    function settleGeneration(jobId, summary) {
+        if (summary.processed - summary.failed > 0) finishGeneration(jobId);
+        else failGeneration(summary.error || 'No diptychs could be generated');
+    }
+
+    // Each event carries one diptych's result, so large batches do not
+    // re-send the whole job on every update.
+    function followGenerationEvents(jobId) {
+        const source = new EventSource(`/generation_events/${encodeURIComponent(jobId)}`);
+        source.addEventListener('item', e => showGenerationProgress(JSON.parse(e.data)));
+        source.addEventListener('failed', e => showGenerationProgress(JSON.parse(e.data)));
+        source.addEventListener('done', e => {
+            source.close();
+            settleGeneration(jobId, JSON.parse(e.data));
+        });
+        source.onerror = () => {
+            // EventSource reconnects by itself unless the server refused the stream.
+            if (source.readyState === EventSource.CLOSED) pollGenerationProgress(jobId);
+        };
+    }
+
+    function pollGenerationProgress(jobId) {
+        const progressInterval = setInterval(async () => {
+            try {
                 const progressResponse = await fetch(`/get_generation_progress?job_id=${encodeURIComponent(jobId)}`);
                 const progress = await progressResponse.json();
-                // Check for server-side errors
-                if (progress.error) {
+                showGenerationProgress(progress);
+                if (progress.done) {
                     clearInterval(progressInterval);
-                    hideLoading();
-                    showStatus(`Generation failed: ${progress.error}`, 'error');
-                    appState.isGenerating = false;
-                    return;
-                }
-                const percent = progress.total > 0 ? (progress.processed / progress.total) * 100 : 0;
-                const current = Math.min(progress.processed + 1, progress.total);
-                updateLoadingProgress(percent, `Generating diptych ${current} of ${progress.total}...`);
-                if (progress.processed >= progress.total) {
-                    clearInterval(progressInterval);
-                    updateLoadingProgress(100, 'Finalizing download...');
-                    const finalResponse = await fetch(`/finalize_download?job_id=${encodeURIComponent(jobId)}`);
-                    const finalResult = await finalResponse.json();
-                    hideLoading();
-                    if (finalResult.error) {
-                        showStatus(`Download failed: ${finalResult.error}`, 'error');
-                    } else if (finalResult.download_id) {
-                        window.location.href = `/download_file?id=${encodeURIComponent(finalResult.download_id)}`;
-                    } else if (finalResult.download_path) {
-                        window.location.href = `/download_file?path=${encodeURIComponent(finalResult.download_path)}`;
-                    } else if (finalResult.download_ids) {
-                        finalResult.download_ids.forEach((id, index) => {
-                            setTimeout(() => {
-                                const a = document.createElement('a');
-                                a.href = `/download_file?id=${encodeURIComponent(id)}`;
-                                document.body.appendChild(a);
-                                a.click();
-                                document.body.removeChild(a);
-                            }, 300 * index);
-                        });
-                    } else if (finalResult.download_paths) {
-                        finalResult.download_paths.forEach((path, index) => {
-                            setTimeout(() => {
-                                const a = document.createElement('a');
-                                a.href = `/download_file?path=${encodeURIComponent(path)}`;
-                                a.download = path.split(/[\\/]/).pop();
-                                document.body.appendChild(a);
-                                a.click();
-                                document.body.removeChild(a);
-                            }, 300 * index);
-                        });
-                    }
-                    appState.isGenerating = false;
+                    settleGeneration(jobId, progress);
                 }
-            }, 1000);
+            } catch (error) {
+                // Network hiccup: try again on the next tick.
+            }
+        }, 1000);
+    }
+
+    async function finishGeneration(jobId) {
+        updateLoadingProgress(100, 'Finalizing download...');
+        try {
+            const finalResponse = await fetch(`/finalize_download?job_id=${encodeURIComponent(jobId)}`);
+            const finalResult = await finalResponse.json();
+            hideLoading();
+            if (finalResult.error) {
+                showStatus(`Download failed: ${finalResult.error}`, 'error');
+            } else if (finalResult.download_url) {
+                window.location.href = finalResult.download_url;
+            } else if (finalResult.download_id) {
+                window.location.href = `/download_file?id=${encodeURIComponent(finalResult.download_id)}`;
+            } else if (finalResult.download_path) {
+                window.location.href = `/download_file?path=${encodeURIComponent(finalResult.download_path)}`;
+            } else if (finalResult.download_ids) {
+                finalResult.download_ids.forEach((id, index) => {
+                    setTimeout(() => {
+                        const a = document.createElement('a');
+                        a.href = `/download_file?id=${encodeURIComponent(id)}`;
+                        document.body.appendChild(a);
+                        a.click();
+                        document.body.removeChild(a);
+                    }, 300 * index);
+                });
+            } else if (finalResult.download_paths) {
+                finalResult.download_paths.forEach((path, index) => {
+                    setTimeout(() => {
+                        const a = document.createElement('a');
+                        a.href = `/download_file?path=${encodeURIComponent(path)}`;
+                        a.download = path.split(/[\\/]/).pop();
+                        document.body.appendChild(a);
+                        a.click();
+                        document.body.removeChild(a);
+                    }, 300 * index);
+                });
+            }
+            if (!finalResult.error && finalResult.warning) showStatus(finalResult.warning, 'warning');
         } catch (error) {
             hideLoading();
             showStatus(`An error occurred: ${error.message}`, 'error');
+        } finally {
             appState.isGenerating = false;
         }
     }
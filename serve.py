@@ -0,0 +1,146 @@
+"""Production entry point for the Diptych Creator server.
+
+`python app.py` runs Werkzeug's development server, which handles requests
+one thread at a time per connection and is not meant for concurrent
+traffic. This script serves the same Flask app with waitress, a pure-Python
+multi-threaded WSGI server, and can pre-fork several worker processes that
+share one listening socket.
+
+Every worker starts its own background services (cleanup thread, thread
+pools and render process pool) through `start_background_services`, sized
+to its share of the host's memory budget and pools (see `SERVE_WORKERS` in
+app). The parent only binds the socket, clears the cache when asked, and
+restarts workers that exit unexpectedly. Several workers must share state
+through `DIPTYCH_STATE_DB`, since a client's requests may reach any of them.
+
+Each open event stream (/thumbnail_events, /generation_events) holds one of
+a worker's `DIPTYCH_SERVE_THREADS` threads for as long as the page is open.
+A worker serves at most `DIPTYCH_MAX_EVENT_STREAMS` of them at once, half
+its threads by default, and refuses further streams with 503 so those pages
+poll instead; raise the threads to keep more pages on live streams.
+
+Some state stays with one worker: event streams (/thumbnail_events and
+/generation_events) only carry what that worker did, so pages also re-check
+what they wait for; a newer preview only cancels the one it replaces when
+both reach the same worker; and each worker has its own render caches.
+"""
+
+import logging
+import os
+import signal
+import socket
+import sys
+
+logger = logging.getLogger('serve')
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def server_options():
+    """Return waitress settings from the DIPTYCH_SERVE_* environment variables."""
+    return {
+        # Open event streams each hold a thread; app caps them at
+        # DIPTYCH_MAX_EVENT_STREAMS (half of these by default).
+        'threads': max(1, env_int('DIPTYCH_SERVE_THREADS', 32)),
+        'connection_limit': max(1, env_int('DIPTYCH_SERVE_CONNECTIONS', 256)),
+        # Idle keep-alive connections are closed after this many seconds.
+        'channel_timeout': max(1, env_int('DIPTYCH_SERVE_KEEPALIVE_SECONDS', 60)),
+        'max_request_body_size': int(float(os.environ.get('DIPTYCH_MAX_REQUEST_MB', 1024)) * 1024 * 1024),
+        'max_request_header_size': 256 * 1024,
+        'ident': 'diptych-creator',
+    }
+
+def bind_socket(host, port, backlog=1024):
+    """Open the listening socket that every worker accepts from."""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+def create_server(sock, options=None):
+    """Return a waitress server for the app on an already bound socket."""
+    from waitress import create_server as create_waitress_server
+
+    import app as app_module
+    app_module.start_background_services()
+    return create_waitress_server(app_module.app, sockets=[sock], **(options or server_options()))
+
+def run_worker(sock, options):
+    server = create_server(sock, options)
+    logger.info("Worker %d started", os.getpid())
+    server.run()
+
+def supervise(sock, workers, options):
+    """Fork ``workers`` processes on ``sock`` and keep them running until stopped."""
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(sock, options)
+            except BaseException:
+                logger.exception("Worker %d stopped", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            logger.warning("Worker %d exited with status %d; starting a replacement", pid, status)
+            spawn()
+
+def main():
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+    host = os.environ.get('FLASK_HOST', '127.0.0.1')
+    port = int(os.environ.get('FLASK_PORT', '5000'))
+    workers = max(1, env_int('DIPTYCH_SERVE_WORKERS', 1))
+    if workers > 1 and not os.environ.get('DIPTYCH_STATE_DB'):
+        sys.exit("DIPTYCH_SERVE_WORKERS > 1 needs DIPTYCH_STATE_DB so the workers share jobs and downloads")
+    if workers > 1 and not hasattr(os, 'fork'):
+        sys.exit("DIPTYCH_SERVE_WORKERS > 1 is only supported where processes can fork")
+
+    import app as app_module
+    if os.environ.get('DIPTYCH_CLEAN_CACHE', '1') != '0':
+        # Once, before any worker exists, so no worker loses files in use.
+        app_module.reset_cache()
+    options = server_options()
+    sock = bind_socket(host, port)
+    logger.info(
+        "Serving on http://%s:%d with %d worker(s) x %d threads",
+        host, port, workers, options['threads'],
+    )
+    if workers == 1:
+        run_worker(sock, options)
+    else:
+        supervise(sock, workers, options)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+# state_backend.py
+
+"""
+Where the server keeps runtime state that requests need to share.
+
+Job records, download handles, the diptych order, upload times, chunked
+upload sessions and ingest outcomes are reached through a backend instead
+of module globals, so the same code runs as one process or as several
+processes behind a load balancer:
+
+``MemoryBackend``
+    Process-local state, the default. Stores are ``job_store.JobStore``
+    instances that hand out records by reference, exactly as before.
+
+``SQLiteBackend``
+    One SQLite database in WAL mode that every server process on the host
+    opens, so any of them can answer for jobs started by another.
+
+Both expose the same three calls: ``store(name, **limits)`` returns a job
+store with the ``JobStore`` API plus ``save(key, record, fields)`` to
+publish a mutated record, or just some of its fields;
+``mapping(name, encode, decode)`` returns a dict-like map whose
+``modify(key, change)`` updates one value atomically; and
+``get_value``/``set_value`` hold single values. With SQLite, record
+values that cannot be stored as JSON (locks, events, futures) stay in the
+process that created the record, which keeps using its live object;
+other processes see the JSON fields as of the last ``put`` or ``save``.
+"""
+
+from collections.abc import MutableMapping
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import job_store
+
+JSON_TYPES = (str, int, float, bool, type(None), list, dict)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    store TEXT NOT NULL,
+    key TEXT NOT NULL,
+    record TEXT NOT NULL,
+    payload BLOB,
+    touched REAL NOT NULL,
+    PRIMARY KEY (store, key)
+);
+CREATE INDEX IF NOT EXISTS records_touched ON records (store, touched);
+CREATE TABLE IF NOT EXISTS entries (
+    map TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (map, key)
+);
+CREATE TABLE IF NOT EXISTS state_values (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+def shareable(record):
+    """Return ``record``, or the fields of a dict record, that can be stored as JSON."""
+    if not isinstance(record, dict):
+        return record
+    return {key: value for key, value in record.items() if isinstance(value, JSON_TYPES)}
+
+class MemoryMapping(dict):
+    """Process-local map with the ``modify`` call of ``SQLiteMapping``."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def modify(self, key, change):
+        """Replace the value of ``key`` with ``change(value)``; return it, or None when absent."""
+        with self._lock:
+            if key not in self:
+                return None
+            value = self[key] = change(self[key])
+            return value
+
+class MemoryBackend:
+    """Process-local state for a single server process."""
+
+    shared = False
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def store(self, name, **limits):
+        return job_store.JobStore(**limits)
+
+    def mapping(self, name, encode=None, decode=None):
+        return MemoryMapping()
+
+    def get_value(self, name, default=None):
+        with self._lock:
+            return self._values.get(name, default)
+
+    def set_value(self, name, value):
+        with self._lock:
+            self._values[name] = value
+
+    def close(self):
+        pass
+
+class SQLiteBackend:
+    """State shared by every process that opens the same database file."""
+
+    shared = True
+
+    def __init__(self, db_path, timeout=30.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._connection: sqlite3.Connection | None = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # A connection inherited across fork() must not be reused.
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            self._connection = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.executescript(SCHEMA)
+            self._pid = os.getpid()
+        return self._connection
+
+    def execute(self, sql, parameters=()):
+        """Run one statement in its own transaction and return all rows."""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                return connection.execute(sql, parameters).fetchall()
+
+    def change(self, sql, parameters=()):
+        """Run one write statement and return how many rows it changed."""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                return connection.execute(sql, parameters).rowcount
+
+    def transaction(self, work):
+        """Call ``work(connection)`` inside one write transaction."""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute('BEGIN IMMEDIATE')
+                return work(connection)
+
+    def close(self):
+        """Close the database; the next call reopens (and recreates) it."""
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+    def store(self, name, **limits):
+        return SQLiteJobStore(self, name, **limits)
+
+    def mapping(self, name, encode=None, decode=None):
+        return SQLiteMapping(self, name, encode, decode)
+
+    def get_value(self, name, default=None):
+        rows = self.execute('SELECT value FROM state_values WHERE name = ?', (name,))
+        return json.loads(rows[0][0]) if rows else default
+
+    def set_value(self, name, value):
+        self.execute(
+            'INSERT INTO state_values (name, value) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET value = excluded.value',
+            (name, json.dumps(value)),
+        )
+
+class SQLiteJobStore:
+    """
+    ``JobStore`` API over rows of the shared ``records`` table.
+
+    The count limit and TTL apply to the shared rows (the TTL counts from
+    the last write); ``evictable`` is checked against the stored JSON.
+    Payloads are stored as blobs in the row, so ``max_bytes`` and the spill
+    options do not apply. Records put by this process are also kept in a
+    local ``JobStore`` so their creator keeps working with the live object.
+    """
+
+    def __init__(self, backend, name, max_entries, ttl_seconds=None, evictable=None, clock=time.time, **_memory_limits):
+        self.backend = backend
+        self.name = name
+        self.max_entries = int(max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._evictable = evictable or (lambda record: True)
+        self._clock = clock
+        self._local = job_store.JobStore(max_entries, ttl_seconds=ttl_seconds, evictable=evictable)
+        self.evictions = 0
+
+    def _expired(self, record, touched, now):
+        return (
+            self.ttl_seconds is not None
+            and now - touched > self.ttl_seconds
+            and self._evictable(record)
+        )
+
+    def _evict_over_count(self, connection):
+        rows = connection.execute(
+            'SELECT key, record FROM records WHERE store = ? ORDER BY touched',
+            (self.name,),
+        ).fetchall()
+        excess = len(rows) - self.max_entries
+        for key, record in rows:
+            if excess <= 0:
+                break
+            if self._evictable(json.loads(record)):
+                connection.execute('DELETE FROM records WHERE store = ? AND key = ?', (self.name, key))
+                self._local.pop(key)
+                self.evictions += 1
+                excess -= 1
+
+    def put(self, key, record):
+        """Insert or replace the record for ``key`` (dropping any payload)."""
+        self._local.put(key, record)
+        encoded = json.dumps(shareable(record))
+
+        def write(connection):
+            connection.execute(
+                'INSERT OR REPLACE INTO records (store, key, record, payload, touched) VALUES (?, ?, ?, NULL, ?)',
+                (self.name, key, encoded, self._clock()),
+            )
+            self._evict_over_count(connection)
+        self.backend.transaction(write)
+
+    def save(self, key, record, fields=None):
+        """
+        Publish the current fields of ``record``; returns False if it is gone.
+
+        With ``fields``, only those are written, so frequent updates of a
+        few counters do not rewrite a large record.
+        """
+        self._local.save(key, record)
+        if fields is None:
+            return self.backend.change(
+                'UPDATE records SET record = ?, touched = ? WHERE store = ? AND key = ?',
+                (json.dumps(shareable(record)), self._clock(), self.name, key),
+            ) > 0
+        values = shareable({field: record[field] for field in fields})
+        assignments = ''.join(', ?, json(?)' for _ in values)
+        parameters = [value for field, item in values.items() for value in (f'$."{field}"', json.dumps(item))]
+        return self.backend.change(
+            f'UPDATE records SET record = json_set(record{assignments}), touched = ? WHERE store = ? AND key = ?',
+            (*parameters, self._clock(), self.name, key),
+        ) > 0
+
+    def get(self, key, default=None):
+        """Return this process's live record for ``key``, else the shared one."""
+        record = self._local.get(key)
+        if record is not None:
+            return record
+        rows = self.backend.execute(
+            'SELECT record, touched FROM records WHERE store = ? AND key = ?',
+            (self.name, key),
+        )
+        if not rows:
+            return default
+        record = json.loads(rows[0][0])
+        if self._expired(record, rows[0][1], self._clock()):
+            self.pop(key)
+            self.evictions += 1
+            return default
+        return record
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def pop(self, key, default=None):
+        """Remove ``key`` and return its record."""
+        local = self._local.pop(key)
+
+        def remove(connection):
+            rows = connection.execute(
+                'SELECT record FROM records WHERE store = ? AND key = ?',
+                (self.name, key),
+            ).fetchall()
+            connection.execute('DELETE FROM records WHERE store = ? AND key = ?', (self.name, key))
+            return rows
+        rows = self.backend.transaction(remove)
+        if local is not None:
+            return local
+        return json.loads(rows[0][0]) if rows else default
+
+    def set_payload(self, key, payload):
+        """Attach result bytes to an existing record; returns False if it is gone."""
+        return self.backend.change(
+            'UPDATE records SET payload = ?, touched = ? WHERE store = ? AND key = ?',
+            (sqlite3.Binary(bytes(payload)), self._clock(), self.name, key),
+        ) > 0
+
+    def get_payload(self, key):
+        """Return the bytes attached to ``key``."""
+        rows = self.backend.execute(
+            'SELECT payload FROM records WHERE store = ? AND key = ?',
+            (self.name, key),
+        )
+        return bytes(rows[0][0]) if rows and rows[0][0] is not None else None
+
+    def drop_payload(self, key):
+        """Release the bytes attached to ``key`` but keep its record."""
+        self.backend.execute(
+            'UPDATE records SET payload = NULL WHERE store = ? AND key = ?',
+            (self.name, key),
+        )
+
+    def purge(self):
+        """Drop expired rows; return how many went."""
+        self._local.purge()
+        if self.ttl_seconds is None:
+            return 0
+
+        def expire(connection):
+            now = self._clock()
+            rows = connection.execute(
+                'SELECT key, record, touched FROM records WHERE store = ? AND touched < ?',
+                (self.name, now - self.ttl_seconds),
+            ).fetchall()
+            expired = [key for key, record, touched in rows if self._expired(json.loads(record), touched, now)]
+            connection.executemany(
+                'DELETE FROM records WHERE store = ? AND key = ?',
+                [(self.name, key) for key in expired],
+            )
+            return len(expired)
+        removed = self.backend.transaction(expire)
+        self.evictions += removed
+        return removed
+
+    def items(self):
+        """Return a snapshot list of ``(key, record)`` pairs."""
+        rows = self.backend.execute(
+            'SELECT key, record FROM records WHERE store = ? ORDER BY touched',
+            (self.name,),
+        )
+        return [(key, json.loads(record)) for key, record in rows]
+
+    def spilled_paths(self):
+        return set()
+
+    def stats(self):
+        """Return entry, byte and eviction counters."""
+        entries, payload_bytes = self.backend.execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM records WHERE store = ?',
+            (self.name,),
+        )[0]
+        return {
+            'entries': entries,
+            'payload_bytes': payload_bytes,
+            'spilled': 0,
+            'evictions': self.evictions,
+            'spills': 0,
+        }
+
+class SQLiteMapping(MutableMapping):
+    """Dict-like view of one map in the shared ``entries`` table."""
+
+    def __init__(self, backend, name, encode=None, decode=None):
+        self.backend = backend
+        self.name = name
+        self._encode = encode or (lambda value: value)
+        self._decode = decode or (lambda value: value)
+
+    def __getitem__(self, key):
+        rows = self.backend.execute(
+            'SELECT value FROM entries WHERE map = ? AND key = ?',
+            (self.name, key),
+        )
+        if not rows:
+            raise KeyError(key)
+        return self._decode(json.loads(rows[0][0]))
+
+    def __setitem__(self, key, value):
+        self.backend.execute(
+            'INSERT INTO entries (map, key, value) VALUES (?, ?, ?) '
+            'ON CONFLICT(map, key) DO UPDATE SET value = excluded.value',
+            (self.name, key, json.dumps(self._encode(value))),
+        )
+
+    def __delitem__(self, key):
+        removed = self.backend.change(
+            'DELETE FROM entries WHERE map = ? AND key = ?',
+            (self.name, key),
+        )
+        if not removed:
+            raise KeyError(key)
+
+    def __iter__(self):
+        rows = self.backend.execute('SELECT key FROM entries WHERE map = ?', (self.name,))
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        return self.backend.execute('SELECT COUNT(*) FROM entries WHERE map = ?', (self.name,))[0][0]
+
+    def clear(self):
+        self.backend.execute('DELETE FROM entries WHERE map = ?', (self.name,))
+
+    def modify(self, key, change):
+        """Replace the value of ``key`` with ``change(value)``; return it, or None when absent."""
+        def update(connection):
+            rows = connection.execute(
+                'SELECT value FROM entries WHERE map = ? AND key = ?',
+                (self.name, key),
+            ).fetchall()
+            if not rows:
+                return None
+            value = change(self._decode(json.loads(rows[0][0])))
+            connection.execute(
+                'UPDATE entries SET value = ? WHERE map = ? AND key = ?',
+                (json.dumps(self._encode(value)), self.name, key),
+            )
+            return value
+        return self.backend.transaction(update)
+
+def open_backend(db_path=None):
+    """Return a SQLite backend for ``db_path``, or process-local state without one."""
+    if db_path:
+        return SQLiteBackend(db_path)
+    return MemoryBackend()
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Set before any test imports app, so the uploads, proxies and metadata
+# index are created in a scratch directory instead of the checkout.
+os.environ.setdefault('DIPTYCH_CACHE_DIR', tempfile.mkdtemp(prefix='diptych-test-cache-'))
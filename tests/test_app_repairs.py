@@ -1,16 +1,21 @@
 import io
+import json
 import os
 import time
+import zipfile
 
 from PIL import Image
 
 from app import (
+    OBJECT_DIR,
     OUTPUT_DIR_BASE,
     THUMB_CACHE_DIR,
     UPLOAD_DIR,
     app,
     create_single_thumbnail,
+    existing_proxies,
     is_safe_output_path,
+    proxy_level_paths,
     thumbnail_cache_name,
 )
 
@@ -49,6 +54,23 @@ def test_thumbnail_handles_alpha_png():
         assert thumb.getpixel((2, 12))[2] > 235
 
 
+def test_thumbnail_task_builds_proxy_pyramid():
+    clear_dir(UPLOAD_DIR)
+    clear_dir(THUMB_CACHE_DIR)
+    source = os.path.join(UPLOAD_DIR, 'wide.jpg')
+    create_image(source, size=(2400, 1200), color='blue')
+
+    create_single_thumbnail(source)
+
+    levels = proxy_level_paths('wide.jpg')
+    assert levels[300] == os.path.join(THUMB_CACHE_DIR, thumbnail_cache_name('wide.jpg'))
+    assert existing_proxies('wide.jpg') == [levels[2048], levels[1024], levels[300]]
+    with Image.open(levels[2048]) as proxy:
+        assert proxy.size == (2048, 1024)
+    with Image.open(levels[300]) as thumb:
+        assert thumb.size == (300, 150)
+
+
 def test_preview_rejects_invalid_dimensions():
     clear_dir(UPLOAD_DIR)
     image_path = os.path.join(UPLOAD_DIR, 'tiny.jpg')
@@ -164,9 +186,197 @@ def test_upload_accepts_webp_and_rejects_fake_image():
     assert payload['invalid'] == ['fake.jpg']
 
 
+class InlineExecutor:
+    def submit(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+
+def test_upload_ingests_with_one_decode_and_records_hash():
+    import hashlib
+    from unittest.mock import patch
+    import app as app_module
+
+    clear_dir(UPLOAD_DIR)
+    clear_dir(THUMB_CACHE_DIR)
+    clear_dir(OBJECT_DIR)
+    payload = io.BytesIO()
+    Image.new('RGB', (1200, 800), 'green').save(payload, format='JPEG')
+    data = payload.getvalue()
+
+    opened = []
+    real_open = Image.open
+
+    def counting_open(fp, *args, **kwargs):
+        opened.append(fp)
+        return real_open(fp, *args, **kwargs)
+
+    with patch.object(app_module, 'ingest_executor', InlineExecutor()), \
+            patch.object(Image, 'open', side_effect=counting_open):
+        with app.test_client() as client:
+            response = client.post(
+                '/upload_images',
+                data={'files[]': [(io.BytesIO(data), 'scan.jpg')]},
+                content_type='multipart/form-data',
+            )
+
+    assert response.get_json()['uploaded'] == ['scan.jpg']
+    # One header check in the request, one decode during ingest.
+    assert len(opened) == 2
+    row = app_module.image_index.get('scan.jpg')
+    assert row['sha256'] == hashlib.sha256(data).hexdigest()
+    assert (row['width'], row['height']) == (1200, 800)
+    assert existing_proxies('scan.jpg') == [proxy_level_paths('scan.jpg')[1024], proxy_level_paths('scan.jpg')[300]]
+
+
+def test_undecodable_upload_is_discarded_and_reported():
+    from unittest.mock import patch
+    import app as app_module
+
+    clear_dir(UPLOAD_DIR)
+    clear_dir(THUMB_CACHE_DIR)
+    payload = io.BytesIO()
+    Image.effect_noise((400, 300), 64).convert('RGB').save(payload, format='JPEG')
+    truncated = payload.getvalue()[:payload.tell() // 2]
+
+    with patch.object(app_module, 'ingest_executor', InlineExecutor()):
+        with app.test_client() as client:
+            response = client.post(
+                '/upload_images',
+                data={'files[]': [(io.BytesIO(truncated), 'broken.jpg')]},
+                content_type='multipart/form-data',
+            )
+            assert response.get_json()['uploaded'] == ['broken.jpg']
+            thumb = client.get('/thumbnail/broken.jpg')
+
+    assert thumb.status_code == 422
+    assert 'error' in thumb.get_json()
+    assert not os.path.exists(os.path.join(UPLOAD_DIR, 'broken.jpg'))
+    assert app_module.image_index.get('broken.jpg') is None
+
+
 def test_download_path_guard_uses_commonpath():
     safe_path = os.path.join(OUTPUT_DIR_BASE, 'DiptychMaster_test', 'out.jpg')
     unsafe_prefix_match = os.path.abspath(OUTPUT_DIR_BASE) + '_else\\out.jpg'
 
     assert is_safe_output_path(safe_path)
     assert not is_safe_output_path(unsafe_prefix_match)
+
+
+def test_generation_reports_item_errors_and_keeps_requested_order():
+    clear_dir(UPLOAD_DIR)
+    first = os.path.join(UPLOAD_DIR, 'batch_first.jpg')
+    last = os.path.join(UPLOAD_DIR, 'batch_last.jpg')
+    create_image(first, color='red')
+    create_image(last, color='blue')
+    config = {'width': 4, 'height': 3, 'dpi': 10, 'fit_mode': 'fill'}
+    payload = {
+        'pairs': [
+            {'pair': [{'path': first}, None], 'config': config},
+            {'pair': [{'path': first}, None], 'config': dict(config, outer_border=50)},
+            {'pair': [{'path': last}, None], 'config': config},
+        ],
+        'zip': False,
+    }
+
+    with app.test_client() as client:
+        start = client.post('/generate_diptychs', json=payload)
+        job_id = start.get_json()['job_id']
+        while True:
+            progress = client.get(f'/get_generation_progress?job_id={job_id}').get_json()
+            if progress['done']:
+                break
+            time.sleep(0.05)
+        # The failed item does not hold back the outputs that did render.
+        final = client.get(f'/finalize_download?job_id={job_id}')
+
+    assert final.status_code == 200
+    assert [os.path.basename(path) for path in final.get_json()['download_paths']] == ['diptych_1.jpg', 'diptych_3.jpg']
+    assert final.get_json()['failed'] == 1
+    assert final.get_json()['warning'].startswith('1 of 3 diptychs could not be generated')
+    assert progress['processed'] == 3
+    assert progress['failed'] == 1
+    assert [item['index'] for item in progress['errors']] == [1]
+    assert 'Outer border' in progress['error']
+    assert [os.path.basename(path) for path in progress['final_paths']] == ['diptych_1.jpg', 'diptych_3.jpg']
+
+
+def run_generation(client, payload):
+    start = client.post('/generate_diptychs', json=payload)
+    assert start.status_code == 200
+    job_id = start.get_json()['job_id']
+    while True:
+        progress = client.get(f'/get_generation_progress?job_id={job_id}').get_json()
+        if progress['done']:
+            return job_id, progress
+        time.sleep(0.05)
+
+
+def test_zip_archive_is_written_during_generation_with_stored_entries():
+    clear_dir(UPLOAD_DIR)
+    source = os.path.join(UPLOAD_DIR, 'zip_source.jpg')
+    create_image(source, color='green')
+    job = {'pair': [{'path': source}, None], 'config': {'width': 4, 'height': 3, 'dpi': 10}}
+
+    with app.test_client() as client:
+        job_id, progress = run_generation(client, {'pairs': [job, job, job], 'zip': True})
+        assert progress['zip_path'].endswith('diptych_results.zip')
+        final = client.get(f'/finalize_download?job_id={job_id}').get_json()
+
+    assert final['is_zip'] is True
+    with zipfile.ZipFile(final['download_path']) as archive:
+        infos = archive.infolist()
+    assert [info.filename for info in infos] == ['diptych_1.jpg', 'diptych_2.jpg', 'diptych_3.jpg']
+    assert all(info.compress_type == zipfile.ZIP_STORED for info in infos)
+
+
+def test_stream_zip_sends_archive_without_temp_file():
+    clear_dir(UPLOAD_DIR)
+    source = os.path.join(UPLOAD_DIR, 'stream_source.jpg')
+    create_image(source, color='yellow')
+    job = {'pair': [{'path': source}, None], 'config': {'width': 4, 'height': 3, 'dpi': 10}}
+
+    with app.test_client() as client:
+        job_id, progress = run_generation(client, {'pairs': [job, job], 'zip': True, 'stream_zip': True})
+        final = client.get(f'/finalize_download?job_id={job_id}').get_json()
+        response = client.get(final['download_url'])
+
+    assert progress['zip_path'] is None
+    assert not os.path.exists(os.path.join(progress['output_dir'], 'diptych_results.zip'))
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == ['diptych_1.jpg', 'diptych_2.jpg']
+        assert archive.testzip() is None
+
+
+def test_generation_events_stream_each_item_and_a_summary():
+    clear_dir(UPLOAD_DIR)
+    source = os.path.join(UPLOAD_DIR, 'events_source.jpg')
+    create_image(source, color='purple')
+    config = {'width': 4, 'height': 3, 'dpi': 10}
+    payload = {
+        'pairs': [
+            {'pair': [{'path': source}, None], 'config': config},
+            {'pair': [{'path': source}, None], 'config': dict(config, outer_border=50)},
+        ],
+        'zip': False,
+    }
+
+    with app.test_client() as client:
+        job_id = client.post('/generate_diptychs', json=payload).get_json()['job_id']
+        # The stream ends by itself after the summary.
+        body = client.get(f'/generation_events/{job_id}').get_data(as_text=True)
+        resumed = client.get(f'/generation_events/{job_id}', headers={'Last-Event-ID': '2'}).get_data(as_text=True)
+        assert client.get('/generation_events/unknown').status_code == 404
+
+    events = [
+        (line.split(': ', 1)[1], json.loads(data.split(': ', 1)[1]))
+        for line, data in (
+            block.splitlines()[1:3] for block in body.split('\n\n') if block.startswith('id: ')
+        )
+    ]
+    kinds = sorted(kind for kind, _ in events[:2])
+    assert kinds == ['failed', 'item']
+    assert all('final_paths' not in data for _, data in events)
+    assert events[-1] == ('done', {'processed': 2, 'failed': 1, 'total': 2, 'error': events[-1][1]['error']})
+    assert 'Outer border' in events[-1][1]['error']
+    assert resumed.startswith('id: 3\nevent: done\n')
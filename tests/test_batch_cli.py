@@ -0,0 +1,96 @@
+import json
+import os
+import time
+
+from PIL import Image
+
+import diptych_creator
+
+
+def write_csv(path, lines):
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('\n'.join(lines) + '\n')
+
+
+def read_report(output_dir):
+    with open(os.path.join(output_dir, diptych_creator.REPORT_NAME), encoding='utf-8') as source:
+        return json.load(source)
+
+
+def test_csv_manifest_renders_rows_and_reports_failures(tmp_path):
+    Image.new('RGB', (40, 30), 'red').save(tmp_path / 'left.jpg')
+    Image.new('RGB', (30, 40), 'blue').save(tmp_path / 'right.jpg')
+    manifest = tmp_path / 'prints.csv'
+    write_csv(manifest, [
+        'image1,image2,output,rotation2,crop_focus1,width,height,dpi,gap,outer_border',
+        'left.jpg,right.jpg,pair.jpg,90,0.2 0.5,4,3,10,2,1',
+        'left.jpg,,too_big_border.jpg,,,4,3,10,0,50',
+    ])
+    output_dir = tmp_path / 'out'
+
+    assert diptych_creator.main([str(manifest), str(output_dir), '--workers', '1']) == 1
+
+    with Image.open(output_dir / 'pair.jpg') as result:
+        assert result.size == (40, 30)
+        assert result.info['dpi'][0] == 10
+    report = read_report(output_dir)
+    assert (report['rendered'], report['skipped'], report['failed']) == (1, 0, 1)
+    assert report['results'][1]['row'] == 2
+    assert 'Outer border' in report['results'][1]['error']
+    assert not os.path.exists(output_dir / 'too_big_border.jpg')
+
+
+def test_rerun_skips_outputs_that_are_up_to_date(tmp_path):
+    source = tmp_path / 'only.jpg'
+    Image.new('RGB', (40, 30), 'green').save(source)
+    manifest = tmp_path / 'prints.json'
+    rows = [{'image1': {'path': 'only.jpg', 'rotation': 0}, 'config': {'width': 4, 'height': 3}}]
+    manifest.write_text(json.dumps({'defaults': {'dpi': 10}, 'rows': rows}))
+    output_dir = tmp_path / 'out'
+
+    assert diptych_creator.main([str(manifest), str(output_dir), '--workers', '1']) == 0
+    assert read_report(output_dir)['rendered'] == 1
+    assert diptych_creator.main([str(manifest), str(output_dir), '--workers', '1']) == 0
+    assert read_report(output_dir)['skipped'] == 1
+
+    # A newer source or different settings make the output stale.
+    later = time.time() + 5
+    os.utime(source, (later, later))
+    diptych_creator.main([str(manifest), str(output_dir), '--workers', '1'])
+    assert read_report(output_dir)['rendered'] == 1
+    rows[0]['config']['fit_mode'] = 'fit'
+    manifest.write_text(json.dumps({'defaults': {'dpi': 10}, 'rows': rows}))
+    diptych_creator.main([str(manifest), str(output_dir), '--workers', '1'])
+    assert read_report(output_dir)['rendered'] == 1
+    with Image.open(output_dir / 'diptych_1.jpg') as result:
+        assert result.size == (40, 30)
+
+
+def test_manifest_rows_use_web_defaults_and_validation(tmp_path):
+    rows = [
+        {'image1': 'a.jpg', 'image2': 'b.jpg', 'orientation': 'portrait', 'crop_focus': '0.1,0.9'},
+        {'image1': 'a.jpg', 'fit_mode': 'stretch'},
+        {'output': 'empty.jpg'},
+    ]
+    jobs = diptych_creator.plan_manifest(rows, '/out', '/photos')
+
+    first = jobs[0]
+    assert first['output'] == os.path.join('/out', 'diptych_1.jpg')
+    assert first['args'][0] == {'path': os.path.join('/photos', 'a.jpg'), 'rotation': 0, 'crop_focus': (0.1, 0.9)}
+    # 10x8 in at 72 DPI, flipped for portrait.
+    assert first['args'][3] == [576, 720]
+    assert 'fill or fit' in jobs[1]['error']
+    assert 'At least one image' in jobs[2]['error']
+
+
+def test_rows_writing_the_same_output_are_rejected():
+    rows = [
+        {'image1': 'a.jpg', 'output': 'pair.jpg'},
+        {'image1': 'b.jpg', 'output': os.path.join('nested', '..', 'pair.jpg')},
+        {'image1': 'c.jpg'},
+        {'image1': 'd.jpg', 'output': 'diptych_3.jpg'},
+    ]
+    jobs = diptych_creator.plan_manifest(rows, '/out', '/photos')
+    assert 'error' not in jobs[0] and 'error' not in jobs[2]
+    assert jobs[1]['error'] == 'Output pair.jpg is already written by row 1'
+    assert jobs[3]['error'] == 'Output diptych_3.jpg is already written by row 3'
@@ -9,7 +9,15 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-from diptych_creator import create_diptych_canvas, process_source_image, create_diptych
+from diptych_creator import (
+    build_proxy_pyramid,
+    calculate_preview_dimensions,
+    calculate_reduced_decode_scale,
+    create_diptych_canvas,
+    create_diptych,
+    process_source_image,
+    select_proxy,
+)
 from app import app, get_capture_time, UPLOAD_TIMES, UPLOAD_DIR
 from datetime import datetime
 import random
@@ -89,6 +97,107 @@ def test_auto_rotate_portrait_into_landscape_cell(tmp_path):
     assert result.size == (80, 50)
 
 
+def test_preview_dimensions_scale_gap_and_border():
+    config = {'width': 20, 'height': 16, 'gap': 30, 'outer_border': 15}
+    final_dims, processing, border, gap = calculate_preview_dimensions(config, 150, (1000, 1000))
+    assert final_dims == (1000, 800)
+    assert (border, gap) == (5, 10)
+    assert processing == (1000 - 10 - 10, 800 - 10)
+
+
+def test_preview_dimensions_never_exceed_output():
+    config = {'width': 4, 'height': 3, 'gap': 1, 'outer_border': 1}
+    assert calculate_preview_dimensions(config, 10, (4000, 4000)) == ((40, 30), (37, 28), 1, 1)
+
+
+def test_reduced_decode_scale_covers_cell():
+    # Fill keeps the full height of a wide source, so height decides.
+    assert calculate_reduced_decode_scale((4000, 2000), (100, 100), 'fill') == 0.05
+    # Fit only needs the longer axis to reach the cell.
+    assert calculate_reduced_decode_scale((4000, 2000), (100, 100), 'fit') == 0.025
+    # Nothing to gain when the cell needs more than half the source.
+    assert calculate_reduced_decode_scale((400, 300), (300, 300), 'fill') is None
+
+
+def test_large_jpeg_decodes_at_reduced_scale(tmp_path):
+    from PIL import JpegImagePlugin
+    path = tmp_path / "large.jpg"
+    Image.new('RGB', (800, 400), 'green').save(path)
+    original_draft = JpegImagePlugin.JpegImageFile.draft
+    with patch.object(JpegImagePlugin.JpegImageFile, 'draft', autospec=True, side_effect=original_draft) as draft:
+        result = process_source_image(str(path), (100, 50))
+    assert draft.call_count == 1
+    assert draft.call_args.args[2] == (100, 50)
+    assert result.size == (50, 50)
+    r, g, b = result.getpixel((25, 25))
+    assert g > 100 and r < 40 and b < 40
+
+
+def test_proxy_pyramid_is_upright_and_skips_oversized_levels(tmp_path):
+    source = tmp_path / "rotated.jpg"
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Rotate 90° clockwise for display
+    Image.new('RGB', (1200, 600), 'green').save(source, exif=exif)
+    levels = {edge: str(tmp_path / f"p{edge}.jpg") for edge in (2048, 1024, 300)}
+
+    written = build_proxy_pyramid(str(source), levels)
+
+    assert written == [levels[1024], levels[300]]
+    with Image.open(levels[1024]) as proxy:
+        assert proxy.size == (512, 1024)
+        assert proxy.getexif().get(0x0112) is None
+    with Image.open(levels[300]) as thumb:
+        assert thumb.size == (150, 300)
+
+
+def test_transparent_sources_only_get_a_thumbnail(tmp_path):
+    source = tmp_path / "alpha.png"
+    Image.new('RGBA', (1200, 600), (255, 0, 0, 0)).save(source)
+    levels = {edge: str(tmp_path / f"p{edge}.jpg") for edge in (1024, 300)}
+
+    assert build_proxy_pyramid(str(source), levels) == [levels[300]]
+    # The flattened thumbnail would lose the alpha, so it is never used.
+    assert select_proxy(str(source), [levels[300]], (10, 10)) == str(source)
+
+
+def test_process_source_image_reads_smallest_covering_proxy(tmp_path):
+    from diptych_creator import cell_cache
+    source = tmp_path / "large.png"
+    Image.new('RGB', (3000, 2000), 'blue').save(source)
+    levels = {edge: str(tmp_path / f"p{edge}.jpg") for edge in (2048, 1024, 300)}
+    proxies = build_proxy_pyramid(str(source), levels)
+
+    assert select_proxy(str(source), proxies, (200, 200)) == levels[300]
+    assert select_proxy(str(source), proxies, (600, 600)) == levels[1024]
+    assert select_proxy(str(source), proxies, (1800, 1800)) == str(source)
+    # Fit mode only needs the long edge to reach the cell.
+    assert select_proxy(str(source), proxies, (900, 900), fit_mode='fit') == levels[1024]
+
+    cell_cache.clear()
+    with patch('diptych_creator.Image.open', wraps=Image.open) as opened:
+        result = process_source_image(str(source), (1200, 600), proxies=proxies)
+    assert opened.call_args_list[-1].args[0] == levels[1024]
+    assert result.size == (600, 600)
+    r, g, b = result.getpixel((300, 300))
+    assert b > 200 and r < 40 and g < 40
+
+
+def test_proxy_choice_is_remembered_until_a_file_changes(tmp_path):
+    source = tmp_path / "remembered.png"
+    Image.new('RGB', (3000, 2000), 'blue').save(source)
+    levels = {edge: str(tmp_path / f"p{edge}.jpg") for edge in (1024, 300)}
+    proxies = build_proxy_pyramid(str(source), levels)
+
+    assert select_proxy(str(source), proxies, (200, 200)) == levels[300]
+    with patch('diptych_creator.Image.open', wraps=Image.open) as opened:
+        assert select_proxy(str(source), proxies, (200, 200)) == levels[300]
+    assert opened.call_count == 0
+
+    # A proxy that disappears changes the key, so the choice is made again.
+    os.remove(levels[300])
+    assert select_proxy(str(source), proxies, (200, 200)) == levels[1024]
+
+
 def test_get_capture_time_falls_back_to_upload(tmp_path):
     path = tmp_path / "sample.jpg"
     Image.new('RGB', (10, 10), 'white').save(path)
@@ -223,3 +332,87 @@ def test_preserve_exif_metadata(tmp_path):
         assert exif_res.get(306) == '2020:01:01 10:00:00'
 
 
+
+
+@pytest.mark.parametrize('final_dims, fit_mode, rotation, both', [
+    ((120, 70), 'fill', 0, True),
+    ((120, 70), 'fill', 90, True),
+    ((70, 120), 'fit', 270, True),
+    ((90, 90), 'fill', 180, False),
+])
+def test_low_memory_strips_match_in_memory_output(tmp_path, final_dims, fit_mode, rotation, both):
+    left = tmp_path / 'left.png'
+    right = tmp_path / 'right.png'
+    gradient = Image.linear_gradient('L').resize((160, 90))
+    Image.merge('RGB', (gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), gradient)).save(left)
+    transparent = Image.new('RGBA', (60, 100), (20, 200, 40, 255))
+    transparent.paste((0, 0, 0, 0), (0, 0, 30, 100))
+    transparent.save(right)
+    image2 = {'path': str(right)} if both else None
+    in_memory = tmp_path / 'in_memory.jpg'
+    strips = tmp_path / 'strips.jpg'
+    args = ({'path': str(left), 'rotation': rotation}, image2)
+    kwargs = dict(final_dims=final_dims, gap_px=6, fit_mode=fit_mode, dpi=150, outer_border_px=3, border_color='#336699')
+
+    create_diptych(*args, str(in_memory), **kwargs)
+    with patch('diptych_creator.STRIP_HEIGHT', 7):
+        create_diptych(*args, str(strips), low_memory=True, **kwargs)
+
+    assert strips.read_bytes() == in_memory.read_bytes()
+    # The memory-mapped scratch file is removed after saving.
+    assert sorted(os.listdir(tmp_path)) == ['in_memory.jpg', 'left.png', 'right.png', 'strips.jpg']
+
+
+def test_cell_cache_reuses_cells_across_colour_changes(tmp_path):
+    from diptych_creator import cell_cache
+    path = tmp_path / "cached.png"
+    Image.new('RGBA', (40, 20), (0, 0, 255, 255)).save(path)
+    cell_cache.clear()
+    before = cell_cache.stats()
+
+    first = process_source_image(str(path), (60, 60), fit_mode='fit', background_color='#ff0000', use_cache=True)
+    second = process_source_image(str(path), (60, 60), fit_mode='fit', background_color='#00ff00', use_cache=True)
+
+    stats = cell_cache.stats()
+    assert stats['misses'] - before['misses'] == 1
+    assert stats['hits'] - before['hits'] == 1
+    assert first.getpixel((0, 0)) == (255, 0, 0)
+    assert second.getpixel((0, 0)) == (0, 255, 0)
+
+
+def test_cell_cache_misses_after_source_changes(tmp_path):
+    from diptych_creator import cell_cache
+    path = tmp_path / "changing.png"
+    Image.new('RGB', (20, 20), 'red').save(path)
+    cell_cache.clear()
+    assert process_source_image(str(path), (40, 20), use_cache=True).getpixel((5, 5)) == (255, 0, 0)
+
+    Image.new('RGB', (24, 24), 'blue').save(path)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    assert process_source_image(str(path), (40, 20), use_cache=True).getpixel((5, 5)) == (0, 0, 255)
+
+
+def test_final_renders_bypass_the_cell_cache(tmp_path):
+    from diptych_creator import cell_cache
+    path = tmp_path / "print.png"
+    Image.new('RGB', (40, 20), 'red').save(path)
+    cell_cache.clear()
+    create_diptych({'path': str(path)}, None, str(tmp_path / 'out.jpg'), (80, 40), 0, 'fill', 72, 0, 'white')
+    assert cell_cache.stats()['entries'] == 0
+
+
+def test_cell_cache_evicts_least_recently_used_by_bytes():
+    from diptych_creator import ProcessedCellCache
+    cache = ProcessedCellCache(max_bytes=2 * 10 * 10 * 4)
+    cache.put('a', make_img(10, 10))
+    cache.put('b', make_img(10, 10))
+    assert cache.get('a') is not None
+    cache.put('c', make_img(10, 10))
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == 2 * 10 * 10 * 4
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from unittest.mock import patch
+
+from PIL import Image
+
+import app as app_module
+from app import UPLOAD_DIR, app
+from event_stream import EventLog, format_sse, sse_stream
+
+
+def test_readers_wait_for_events_after_their_last_id():
+    log = EventLog()
+    first = log.publish('ready', {'name': 'a.jpg'})
+    assert log.read(0) == [(first, 'ready', {'name': 'a.jpg'})]
+    assert log.read(first, timeout=0.01) == []
+
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(log.read(first)))
+    reader.start()
+    time.sleep(0.05)
+    second = log.publish('failed', {'name': 'b.jpg', 'error': 'bad'})
+    reader.join(timeout=2)
+    assert received == [(second, 'failed', {'name': 'b.jpg', 'error': 'bad'})]
+    # An id from an earlier server run replays what is retained.
+    assert [item[0] for item in log.read(99)] == [first, second]
+
+
+def test_log_keeps_newest_events_and_stream_ends_when_closed():
+    log = EventLog(maxlen=2)
+    for index in range(3):
+        log.publish('item', {'index': index})
+    log.close()
+    assert list(sse_stream(log, after=0)) == [
+        format_sse(2, 'item', {'index': 1}),
+        format_sse(3, 'item', {'index': 2}),
+    ]
+    assert format_sse(3, 'item', {'index': 2}) == 'id: 3\nevent: item\ndata: {"index":2}\n\n'
+
+
+def test_ingest_outcomes_are_published(tmp_path):
+    events = EventLog()
+    good = tmp_path / 'good.jpg'
+    Image.new('RGB', (64, 48), 'red').save(good)
+    bad = tmp_path / 'bad.jpg'
+    bad.write_bytes(b'not an image')
+    with patch.object(app_module, 'thumbnail_events', events):
+        for path in (good, bad):
+            target = os.path.join(UPLOAD_DIR, path.name)
+            with open(target, 'wb') as out:
+                out.write(path.read_bytes())
+            app_module.ingest_upload(target)
+        with app.test_client() as client:
+            response = client.get('/thumbnail_events', headers={'Last-Event-ID': '1'}, buffered=False)
+            assert response.mimetype == 'text/event-stream'
+            chunk = next(response.response)
+            response.close()
+
+    ready, failed = events.read(0)
+    assert ready[1:] == ('ready', {'name': 'good.jpg'})
+    assert failed[1] == 'failed' and failed[2]['name'] == 'bad.jpg'
+    assert chunk.startswith(b'id: 2\nevent: failed\n')
+
+
+def test_new_thumbnail_subscribers_skip_earlier_events():
+    events = EventLog()
+    events.publish('ready', {'name': 'old.jpg'})
+    events.close()
+    with patch.object(app_module, 'thumbnail_events', events):
+        with app.test_client() as client:
+            assert client.get('/thumbnail_events').data == b''
+            resumed = client.get('/thumbnail_events?after=0').data
+    assert resumed == format_sse(1, 'ready', {'name': 'old.jpg'}).encode()
+
+
+def test_event_streams_beyond_the_limit_are_refused():
+    events = EventLog()
+    events.close()
+    slots = threading.BoundedSemaphore(1)
+    with patch.object(app_module, 'thumbnail_events', events), \
+            patch.object(app_module, 'event_stream_slots', slots):
+        with app.test_client() as client:
+            held = client.get('/thumbnail_events', buffered=False)
+            assert held.status_code == 200
+            refused = client.get('/thumbnail_events')
+            assert refused.status_code == 503 and refused.headers['Retry-After']
+            # Closing the open stream frees its slot.
+            held.close()
+            again = client.get('/thumbnail_events')
+            assert again.status_code == 200
+            again.close()
+    assert slots.acquire(blocking=False)
@@ -1,7 +1,14 @@
 import pytest
 from PIL import Image
 
-from diptych_creator import apply_exif_orientation, ORIENTATION_TAG
+from diptych_creator import (
+    ORIENTATION_TAG,
+    TRANSPOSE_METHODS,
+    apply_exif_orientation,
+    plan_source_geometry,
+    process_source_image,
+    transform_box,
+)
 
 
 def build_image(size, pixels):
@@ -52,3 +59,93 @@ def test_orientation_7_mirror_and_rotate():
     assert result.size == (1, 2)
     assert result.getpixel((0, 0)) == (0, 0, 255)
     assert result.getpixel((0, 1)) == (255, 0, 0)
+
+
+QUADRANTS = [(230, 20, 20), (20, 200, 20), (20, 40, 230), (240, 220, 30)]
+
+
+def quadrant_image(size=(120, 80)):
+    width, height = size
+    img = Image.new('RGB', size)
+    for idx, color in enumerate(QUADRANTS):
+        x0 = (idx % 2) * width // 2
+        y0 = (idx // 2) * height // 2
+        img.paste(color, (x0, y0, x0 + width // 2, y0 + height // 2))
+    return img
+
+
+def legacy_process(img, cell, orientation, rotation):
+    """Reference pipeline applying each step to a full-size copy."""
+    ops = {
+        2: [Image.Transpose.FLIP_LEFT_RIGHT],
+        3: [Image.Transpose.ROTATE_180],
+        4: [Image.Transpose.FLIP_TOP_BOTTOM],
+        5: [Image.Transpose.FLIP_LEFT_RIGHT, Image.Transpose.ROTATE_90],
+        6: [Image.Transpose.ROTATE_270],
+        7: [Image.Transpose.FLIP_LEFT_RIGHT, Image.Transpose.ROTATE_270],
+        8: [Image.Transpose.ROTATE_90],
+    }
+    for op in ops.get(orientation, []):
+        img = img.transpose(op)
+    img = img.rotate(-rotation, expand=True)
+    half_w, half_h = cell
+    if half_w != half_h and (half_w > half_h) != (img.width > img.height):
+        img = img.rotate(90, expand=True)
+    target_aspect = half_w / half_h
+    if img.width / img.height > target_aspect:
+        new_width = int(target_aspect * img.height)
+        offset = (img.width - new_width) // 2
+        img = img.crop((offset, 0, offset + new_width, img.height))
+    else:
+        new_height = int(img.width / target_aspect)
+        offset = (img.height - new_height) // 2
+        img = img.crop((0, offset, img.width, offset + new_height))
+    return img.resize(cell, Image.Resampling.NEAREST)
+
+
+@pytest.mark.parametrize('orientation', range(1, 9))
+@pytest.mark.parametrize('rotation', [0, 90, 180, 270])
+@pytest.mark.parametrize('target_dims', [(80, 40), (60, 50)])
+def test_planned_geometry_matches_step_by_step_pipeline(tmp_path, orientation, rotation, target_dims):
+    source = quadrant_image()
+    path = tmp_path / 'oriented.png'
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = orientation
+    source.save(path, exif=exif)
+    cell = (target_dims[0] // 2, target_dims[1])
+
+    result = process_source_image(str(path), target_dims, rotation_override=rotation)
+    expected = legacy_process(source, cell, orientation, rotation)
+
+    assert result.size == cell
+    for fx, fy in [(0.2, 0.2), (0.8, 0.2), (0.2, 0.8), (0.8, 0.8)]:
+        point = (int(cell[0] * fx), int(cell[1] * fy))
+        actual = result.getpixel(point)
+        reference = expected.getpixel(point)
+        assert all(abs(a - e) <= 30 for a, e in zip(actual, reference)), (point, actual, reference)
+
+
+@pytest.mark.parametrize('transform', sorted(TRANSPOSE_METHODS))
+def test_transform_box_matches_transpose(transform):
+    source = quadrant_image((12, 8))
+    box = (2, 1, 9, 6)
+    method = TRANSPOSE_METHODS[transform]
+    oriented = source.transpose(method) if method is not None else source
+    mapped = transform_box(box, source.size, transform)
+    cropped_then_transposed = source.crop(box)
+    if method is not None:
+        cropped_then_transposed = cropped_then_transposed.transpose(method)
+    assert oriented.crop(mapped).tobytes() == cropped_then_transposed.tobytes()
+
+
+def test_plan_crops_before_resizing_in_source_orientation():
+    source_box, resized_size, method, oriented_size = plan_source_geometry(
+        (6000, 4000),
+        (200, 300),
+        orientation=6,
+    )
+    # Orientation 6 makes the source portrait, matching the portrait cell.
+    assert oriented_size == (4000, 6000)
+    assert method == Image.Transpose.ROTATE_270
+    assert resized_size == (300, 200)
+    assert source_box == (0, 0, 6000, 4000)
@@ -0,0 +1,131 @@
+import os
+from unittest.mock import patch
+
+from job_store import JobStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_records_are_evicted_past_the_count_limit():
+    store = JobStore(max_entries=3, shards=1)
+    for key in ('a', 'b', 'c'):
+        store.put(key, {'id': key})
+    assert store.get('a') == {'id': 'a'}
+    store.put('d', {'id': 'd'})
+    assert 'b' not in store
+    assert sorted(key for key, _ in store.items()) == ['a', 'c', 'd']
+    assert store.stats()['evictions'] == 1
+
+
+def test_running_records_are_not_evicted_or_expired():
+    clock = FakeClock()
+    store = JobStore(
+        max_entries=1, ttl_seconds=10, shards=1, clock=clock,
+        evictable=lambda record: record['status'] == 'done',
+    )
+    store.put('running', {'status': 'running'})
+    store.put('finished', {'status': 'done'})
+    assert 'running' in store
+    clock.now = 60
+    assert store.purge() == 1
+    assert store.get('running') == {'status': 'running'}
+    assert store.get('finished') is None
+
+
+def test_idle_records_expire_after_the_ttl():
+    clock = FakeClock()
+    store = JobStore(max_entries=10, ttl_seconds=10, shards=1, clock=clock)
+    store.put('old', {})
+    store.put('fresh', {})
+    clock.now = 8
+    store.get('fresh')
+    clock.now = 12
+    assert store.get('old') is None
+    assert store.get('fresh') == {}
+
+
+def test_payloads_over_the_byte_limit_spill_to_disk(tmp_path):
+    store = JobStore(max_entries=10, max_bytes=100, spill_dir=str(tmp_path), spill_bytes=80, shards=1)
+    for key in ('a', 'b', 'c'):
+        store.put(key, {})
+    store.set_payload('a', b'x' * 60)
+    store.set_payload('b', b'y' * 60)
+    assert store.stats()['payload_bytes'] == 60
+    assert len(store.spilled_paths()) == 1
+    assert store.get_payload('a') == b'x' * 60
+
+    # Large payloads skip memory entirely.
+    store.set_payload('c', b'z' * 90)
+    assert store.get_payload('c') == b'z' * 90
+    assert store.stats()['spilled'] == 2
+
+    paths = store.spilled_paths()
+    store.drop_payload('a')
+    store.pop('c')
+    assert store.spilled_paths() == set()
+    assert not any(os.path.exists(path) for path in paths)
+    assert store.get_payload('b') == b'y' * 60
+
+
+def test_spill_files_are_written_outside_the_shard_lock(tmp_path):
+    store = JobStore(max_entries=10, spill_dir=str(tmp_path), spill_bytes=10, shards=1)
+    store.put('a', {})
+    seen = []
+
+    def checked_open(path, mode='r', *args, **kwargs):
+        # Another thread can still use the shard and read the payload.
+        seen.append((store._shards[0].lock.locked(), store.get_payload('a')))
+        return open(path, mode, *args, **kwargs)
+
+    with patch('job_store.open', checked_open, create=True):
+        store.set_payload('a', b'x' * 20)
+    assert seen == [(False, b'x' * 20)]
+    assert len(store.spilled_paths()) == 1
+    assert store.get_payload('a') == b'x' * 20
+
+
+def test_a_payload_dropped_while_spilling_drops_the_spill_file(tmp_path):
+    store = JobStore(max_entries=10, spill_dir=str(tmp_path), spill_bytes=10, shards=1)
+    store.put('a', {})
+
+    def replacing_open(path, mode='r', *args, **kwargs):
+        store.drop_payload('a')
+        return open(path, mode, *args, **kwargs)
+
+    with patch('job_store.open', replacing_open, create=True):
+        store.set_payload('a', b'x' * 20)
+    assert store.spilled_paths() == set()
+    assert store.get_payload('a') is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_without_spill_dir_whole_entries_go_to_stay_within_bytes():
+    store = JobStore(max_entries=10, max_bytes=100, shards=1)
+    store.put('a', {})
+    store.put('b', {})
+    store.set_payload('a', b'x' * 60)
+    store.set_payload('b', b'y' * 60)
+    assert 'a' not in store
+    assert store.get_payload('b') == b'y' * 60
+    assert store.set_payload('a', b'late') is False
+
+
+def test_limits_apply_to_the_whole_store_not_each_shard():
+    store = JobStore(max_entries=64, max_bytes=64 * 10, shards=8)
+    # Keys that all land in one shard, as skewed ids would.
+    keys = [key for key in (f'job-{n}' for n in range(10000)) if store._shard(key) is store._shards[0]][:64]
+    for key in keys:
+        store.put(key, {'id': key})
+        store.set_payload(key, b'x' * 10)
+    assert store.stats()['evictions'] == 0
+    assert sorted(key for key, _ in store.items()) == sorted(keys)
+
+    store.put('one-more', {})
+    assert store.stats()['entries'] == 64
+    assert keys[0] not in store
@@ -0,0 +1,95 @@
+import os
+from datetime import datetime
+from unittest.mock import patch
+
+from PIL import Image
+
+import app as app_module
+from app import UPLOAD_DIR, app, ingest_upload
+from metadata_index import ImageMetadataIndex
+
+
+def clear_upload_dir():
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    for name in os.listdir(UPLOAD_DIR):
+        path = os.path.join(UPLOAD_DIR, name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def test_refresh_only_reads_new_or_changed_files(tmp_path):
+    index = ImageMetadataIndex(str(tmp_path / 'index.sqlite3'))
+    (tmp_path / 'files').mkdir()
+    directory = tmp_path / 'files'
+    for name in ('a.jpg', 'b.jpg'):
+        (directory / name).write_bytes(b'x')
+    seen = []
+
+    def extract(path):
+        seen.append(os.path.basename(path))
+        return {'width': 10, 'height': 5, 'aspect': 2.0}
+
+    rows = index.refresh(str(directory), extract)
+    assert [row['name'] for row in rows] == ['a.jpg', 'b.jpg']
+    assert seen == ['a.jpg', 'b.jpg']
+
+    index.refresh(str(directory), extract)
+    assert seen == ['a.jpg', 'b.jpg']
+
+    (directory / 'b.jpg').write_bytes(b'changed')
+    os.remove(directory / 'a.jpg')
+    rows = index.refresh(str(directory), extract)
+    assert seen == ['a.jpg', 'b.jpg', 'b.jpg']
+    assert [row['name'] for row in rows] == ['b.jpg']
+    assert index.get('a.jpg') is None
+    index.close()
+
+
+def test_new_hard_links_do_not_invalidate_their_siblings(tmp_path):
+    index = ImageMetadataIndex(str(tmp_path / 'index.sqlite3'))
+    directory = tmp_path / 'files'
+    directory.mkdir()
+    (directory / 'a.jpg').write_bytes(b'x')
+    seen = []
+
+    def extract(path):
+        seen.append(os.path.basename(path))
+        return {'width': 10, 'height': 5, 'aspect': 2.0}
+
+    index.refresh(str(directory), extract)
+    # Another alias of the same stored object changes the shared ctime.
+    os.link(directory / 'a.jpg', directory / 'b.jpg')
+    index.refresh(str(directory), extract)
+    assert seen == ['a.jpg', 'b.jpg']
+    index.close()
+
+
+def test_reindexing_keeps_upload_time(tmp_path):
+    index = ImageMetadataIndex(str(tmp_path / 'index.sqlite3'))
+    index.put({'name': 'a.jpg', 'mtime_ns': 1, 'ctime_ns': 1, 'size': 1, 'inode': 1, 'uploaded_at': 42.0})
+    index.put({'name': 'a.jpg', 'mtime_ns': 2, 'ctime_ns': 2, 'size': 1, 'inode': 1, 'width': 3})
+    row = index.get('a.jpg')
+    assert row['uploaded_at'] == 42.0
+    assert row['width'] == 3 and row['mtime_ns'] == 2
+    index.close()
+
+
+def test_auto_group_reads_index_instead_of_images():
+    clear_upload_dir()
+    wide = os.path.join(UPLOAD_DIR, 'wide.jpg')
+    tall = os.path.join(UPLOAD_DIR, 'tall.jpg')
+    Image.new('RGB', (40, 20), 'red').save(wide)
+    Image.new('RGB', (20, 40), 'blue').save(tall)
+    ingest_upload(wide, datetime(2022, 1, 1))
+    ingest_upload(tall, datetime(2022, 1, 2))
+
+    row = app_module.image_index.get('wide.jpg')
+    assert (row['width'], row['height'], row['orientation']) == (40, 20, 1)
+    assert row['red'] > 200 and row['blue'] < 40
+
+    with patch.object(app_module.Image, 'open', side_effect=AssertionError('image reopened')):
+        with app.test_client() as client:
+            resp = client.post('/auto_group', json={'method': 'orientation'})
+    assert resp.status_code == 200
+    assert resp.get_json()['pairs'] == [['wide.jpg'], ['tall.jpg']]
+    clear_upload_dir()
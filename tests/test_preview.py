@@ -1,12 +1,19 @@
 import os
 import io
+import threading
+from concurrent.futures import Future
+from unittest.mock import patch
+
+import pytest
 from PIL import Image
 
+import app as app_module
 from app import app, UPLOAD_DIR
 from diptych_creator import (
     calculate_diptych_dimensions,
     process_source_image,
     create_diptych_canvas,
+    process_image_pair,
 )
 
 
@@ -113,3 +120,175 @@ def test_preview_fit_background_color(tmp_path):
     r, g, b = preview.getpixel((0, 0))
     assert r > 240 and g < 30 and b < 30
 
+
+
+def test_preview_reports_stage_timings(tmp_path):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    img1_path = os.path.join(UPLOAD_DIR, 'f.jpg')
+    img2_path = os.path.join(UPLOAD_DIR, 'g.jpg')
+    create_image(img1_path, 'orange')
+    create_image(img2_path, 'navy')
+    diptych = {
+        'config': {'width': 4, 'height': 3, 'dpi': 10},
+        'image1': {'path': img1_path},
+        'image2': {'path': img2_path},
+    }
+
+    with app.test_client() as client:
+        resp = client.post('/get_wysiwyg_preview', json={'diptych': diptych})
+
+    assert resp.status_code == 200
+    stages = [part.split(';')[0].strip() for part in resp.headers['Server-Timing'].split(',')]
+    for stage in ('prepare', 'image1', 'image2', 'images', 'compose', 'encode'):
+        assert stage in stages
+
+
+def test_process_image_pair_names_failed_half(tmp_path):
+    good = tmp_path / 'good.jpg'
+    create_image(str(good), 'white')
+    bad = tmp_path / 'bad.jpg'
+    bad.write_bytes(b'not an image')
+
+    with pytest.raises(RuntimeError, match='bad.jpg'):
+        process_image_pair({'path': str(good)}, {'path': str(bad)}, (40, 20))
+
+
+def test_preview_etag_revalidates(tmp_path):
+    import app as app_module
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    img1_path = os.path.join(UPLOAD_DIR, 'etag1.jpg')
+    img2_path = os.path.join(UPLOAD_DIR, 'etag2.jpg')
+    create_image(img1_path, 'purple')
+    create_image(img2_path, 'orange')
+    diptych = {
+        'config': {'width': 4, 'height': 3, 'dpi': 10},
+        'image1': {'path': img1_path},
+        'image2': {'path': img2_path},
+    }
+
+    with app.test_client() as client:
+        first = client.post('/get_wysiwyg_preview', json={'diptych': diptych})
+        assert first.status_code == 200
+        etag = first.headers['ETag']
+        assert etag.startswith('W/') and first.headers['Cache-Control'] == 'no-cache'
+
+        hits = app_module.preview_cache.stats()['hits']
+        again = client.post('/get_wysiwyg_preview', json={'diptych': diptych})
+        assert again.status_code == 200
+        assert again.headers['ETag'] == etag
+        assert again.data == first.data
+        assert app_module.preview_cache.stats()['hits'] == hits + 1
+
+        revalidated = client.post(
+            '/get_wysiwyg_preview',
+            json={'diptych': diptych},
+            headers={'If-None-Match': etag},
+        )
+        assert revalidated.status_code == 304
+        assert revalidated.data == b''
+
+        diptych['config']['gap'] = 5
+        changed = client.post(
+            '/get_wysiwyg_preview',
+            json={'diptych': diptych},
+            headers={'If-None-Match': etag},
+        )
+        assert changed.status_code == 200
+        assert changed.headers['ETag'] != etag
+
+
+def test_preview_renders_at_viewport_size(tmp_path):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    img1_path = os.path.join(UPLOAD_DIR, 'vp1.jpg')
+    img2_path = os.path.join(UPLOAD_DIR, 'vp2.jpg')
+    create_image(img1_path, 'yellow')
+    create_image(img2_path, 'cyan')
+    diptych = {
+        'config': {'width': 20, 'height': 16, 'dpi': 300, 'gap': 60, 'border_color': '#000000'},
+        'image1': {'path': img1_path},
+        'image2': {'path': img2_path},
+    }
+
+    with app.test_client() as client:
+        resp = client.post('/get_wysiwyg_preview', json={
+            'diptych': diptych,
+            'viewport': {'width': 300, 'height': 300, 'dpr': 2},
+        })
+        assert resp.status_code == 200
+        preview = Image.open(io.BytesIO(resp.data))
+        assert preview.size == (600, 480)
+        # The 60 px output gap becomes 6 px at this scale, centred on the canvas.
+        assert sum(preview.getpixel((300, 240))) < 60
+        assert sum(preview.getpixel((292, 240))) > 300
+
+        fallback = client.post('/get_wysiwyg_preview', json={'diptych': diptych})
+        assert Image.open(io.BytesIO(fallback.data)).size == (3000, 2400)
+        assert fallback.headers['ETag'] != resp.headers['ETag']
+
+        bad = client.post('/get_wysiwyg_preview', json={
+            'diptych': diptych,
+            'viewport': {'width': 'wide', 'height': 300},
+        })
+        assert bad.status_code == 400
+
+
+class HeldExecutor:
+    """Accepts jobs without running them, like a pool whose workers are busy."""
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self.futures.append((future, fn, args))
+        return future
+
+
+def test_newer_preview_request_cancels_queued_one(tmp_path):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_DIR, 'coalesce.jpg')
+    create_image(path, 'teal')
+    diptych = {'config': {'width': 4, 'height': 3, 'dpi': 10}, 'image1': {'path': path}}
+    request = {'diptych': diptych, 'client_id': 'tab-1', 'target': 'canvas'}
+    held = HeldExecutor()
+
+    with patch.object(app_module, 'preview_executor', held), app.test_client() as client:
+        first = client.post('/request_preview', json=request).get_json()['job_id']
+        other = client.post('/request_preview', json=dict(request, target='tray-0')).get_json()['job_id']
+        latest = client.post('/request_preview', json=request).get_json()['job_id']
+
+        assert held.futures[0][0].cancelled()
+        assert not held.futures[1][0].cancelled()
+        assert client.get(f'/preview_status/{first}').get_json()['status'] == 'cancelled'
+        assert client.get(f'/preview_result/{first}').status_code == 409
+
+        for future, fn, args in held.futures[1:]:
+            fn(*args)
+        assert client.get(f'/preview_status/{other}').get_json()['status'] == 'done'
+        assert client.get(f'/preview_result/{latest}').status_code == 200
+
+        # A finished preview gives up its bytes once it is superseded.
+        newest = client.post('/request_preview', json=request).get_json()['job_id']
+        assert client.get(f'/preview_status/{latest}').get_json()['status'] == 'cancelled'
+        assert app_module.preview_jobs.get_payload(latest) is None
+        assert newest != latest
+
+
+def test_running_preview_stops_between_stages(tmp_path):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_DIR, 'cancelled.jpg')
+    create_image(path, 'olive')
+    diptych = {'config': {'width': 4, 'height': 3, 'dpi': 10}, 'image1': {'path': path}}
+    cancel = threading.Event()
+    running = {'status': 'running', 'cancel': cancel, 'lock': threading.Lock(), 'created_at': 0}
+    newer = {'cancel': threading.Event(), 'lock': threading.Lock(), 'created_at': 0}
+    app_module.supersede_preview(('tab-2', 'canvas'), running)
+    app_module.supersede_preview(('tab-2', 'canvas'), newer)
+    assert cancel.is_set()
+
+    with patch.object(app_module.diptych_creator, 'process_image_pair') as process:
+        with pytest.raises(app_module.PreviewCancelled):
+            app_module.render_diptych_preview(diptych, cancel=cancel)
+    process.assert_not_called()
+    assert app_module.memory_governor.snapshot()['in_use_bytes'] == 0
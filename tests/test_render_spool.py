@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+import app as app_module
+import diptych_creator
+import render_spool
+from app import UPLOAD_DIR, app
+from render_spool import RenderSpool, RenderTaskError, SpoolExecutor
+
+
+def test_workers_claim_oldest_task_once_and_report_outcomes(tmp_path):
+    spool = RenderSpool(str(tmp_path))
+    first = spool.submit('create_diptych', ['a'], job_id='job')
+    second = spool.submit('create_diptych', ['b'])
+    other_worker = RenderSpool(str(tmp_path))
+
+    claim_path, task = spool.claim()
+    assert task['task_id'] == first and task['args'] == ['a']
+    assert other_worker.claim()[1]['task_id'] == second
+    assert other_worker.claim() is None
+
+    assert spool.heartbeat(claim_path)
+    spool.complete(claim_path, task, value='out.jpg')
+    assert not os.path.exists(claim_path)
+    assert spool.finished() == {first}
+    assert spool.take_result(first)['value'] == 'out.jpg'
+    assert spool.take_result(first) is None
+
+
+def test_expired_claims_are_retried_then_failed(tmp_path):
+    spool = RenderSpool(str(tmp_path), lease_seconds=10, max_attempts=2)
+    task_id = spool.submit('create_diptych')
+    claim_path, _ = spool.claim()
+    stale = time.time() - 60
+    os.utime(claim_path, (stale, stale))
+
+    assert spool.reclaim_expired() == 1
+    # The crashed worker's claim is gone, so a late heartbeat notices.
+    assert not spool.heartbeat(claim_path)
+    claim_path, task = spool.claim()
+    assert claim_path.endswith(f'{task_id}.2.json')
+
+    os.utime(claim_path, (stale, stale))
+    assert spool.reclaim_expired() == 1
+    assert spool.claim() is None
+    assert 'abandoned' in spool.take_result(task_id)['error']
+
+
+def test_cancelled_futures_withdraw_waiting_tasks(tmp_path):
+    spool = RenderSpool(str(tmp_path))
+    executor = SpoolExecutor(spool, poll_seconds=0.01)
+    try:
+        with pytest.raises(TypeError):
+            executor.submit(print, 'not a render')
+        future = executor.submit(diptych_creator.create_diptych, None, None, 'out.jpg', [4, 3], 0, 'fill', 10)
+        assert os.listdir(spool.tasks_dir)
+        assert future.cancel()
+        assert os.listdir(spool.tasks_dir) == []
+
+        failing = executor.submit(diptych_creator.create_diptych, None, None, 'out.jpg', [4, 3], 0, 'fill', 10)
+        render_spool.run_task(spool, *spool.claim())
+        with pytest.raises(RenderTaskError, match='At least one image'):
+            failing.result(timeout=5)
+    finally:
+        executor.shutdown()
+
+
+def test_generation_renders_through_spool_workers(tmp_path):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    source = os.path.join(UPLOAD_DIR, 'spooled.jpg')
+    Image.new('RGB', (24, 24), 'orange').save(source)
+    spool_dir = str(tmp_path / 'spool')
+    config = {'width': 4, 'height': 3, 'dpi': 10, 'fit_mode': 'fill'}
+    payload = {
+        'pairs': [{'pair': [{'path': source}, None], 'config': config}] * 2,
+        'zip': False,
+    }
+    stop = threading.Event()
+    worker = threading.Thread(
+        target=render_spool.work, args=(spool_dir,), kwargs={'idle_seconds': 0.02, 'stop': stop},
+    )
+    worker.start()
+    with patch.object(app_module, 'RENDER_SPOOL_DIR', spool_dir), \
+            patch.object(app_module, 'generation_executor', None):
+        try:
+            with app.test_client() as client:
+                job_id = client.post('/generate_diptychs', json=payload).get_json()['job_id']
+                deadline = time.time() + 20
+                while time.time() < deadline:
+                    progress = client.get(f'/get_generation_progress?job_id={job_id}').get_json()
+                    if progress['done']:
+                        break
+                    time.sleep(0.05)
+            assert isinstance(app_module.generation_executor, SpoolExecutor)
+        finally:
+            stop.set()
+            worker.join(timeout=5)
+            if app_module.generation_executor is not None:
+                app_module.generation_executor.shutdown()
+
+    assert progress['error'] is None
+    assert progress['processed'] == 2
+    assert [os.path.basename(path) for path in progress['final_paths']] == ['diptych_1.jpg', 'diptych_2.jpg']
+    assert all(os.path.exists(path) for path in progress['final_paths'])
+    assert os.listdir(os.path.join(spool_dir, 'claims')) == []
+
+
+def test_progress_is_read_back_from_the_spool_after_a_restart(tmp_path):
+    spool_dir = str(tmp_path / 'spool')
+    spool = RenderSpool(spool_dir)
+    executor = SpoolExecutor(spool, poll_seconds=0.01)
+    try:
+        executor.submit(
+            diptych_creator.create_diptych, None, None, 'out.jpg', [4, 3], 0, 'fill', 10,
+            job_id='restarted', item=1,
+        )
+        claim_path, task = spool.claim()
+        assert task['job_id'] == 'restarted' and task['item'] == 1
+        assert 'job_id' not in task['kwargs']
+    finally:
+        executor.shutdown()
+
+    output = tmp_path / 'diptych_1.jpg'
+    output.write_bytes(b'jpeg')
+    first = spool.submit('create_diptych', job_id='restarted', item=0)
+    spool.complete(spool.claim()[0], {'task_id': first, 'job_id': 'restarted', 'item': 0}, value=str(output))
+    spool.complete(claim_path, task, error='Render failed')
+    # The server that submitted the job is gone: its record still shows
+    # nothing settled and no generation task is running for it.
+    app_module.generation_jobs.put('restarted', {
+        'job_id': 'restarted', 'processed': 0, 'total': 2, 'failed': 0, 'errors': [], 'error': None,
+        'final_paths': [], 'should_zip': True, 'stream_zip': False, 'zip_path': None,
+        'spooled': True, 'done': False,
+    })
+    with patch.object(app_module, 'RENDER_SPOOL_DIR', spool_dir):
+        with app.test_client() as client:
+            progress = client.get('/get_generation_progress?job_id=restarted').get_json()
+            finalized = client.get('/finalize_download?job_id=restarted').get_json()
+
+    assert progress['done'] and progress['processed'] == 2 and progress['failed'] == 1
+    assert progress['final_paths'] == [str(output)]
+    assert progress['errors'] == [{'index': 1, 'error': 'Render failed'}]
+    assert finalized['download_url'] == '/stream_zip?job_id=restarted'
+    assert finalized['failed'] == 1
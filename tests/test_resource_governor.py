@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+import app as app_module
+from app import UPLOAD_DIR, app
+from diptych_creator import estimate_render_bytes
+from resource_governor import (
+    PRIORITY_BATCH,
+    PRIORITY_PREVIEW,
+    AdmissionTimeout,
+    MemoryBudgetExceeded,
+    MemoryGovernor,
+    default_worker_count,
+)
+
+
+def test_rejects_job_larger_than_budget():
+    governor = MemoryGovernor(100)
+    with pytest.raises(MemoryBudgetExceeded):
+        governor.acquire(101)
+
+
+def test_waiting_jobs_are_admitted_in_order_and_report_position():
+    governor = MemoryGovernor(100)
+    first = governor.acquire(80, key='first')
+    admitted = []
+
+    def wait_for(key, cost):
+        ticket = governor.acquire(cost, key=key)
+        admitted.append(key)
+        governor.release(ticket)
+
+    big = threading.Thread(target=wait_for, args=('big', 90))
+    big.start()
+    while governor.position('big') is None:
+        time.sleep(0.01)
+    small = threading.Thread(target=wait_for, args=('small', 10))
+    small.start()
+    while governor.position('small') is None:
+        time.sleep(0.01)
+
+    # The small job would fit, but it must not overtake the big one.
+    assert governor.position('big') == 0
+    assert governor.position('small') == 1
+    assert admitted == []
+
+    governor.release(first)
+    big.join(1)
+    small.join(1)
+    assert admitted == ['big', 'small']
+    assert governor.snapshot()['in_use_bytes'] == 0
+
+
+def test_acquire_times_out_and_leaves_queue():
+    governor = MemoryGovernor(10)
+    held = governor.acquire(10)
+    with pytest.raises(AdmissionTimeout):
+        governor.acquire(5, key='late', timeout=0.05)
+    assert governor.position('late') is None
+    governor.release(held)
+
+
+def test_low_memory_estimate_is_bounded_by_strips():
+    full = estimate_render_bytes((24000, 19200), (23000, 18200), [(8000, 6000)] * 2)
+    strips = estimate_render_bytes((24000, 19200), (23000, 18200), [(8000, 6000)] * 2, low_memory=True)
+    assert full > 1024 ** 3 * 2
+    assert strips < full / 5
+
+
+def test_generation_reports_queue_position_while_waiting():
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    source = os.path.join(UPLOAD_DIR, 'queued.jpg')
+    Image.new('RGB', (20, 20), 'red').save(source)
+    governor = MemoryGovernor(10 * 1024 * 1024)
+    blocker = governor.acquire(governor.budget_bytes, key='other')
+    payload = {
+        'pairs': [{'pair': [{'path': source}, None], 'config': {'width': 4, 'height': 3, 'dpi': 10}}],
+        'zip': False,
+    }
+
+    with patch.object(app_module, 'memory_governor', governor), app.test_client() as client:
+        job_id = client.post('/generate_diptychs', json=payload).get_json()['job_id']
+        for _ in range(100):
+            progress = client.get(f'/get_generation_progress?job_id={job_id}').get_json()
+            if progress['queue_position'] is not None:
+                break
+            time.sleep(0.01)
+        assert progress['queue_position'] == 0
+        assert progress['processed'] == 0
+
+        governor.release(blocker)
+        for _ in range(200):
+            progress = client.get(f'/get_generation_progress?job_id={job_id}').get_json()
+            if progress['done']:
+                break
+            time.sleep(0.05)
+
+    assert progress['error'] is None
+    assert progress['queue_position'] is None
+    assert len(progress['final_paths']) == 1
+
+
+class HeldExecutor:
+    """Process pool stand-in whose renders finish when the test says so."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self.submitted.append((future, args[2]))
+        return future
+
+
+def test_queued_batch_items_reserve_memory_only_once_they_can_start():
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    source = os.path.join(UPLOAD_DIR, 'slots.jpg')
+    Image.new('RGB', (20, 20), 'red').save(source)
+    governor = MemoryGovernor(1024 ** 3)
+    executor = HeldExecutor()
+    payload = {
+        'pairs': [{'pair': [{'path': source}, None], 'config': {'width': 4, 'height': 3, 'dpi': 10}}] * 3,
+        'zip': False,
+    }
+
+    with patch.object(app_module, 'memory_governor', governor), \
+            patch.object(app_module, 'generation_slots', threading.Semaphore(1)), \
+            patch.object(app_module, 'get_generation_executor', return_value=executor), \
+            app.test_client() as client:
+        job_id = client.post('/generate_diptychs', json=payload).get_json()['job_id']
+        item_cost = None
+        for expected in range(1, 4):
+            for _ in range(200):
+                if len(executor.submitted) >= expected:
+                    break
+                time.sleep(0.01)
+            time.sleep(0.05)
+            # Only the item that can run holds a reservation.
+            assert len(executor.submitted) == expected
+            item_cost = item_cost or governor.snapshot()['in_use_bytes']
+            assert governor.snapshot()['in_use_bytes'] == item_cost > 0
+            future, path = executor.submitted[-1]
+            Image.new('RGB', (40, 30)).save(path)
+            future.set_result(path)
+        for _ in range(200):
+            progress = client.get(f'/get_generation_progress?job_id={job_id}').get_json()
+            if progress['done']:
+                break
+            time.sleep(0.05)
+
+    assert progress['processed'] == 3 and progress['error'] is None
+
+
+def test_previews_are_admitted_ahead_of_queued_batch_renders():
+    governor = MemoryGovernor(100)
+    held = governor.acquire(100, key='running')
+    admitted = []
+
+    def wait_for(key, priority):
+        ticket = governor.acquire(60, key=key, priority=priority)
+        admitted.append(key)
+        governor.release(ticket)
+
+    batch = threading.Thread(target=wait_for, args=('batch', PRIORITY_BATCH))
+    batch.start()
+    while governor.position('batch') is None:
+        time.sleep(0.01)
+    preview = threading.Thread(target=wait_for, args=('preview', PRIORITY_PREVIEW))
+    preview.start()
+    while governor.position('preview') is None:
+        time.sleep(0.01)
+
+    assert governor.position('preview') == 0
+    assert governor.position('batch') == 1
+    governor.release(held)
+    batch.join(1)
+    preview.join(1)
+    assert admitted == ['preview', 'batch']
+
+
+def test_default_worker_count_is_bounded_by_cpus_and_memory():
+    with patch('os.cpu_count', return_value=8):
+        assert default_worker_count(100, budget_bytes=250) == 2
+        assert default_worker_count(100, budget_bytes=10_000) == 8
+        assert default_worker_count(100, budget_bytes=50) == 1
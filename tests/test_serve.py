@@ -0,0 +1,61 @@
+import json
+import threading
+import urllib.request
+from unittest.mock import patch
+
+import pytest
+
+import app as app_module
+import serve
+
+
+def test_server_options_come_from_the_environment():
+    env = {
+        'DIPTYCH_SERVE_THREADS': '8',
+        'DIPTYCH_SERVE_CONNECTIONS': '50',
+        'DIPTYCH_SERVE_KEEPALIVE_SECONDS': '5',
+        'DIPTYCH_MAX_REQUEST_MB': '0.5',
+    }
+    with patch.dict('os.environ', env):
+        options = serve.server_options()
+    assert options['threads'] == 8
+    assert options['connection_limit'] == 50
+    assert options['channel_timeout'] == 5
+    assert options['max_request_body_size'] == 512 * 1024
+
+
+def test_several_workers_need_shared_state():
+    with patch.dict('os.environ', {'DIPTYCH_SERVE_WORKERS': '4', 'DIPTYCH_STATE_DB': ''}):
+        with pytest.raises(SystemExit, match='DIPTYCH_STATE_DB'):
+            serve.main()
+
+
+def test_workers_split_the_host_pools():
+    with patch.object(app_module, 'SERVE_WORKERS', 4):
+        assert app_module.serve_worker_share(16) == 4
+        assert app_module.serve_worker_share('6') == 1
+        assert app_module.serve_worker_share(2) == 1
+
+
+def test_worker_serves_the_app_after_starting_background_services():
+    sock = serve.bind_socket('127.0.0.1', 0)
+    port = sock.getsockname()[1]
+    with patch.object(app_module, 'start_background_services') as start:
+        server = serve.create_server(sock, dict(serve.server_options(), threads=2))
+    start.assert_called_once_with()
+
+    def run_until_closed():
+        try:
+            server.run()
+        except OSError:
+            pass  # closing the listening socket ends the loop
+
+    thread = threading.Thread(target=run_until_closed, daemon=True)
+    thread.start()
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/cache_stats', timeout=5) as response:
+            assert response.headers['Server'] == 'diptych-creator'
+            assert 'jobs' in json.loads(response.read())
+    finally:
+        server.close()
+        thread.join(timeout=5)
@@ -0,0 +1,124 @@
+import threading
+from datetime import datetime
+
+from state_backend import MemoryBackend, SQLiteBackend, open_backend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_open_backend_defaults_to_process_local_state(tmp_path):
+    assert isinstance(open_backend(None), MemoryBackend)
+    assert isinstance(open_backend(str(tmp_path / 'state.sqlite3')), SQLiteBackend)
+
+
+def test_processes_sharing_a_database_see_each_others_jobs(tmp_path):
+    path = str(tmp_path / 'state.sqlite3')
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+    jobs_here = first.store('jobs', max_entries=10)
+    jobs_there = second.store('jobs', max_entries=10)
+
+    record = {'status': 'pending', 'lock': threading.Lock()}
+    jobs_here.put('a', record)
+    # The creating process keeps its live object; others get the JSON fields.
+    assert jobs_here.get('a') is record
+    assert jobs_there.get('a') == {'status': 'pending'}
+
+    record['status'] = 'done'
+    assert jobs_there.get('a')['status'] == 'pending'
+    assert jobs_here.save('a', record)
+    assert jobs_there.get('a') == {'status': 'done'}
+
+    assert jobs_here.set_payload('a', b'jpeg')
+    assert jobs_there.get_payload('a') == b'jpeg'
+    jobs_there.drop_payload('a')
+    assert jobs_here.get_payload('a') is None
+
+    assert jobs_there.pop('a') == {'status': 'done'}
+    assert 'a' not in jobs_there
+    assert jobs_there.save('a', record) is False
+    first.close()
+    second.close()
+
+
+def test_shared_values_and_mappings(tmp_path):
+    path = str(tmp_path / 'state.sqlite3')
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+    first.set_value('diptych_order', [{'image1': 'a.jpg', 'image2': 'b.jpg'}])
+    assert second.get_value('diptych_order') == [{'image1': 'a.jpg', 'image2': 'b.jpg'}]
+    assert second.get_value('missing', []) == []
+
+    times = first.mapping('upload_times', encode=datetime.timestamp, decode=datetime.fromtimestamp)
+    other = second.mapping('upload_times', encode=datetime.timestamp, decode=datetime.fromtimestamp)
+    uploaded = datetime(2024, 5, 1, 12, 30)
+    times['a.jpg'] = uploaded
+    assert 'a.jpg' in other and other['a.jpg'] == uploaded
+    assert list(other) == ['a.jpg'] and len(other) == 1
+    assert other.pop('a.jpg') == uploaded
+    assert 'a.jpg' not in times
+    times['b.jpg'] = uploaded
+    times.clear()
+    assert len(other) == 0
+
+
+def test_shared_limits_spare_unfinished_jobs(tmp_path):
+    clock = FakeClock()
+    backend = SQLiteBackend(str(tmp_path / 'state.sqlite3'))
+    jobs = backend.store(
+        'jobs', max_entries=2, ttl_seconds=60, clock=clock,
+        evictable=lambda record: record['done'],
+    )
+    jobs.put('running', {'done': False})
+    clock.now += 1
+    jobs.put('old', {'done': True})
+    clock.now += 1
+    jobs.put('new', {'done': True})
+    assert [key for key, _ in jobs.items()] == ['running', 'new']
+
+    clock.now += 120
+    assert jobs.purge() == 1
+    assert [key for key, _ in jobs.items()] == ['running']
+    assert jobs.stats()['entries'] == 1
+    backend.close()
+
+
+def test_saving_some_fields_leaves_the_rest_of_the_shared_record(tmp_path):
+    path = str(tmp_path / 'state.sqlite3')
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+    jobs_here = first.store('jobs', max_entries=10)
+    jobs_there = second.store('jobs', max_entries=10)
+    record = {'processed': 0, 'error': None, 'final_paths': []}
+    jobs_here.put('a', record)
+
+    record['processed'] = 2
+    record['error'] = 'bad "input"'
+    record['final_paths'] = ['one.jpg', 'two.jpg']
+    assert jobs_here.save('a', record, fields=('processed', 'error'))
+    assert jobs_there.get('a') == {'processed': 2, 'error': 'bad "input"', 'final_paths': []}
+    assert jobs_here.save('a', record)
+    assert jobs_there.get('a')['final_paths'] == ['one.jpg', 'two.jpg']
+    first.close()
+    second.close()
+
+
+def test_mappings_modify_values_in_place(tmp_path):
+    path = str(tmp_path / 'state.sqlite3')
+    backends = [MemoryBackend(), SQLiteBackend(path), SQLiteBackend(path)]
+    sessions = [
+        backend.mapping('sessions', encode=sorted, decode=set)
+        for backend in backends
+    ]
+    for mapping in sessions[:2]:
+        mapping['a'] = set()
+        assert mapping.modify('a', lambda received: received | {1}) == {1}
+        assert mapping.modify('missing', lambda received: received | {1}) is None
+    sessions[2].modify('a', lambda received: received | {2})
+    assert sessions[0]['a'] == {1}
+    assert sessions[1]['a'] == {1, 2}
+    for backend in backends:
+        backend.close()
@@ -0,0 +1,281 @@
+import hashlib
+import io
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+import app as app_module
+from app import (
+    OBJECT_DIR,
+    ORPHAN_GRACE_SECONDS,
+    THUMB_CACHE_DIR,
+    UPLOAD_DIR,
+    app,
+    cleanup_stored_files,
+    proxy_level_paths,
+)
+
+
+class InlineExecutor:
+    def submit(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+
+def clear_dir(path):
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        full_path = os.path.join(path, name)
+        if os.path.isfile(full_path) or os.path.islink(full_path):
+            os.remove(full_path)
+
+
+def jpeg_bytes(color, size=(1200, 800)):
+    buf = io.BytesIO()
+    Image.new('RGB', size, color).save(buf, format='JPEG')
+    return buf.getvalue()
+
+
+def upload(client, *files):
+    response = client.post(
+        '/upload_images',
+        data={'files[]': [(io.BytesIO(data), name) for name, data in files]},
+        content_type='multipart/form-data',
+    )
+    return response.get_json()['uploaded']
+
+
+def setup_function():
+    for directory in (UPLOAD_DIR, THUMB_CACHE_DIR, OBJECT_DIR, app_module.UPLOAD_SESSION_DIR):
+        clear_dir(directory)
+
+
+def test_duplicate_uploads_share_one_stored_copy():
+    data = jpeg_bytes('green')
+    other = jpeg_bytes('red')
+    with patch.object(app_module, 'ingest_executor', InlineExecutor()):
+        with app.test_client() as client:
+            assert upload(client, ('card.jpg', data)) == ['card.jpg']
+            # Same name and bytes: the existing upload is reused, no card_1.
+            assert upload(client, ('card.jpg', data)) == ['card.jpg']
+            with patch.object(Image, 'open', side_effect=AssertionError('decoded again')):
+                assert upload(client, ('copy.jpg', data)) == ['copy.jpg']
+            # Same name, different bytes: a new name.
+            assert upload(client, ('card.jpg', other)) == ['card_1.jpg']
+
+    assert sorted(os.listdir(OBJECT_DIR)) == sorted(
+        [hashlib.sha256(data).hexdigest(), hashlib.sha256(other).hexdigest()]
+    )
+    card = os.path.join(UPLOAD_DIR, 'card.jpg')
+    copy = os.path.join(UPLOAD_DIR, 'copy.jpg')
+    assert os.path.samefile(card, copy)
+    assert os.path.samefile(card, os.path.join(OBJECT_DIR, hashlib.sha256(data).hexdigest()))
+    # Derived files are linked rather than regenerated.
+    assert os.path.samefile(proxy_level_paths('card.jpg')[300], proxy_level_paths('copy.jpg')[300])
+    assert os.path.samefile(proxy_level_paths('card.jpg')[1024], proxy_level_paths('copy.jpg')[1024])
+    assert app_module.image_index.get('copy.jpg')['width'] == 1200
+
+
+def test_check_uploads_registers_known_content_without_bytes():
+    data = jpeg_bytes('blue')
+    with patch.object(app_module, 'ingest_executor', InlineExecutor()):
+        with app.test_client() as client:
+            upload(client, ('first.jpg', data))
+            response = client.post('/check_uploads', json={'files': [
+                {'name': 'again.jpg', 'size': len(data), 'sha256': hashlib.sha256(data).hexdigest()},
+                {'name': 'new.jpg', 'size': 5, 'sha256': hashlib.sha256(b'other').hexdigest()},
+                {'name': 'bad.txt', 'size': len(data), 'sha256': hashlib.sha256(data).hexdigest()},
+                # The digest alone is not enough to claim stored content.
+                {'name': 'guess.jpg', 'sha256': hashlib.sha256(data).hexdigest()},
+                {'name': 'wrong.jpg', 'size': len(data) + 1, 'sha256': hashlib.sha256(data).hexdigest()},
+            ]})
+
+    assert response.get_json() == {'uploaded': ['again.jpg'], 'missing': [1, 2, 3, 4]}
+    assert os.path.samefile(os.path.join(UPLOAD_DIR, 'again.jpg'), os.path.join(UPLOAD_DIR, 'first.jpg'))
+    assert os.path.exists(proxy_level_paths('again.jpg')[300])
+
+
+def test_cleanup_removes_objects_without_aliases():
+    data = jpeg_bytes('white', size=(20, 20))
+    with patch.object(app_module, 'ingest_executor', InlineExecutor()):
+        with app.test_client() as client:
+            upload(client, ('keep.jpg', data))
+    stored = os.path.join(OBJECT_DIR, hashlib.sha256(data).hexdigest())
+    thumb = proxy_level_paths('keep.jpg')[300]
+
+    cleanup_stored_files(time.time() + ORPHAN_GRACE_SECONDS + 1)
+    assert os.path.exists(stored) and os.path.exists(thumb)
+
+    os.remove(os.path.join(UPLOAD_DIR, 'keep.jpg'))
+    cleanup_stored_files(time.time() + ORPHAN_GRACE_SECONDS + 1)
+    assert not os.path.exists(stored)
+    assert not os.path.exists(thumb)
+
+
+def test_chunked_upload_accepts_chunks_out_of_order_and_resumes():
+    data = jpeg_bytes('purple', size=(300, 200))
+    with patch.object(app_module, 'ingest_executor', InlineExecutor()), \
+            patch.object(app_module, 'UPLOAD_CHUNK_BYTES', 1000):
+        with app.test_client() as client:
+            created = client.post('/upload_sessions', json={'name': 'scan.tif', 'size': len(data)})
+            assert created.status_code == 201
+            session = created.get_json()
+            upload_id, chunks = session['upload_id'], session['chunks']
+            assert chunks == -(-len(data) // 1000)
+
+            def put(index, body=None):
+                body = data[index * 1000:(index + 1) * 1000] if body is None else body
+                return client.put(f'/upload_sessions/{upload_id}/chunks/{index}', data=body)
+
+            for index in reversed(range(1, chunks)):
+                assert put(index).status_code == 200
+            assert put(0, b'short').status_code == 400
+
+            # The client lost track; the session says what is still missing.
+            status = client.get(f'/upload_sessions/{upload_id}').get_json()
+            assert status['received'] == list(range(1, chunks))
+            incomplete = client.post(f'/upload_sessions/{upload_id}/complete')
+            assert incomplete.status_code == 409
+            assert incomplete.get_json()['missing'] == [0]
+
+            assert put(0).status_code == 200
+            done = client.post(f'/upload_sessions/{upload_id}/complete')
+            assert done.get_json() == {'filename': 'scan.tif'}
+            assert client.get(f'/upload_sessions/{upload_id}').status_code == 404
+
+            # Known content skips the session entirely.
+            again = client.post('/upload_sessions', json={
+                'name': 'again.tif',
+                'size': len(data),
+                'sha256': hashlib.sha256(data).hexdigest(),
+            })
+            assert again.get_json() == {'filename': 'again.tif'}
+            # A matching digest with the wrong size starts a normal session.
+            mismatched = client.post('/upload_sessions', json={
+                'name': 'other.tif',
+                'size': len(data) - 1,
+                'sha256': hashlib.sha256(data).hexdigest(),
+            }).get_json()
+            assert 'upload_id' in mismatched and 'filename' not in mismatched
+            with app_module.upload_sessions_lock:
+                os.remove(app_module.upload_sessions.pop(mismatched['upload_id'])['path'])
+
+    with open(os.path.join(UPLOAD_DIR, 'scan.tif'), 'rb') as stored:
+        assert stored.read() == data
+    assert os.path.exists(proxy_level_paths('scan.tif')[300])
+    assert os.listdir(app_module.UPLOAD_SESSION_DIR) == []
+
+
+def test_chunked_upload_rejects_unreadable_files():
+    with app.test_client() as client:
+        assert client.post('/upload_sessions', json={'name': 'notes.txt', 'size': 4}).status_code == 400
+        session = client.post('/upload_sessions', json={'name': 'fake.jpg', 'size': 4}).get_json()
+        client.put(f"/upload_sessions/{session['upload_id']}/chunks/0", data=b'nope')
+        response = client.post(f"/upload_sessions/{session['upload_id']}/complete")
+    assert response.status_code == 400
+    assert not os.path.exists(os.path.join(OBJECT_DIR, hashlib.sha256(b'nope').hexdigest()))
+
+
+def test_chunked_upload_rejects_oversized_announcements():
+    before = set(os.listdir(app_module.UPLOAD_SESSION_DIR))
+    with app.test_client() as client:
+        response = client.post('/upload_sessions', json={
+            'name': 'huge.tif', 'size': app_module.MAX_UPLOAD_BYTES + 1,
+        })
+    assert response.status_code == 413
+    assert set(os.listdir(app_module.UPLOAD_SESSION_DIR)) == before
+
+
+def test_local_files_are_registered_in_place(tmp_path):
+    library = tmp_path / 'library'
+    (library / 'day2').mkdir(parents=True)
+    (library / 'a.jpg').write_bytes(jpeg_bytes('red', size=(400, 300)))
+    (library / 'notes.txt').write_text('skip me')
+    (library / 'day2' / 'b.jpg').write_bytes(jpeg_bytes('blue', size=(300, 400)))
+    outside = tmp_path / 'outside.jpg'
+    outside.write_bytes(jpeg_bytes('green'))
+
+    with patch.object(app_module, 'ingest_executor', InlineExecutor()), \
+            patch.object(app_module, 'LIBRARY_DIRS', [os.path.realpath(library)]):
+        with app.test_client() as client:
+            response = client.post('/register_local_files', json={'paths': [str(library)], 'recursive': True})
+            assert response.get_json() == {'uploaded': ['a.jpg', 'b.jpg']}
+            # Registering again reuses the names instead of adding copies.
+            again = client.post('/register_local_files', json={'paths': [str(library / 'a.jpg')]})
+            assert again.get_json() == {'uploaded': ['a.jpg']}
+            for escape in (str(outside), str(library / '..' / 'outside.jpg')):
+                rejected = client.post('/register_local_files', json={'paths': [escape]})
+                assert rejected.status_code == 400
+            assert client.get('/thumbnail/a.jpg').status_code == 200
+
+    link = os.path.join(UPLOAD_DIR, 'a.jpg')
+    assert os.path.islink(link)
+    assert os.path.samefile(link, library / 'a.jpg')
+    assert os.listdir(OBJECT_DIR) == []
+    assert app_module.image_index.get('b.jpg')['width'] == 300
+
+    # Without the allow-list the same reference is refused.
+    with patch.object(app_module, 'LIBRARY_DIRS', []):
+        with app.test_client() as client:
+            assert client.post('/register_local_files', json={'paths': [str(library)]}).status_code == 403
+        with pytest.raises(ValueError):
+            app_module.resolve_uploaded_image({'path': 'a.jpg'})
+
+
+def test_local_files_are_hard_linked_without_symlink_support(tmp_path):
+    source = tmp_path / 'shot.jpg'
+    source.write_bytes(jpeg_bytes('red', size=(400, 300)))
+    with patch.object(app_module, 'ingest_executor', InlineExecutor()), \
+            patch.object(app_module, 'LIBRARY_DIRS', [os.path.realpath(tmp_path)]), \
+            patch.object(app_module.os, 'symlink', side_effect=OSError('symbolic links are not permitted')):
+        assert app_module.register_reference(str(source)) == 'shot.jpg'
+        assert app_module.register_reference(str(source)) == 'shot.jpg'
+        link = os.path.join(UPLOAD_DIR, 'shot.jpg')
+        assert not os.path.islink(link)
+        assert os.path.samefile(link, source)
+        assert app_module.resolve_uploaded_image({'path': 'shot.jpg'}, with_proxies=True)['proxies']
+
+        # Saving by replacing the file is picked up as a symlink would be.
+        replacement = tmp_path / 'shot.tmp'
+        replacement.write_bytes(jpeg_bytes('blue', size=(300, 400)))
+        os.replace(replacement, source)
+        assert app_module.resolve_uploaded_image({'path': 'shot.jpg'}, with_proxies=True)['proxies'] == []
+        assert os.path.samefile(link, source)
+        assert app_module.image_index.get('shot.jpg')['width'] == 300
+
+        with patch.object(app_module, 'LIBRARY_DIRS', []):
+            with pytest.raises(ValueError):
+                app_module.resolve_uploaded_image({'path': 'shot.jpg'})
+
+    source.unlink()
+    cleanup_stored_files(time.time())
+    assert not os.path.lexists(os.path.join(UPLOAD_DIR, 'shot.jpg'))
+    assert 'shot.jpg' not in app_module.REFERENCE_SOURCES
+
+
+def test_changed_local_file_is_reingested(tmp_path):
+    source = tmp_path / 'shot.jpg'
+    source.write_bytes(jpeg_bytes('red', size=(400, 300)))
+    with patch.object(app_module, 'ingest_executor', InlineExecutor()), \
+            patch.object(app_module, 'LIBRARY_DIRS', [os.path.realpath(tmp_path)]):
+        assert app_module.register_reference(str(source)) == 'shot.jpg'
+        before = app_module.preview_cache_key({'image1': {'path': 'shot.jpg'}})
+        assert app_module.resolve_uploaded_image({'path': 'shot.jpg'}, with_proxies=True)['proxies']
+
+        source.write_bytes(jpeg_bytes('blue', size=(300, 400)))
+        os.utime(source, ns=(time.time_ns(), time.time_ns() + 10**9))
+        # The stale proxies are skipped while the file is ingested again.
+        assert app_module.resolve_uploaded_image({'path': 'shot.jpg'}, with_proxies=True)['proxies'] == []
+        assert app_module.resolve_uploaded_image({'path': 'shot.jpg'}, with_proxies=True)['proxies']
+        assert app_module.preview_cache_key({'image1': {'path': 'shot.jpg'}}) != before
+
+    assert app_module.image_index.get('shot.jpg')['width'] == 300
+    with Image.open(proxy_level_paths('shot.jpg')[300]) as thumb:
+        assert thumb.size[0] < thumb.size[1]
+
+    source.unlink()
+    cleanup_stored_files(time.time())
+    assert not os.path.lexists(os.path.join(UPLOAD_DIR, 'shot.jpg'))
+    assert app_module.image_index.get('shot.jpg') is None